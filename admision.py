@@ -0,0 +1,264 @@
+"""
+Control de admisión: que unos cuantos PDF/Excel de varios años no saturen el executor ni
+MySQL y dejen a las cajas esperando /recibos/hoy.
+
+  - Cada ruta cara (registrar_ruta: consultas de intervalo, exportaciones, reportes directos)
+    tiene su límite de peticiones simultáneas y una cola de espera acotada. Con la cola llena,
+    o tras ADMISION_ESPERA segundos en ella, se responde 503 con Retry-After.
+  - Todas las rutas caras comparten además ADMISION_PESADAS turnos (por defecto DB_POOL_SIZE
+    menos ADMISION_RESERVA), así que siempre quedan conexiones e hilos para las baratas, que no
+    pasan por aquí. En esa cola común una consulta va antes que un reporte o una exportación.
+  - Presupuesto de filas por petición (FILAS_MAX_JSON, FILAS_MAX_PDF, FILAS_MAX_EXCEL; 0 = sin
+    límite): main lo compara con el COUNT de la versión del rango antes de leerlo y responde 413
+    con las alternativas (ndjson, paginación, CSV o POST /reportes).
+
+El tiempo máximo de cada SELECT (MAX_EXECUTION_TIME; max_statement_time en MariaDB) lo pone
+pool.conexion. En curso, en cola y rechazos por ruta en GET /admision y /metrics.
+ADMISION_ENABLED=0 lo desactiva.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+from starlette.responses import JSONResponse
+
+from metricas import etapa
+
+
+class AdmisionRechazada(Exception):
+    """No hubo turno para la petición: cola llena o se agotó la espera."""
+
+
+class PresupuestoExcedido(Exception):
+    """El intervalo tiene más filas de las que se permiten en una sola respuesta."""
+
+    def __init__(self, filas, maximo, alternativas):
+        super().__init__(
+            f"El intervalo tiene {filas} filas y el máximo por respuesta es {maximo}; "
+            "use la descarga en streaming o un reporte en segundo plano"
+        )
+        self.filas = filas
+        self.maximo = maximo
+        self.alternativas = alternativas
+
+
+class Clase:
+    """
+    Límites por defecto de las rutas de una clase; `prioridad` menor pasa primero en la cola común.
+    ADMISION_{CLASE}_LIMITE y ADMISION_{CLASE}_COLA se leen al registrar cada ruta, no al importar:
+    main carga .env después de importar este módulo.
+    """
+
+    def __init__(self, nombre, prioridad, limite, cola):
+        self.nombre = nombre
+        self.prioridad = prioridad
+        self._limite = limite
+        self._cola = cola
+
+    @property
+    def limite(self) -> int:
+        return int(os.getenv(f"ADMISION_{self.nombre.upper()}_LIMITE", str(self._limite)))
+
+    @property
+    def cola(self) -> int:
+        return int(os.getenv(f"ADMISION_{self.nombre.upper()}_COLA", str(self._cola)))
+
+
+class Limitador:
+    """
+    Semáforo del event loop con cola de espera acotada y por prioridad. Al salir, el turno pasa
+    directo al primero de la cola (menor prioridad, luego el más antiguo) sin volver a competir.
+    """
+
+    def __init__(self, limite, cola):
+        self.limite = limite
+        self.cola = cola
+        self.en_curso = 0
+        self.en_cola = 0
+        self._esperando = []
+        self._orden = itertools.count()
+
+        self.admitidas = 0
+        self.rechazos_cola = 0
+        self.rechazos_espera = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    async def entrar(self, prioridad=0, espera=10.0):
+        if self.en_curso < self.limite and not self.en_cola:
+            self.en_curso += 1
+            self.admitidas += 1
+            return
+        if self.en_cola >= self.cola:
+            self.rechazos_cola += 1
+            raise AdmisionRechazada("Cola de espera llena")
+
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._esperando, (prioridad, next(self._orden), futuro))
+        self.en_cola += 1
+        inicio = time.monotonic()
+        try:
+            await asyncio.wait_for(futuro, espera)
+        except asyncio.TimeoutError:
+            self.rechazos_espera += 1
+            raise AdmisionRechazada(f"Sin turno tras {espera:g}s") from None
+        except BaseException:
+            # Cancelada justo después de recibir el turno: se lo pasa al siguiente
+            if futuro.done() and not futuro.cancelled():
+                self.salir()
+            raise
+        finally:
+            self.en_cola -= 1
+        esperado = time.monotonic() - inicio
+        self.admitidas += 1
+        self.espera_total += esperado
+        self.espera_max = max(self.espera_max, esperado)
+
+    def salir(self):
+        while self._esperando:
+            _, _, futuro = heapq.heappop(self._esperando)
+            # Las que ya se rindieron (timeout o desconexión) quedan canceladas en el heap
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.en_curso -= 1
+
+    def estadisticas(self) -> dict:
+        return {
+            "limite": self.limite,
+            "cola": self.cola,
+            "en_curso": self.en_curso,
+            "en_cola": self.en_cola,
+            "admitidas": self.admitidas,
+            "rechazos_cola": self.rechazos_cola,
+            "rechazos_espera": self.rechazos_espera,
+            "espera_promedio_ms": round(self.espera_total / self.admitidas * 1000, 3) if self.admitidas else 0.0,
+            "espera_max_ms": round(self.espera_max * 1000, 3),
+        }
+
+
+CLASES = {
+    "consulta": Clase("consulta", prioridad=1, limite=4, cola=16),
+    "exportacion": Clase("exportacion", prioridad=2, limite=2, cola=4),
+    "reporte": Clase("reporte", prioridad=2, limite=2, cola=4),
+}
+
+
+class ControlAdmision:
+    def __init__(self, pesadas, cola, espera):
+        self.espera = espera
+        self.pesadas = Limitador(pesadas, cola)
+        # ruta -> (clase, limitador)
+        self.rutas = {}
+        self.rechazos_presupuesto = 0
+
+    def registrar_ruta(self, ruta, clase):
+        clase = CLASES[clase]
+        self.rutas[ruta] = (clase, Limitador(clase.limite, clase.cola))
+
+    async def entrar(self, ruta):
+        """Turno de la ruta y luego uno de la cola común; la espera total no pasa de `self.espera`."""
+        clase, limitador = self.rutas[ruta]
+        limite = time.monotonic() + self.espera
+        await limitador.entrar(clase.prioridad, self.espera)
+        try:
+            await self.pesadas.entrar(clase.prioridad, max(limite - time.monotonic(), 0.001))
+        except BaseException:
+            limitador.salir()
+            raise
+
+    def salir(self, ruta):
+        self.pesadas.salir()
+        self.rutas[ruta][1].salir()
+
+    def verificar_filas(self, filas, representacion, alternativas):
+        maximo = presupuesto_filas(representacion)
+        if maximo and filas > maximo:
+            self.rechazos_presupuesto += 1
+            raise PresupuestoExcedido(filas, maximo, alternativas)
+
+    def estadisticas(self) -> dict:
+        rutas = {}
+        for ruta, (clase, limitador) in self.rutas.items():
+            # Llave sin "/" para que /metrics la pueda usar como nombre de gauge
+            rutas[ruta.strip("/").replace("/", "_")] = dict(limitador.estadisticas(), ruta=ruta, clase=clase.nombre)
+        return {
+            "habilitado": habilitado(),
+            "pesadas": self.pesadas.estadisticas(),
+            "rutas": rutas,
+            "en_cola": self.pesadas.en_cola + sum(l.en_cola for _, l in self.rutas.values()),
+            "rechazos": sum(l.rechazos_cola + l.rechazos_espera for l in [self.pesadas] + [l for _, l in self.rutas.values()]),
+            "rechazos_presupuesto": self.rechazos_presupuesto,
+            "presupuesto_filas": {r: presupuesto_filas(r) for r in PRESUPUESTOS},
+        }
+
+
+# representación -> (variable de entorno, valor por defecto)
+PRESUPUESTOS = {
+    "json": ("FILAS_MAX_JSON", 50000),
+    "pdf": ("FILAS_MAX_PDF", 20000),
+    "excel": ("FILAS_MAX_EXCEL", 200000),
+}
+
+
+def presupuesto_filas(representacion) -> int:
+    variable, defecto = PRESUPUESTOS[representacion]
+    return int(os.getenv(variable, str(defecto)))
+
+
+def habilitado() -> bool:
+    return os.getenv("ADMISION_ENABLED", "1") != "0"
+
+
+_control = None
+
+
+def obtener_control() -> ControlAdmision:
+    global _control
+    if _control is None:
+        # Sólo se usa desde el event loop: no hace falta candado
+        reserva = int(os.getenv("ADMISION_RESERVA", "2"))
+        pesadas = int(os.getenv("ADMISION_PESADAS", str(max(1, int(os.getenv("DB_POOL_SIZE", "10")) - reserva))))
+        _control = ControlAdmision(
+            pesadas=pesadas,
+            cola=int(os.getenv("ADMISION_COLA", "32")),
+            espera=float(os.getenv("ADMISION_ESPERA", "10")),
+        )
+    return _control
+
+
+def registrar_ruta(ruta, clase):
+    """`clase` es "consulta", "exportacion" o "reporte"; las rutas sin registrar no esperan turno."""
+    obtener_control().registrar_ruta(ruta, clase)
+
+
+class MiddlewareAdmision:
+    """Pide turno antes de atender las rutas registradas y lo libera al enviar el último byte."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        control = obtener_control()
+        ruta = scope.get("path") if scope["type"] == "http" else None
+        if ruta not in control.rutas or not habilitado():
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            with etapa("admision"):
+                await control.entrar(ruta)
+        except AdmisionRechazada as exc:
+            respuesta = JSONResponse(
+                status_code=503,
+                content={"detail": f"Demasiadas peticiones a {ruta} en curso ({exc}); intente de nuevo en unos segundos"},
+                headers={"Retry-After": "5"},
+            )
+            await respuesta(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            control.salir(ruta)
@@ -0,0 +1,242 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import rollup
+from metricas import etapa
+from pool import conexion
+
+
+class CacheAgregados:
+    """
+    Totales de TEARMO01 por día (y por cuenta para el despliegue). Los días cerrados casi nunca
+    cambian, así que un intervalo se arma sumando cubetas diarias en memoria y sólo se consulta
+    MySQL por los días que faltan o que siguen abiertos (hoy en adelante).
+    """
+
+    def __init__(self, max_dias=5000, dias_abiertos=1):
+        self.max_dias = max_dias
+        self.dias_abiertos = dias_abiertos
+        self._cubetas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.dias_desde_resumen = 0
+
+    # ---------- días ----------
+    def _dias(self, desde, hasta):
+        inicio = datetime.strptime(desde, "%y%m%d").date()
+        fin = datetime.strptime(hasta, "%y%m%d").date()
+        return [(inicio + timedelta(days=i)).strftime("%y%m%d") for i in range((fin - inicio).days + 1)]
+
+    def _cerrado(self, dia):
+        limite = (datetime.now().date() - timedelta(days=self.dias_abiertos - 1)).strftime("%y%m%d")
+        return dia < limite
+
+    @staticmethod
+    def _tramos(dias):
+        """Agrupa días consecutivos (ya ordenados) en tramos (desde, hasta) para consultarlos con BETWEEN."""
+        tramos = []
+        for dia in dias:
+            anterior = _dia_anterior(dia)
+            if tramos and tramos[-1][1] == anterior:
+                tramos[-1][1] = dia
+            else:
+                tramos.append([dia, dia])
+        return tramos
+
+    # ---------- cubetas ----------
+    def _leer(self, tipo, dias):
+        encontradas, faltantes = {}, []
+        with self._lock:
+            for dia in dias:
+                llave = (tipo, dia)
+                if llave in self._cubetas:
+                    self._cubetas.move_to_end(llave)
+                    encontradas[dia] = self._cubetas[llave]
+                    self.aciertos += 1
+                else:
+                    faltantes.append(dia)
+                    self.fallos += 1
+        return encontradas, faltantes
+
+    def _guardar(self, tipo, cubetas):
+        if self.max_dias <= 0:
+            return
+        with self._lock:
+            for dia, valor in cubetas.items():
+                if not self._cerrado(dia):
+                    continue
+                self._cubetas[(tipo, dia)] = valor
+                self._cubetas.move_to_end((tipo, dia))
+            while len(self._cubetas) > self.max_dias:
+                self._cubetas.popitem(last=False)
+                self.desalojos += 1
+
+    def _cubetas_de(self, tipo, desde, hasta, consultar, cursor=None):
+        dias = self._dias(desde, hasta)
+        encontradas, faltantes = self._leer(tipo, dias)
+        if faltantes:
+            nuevas = {dia: consultar.vacia() for dia in faltantes}
+            with _cursor(cursor) as cursor:
+                # Los días que cubre la tabla resumen (si está vigente) se leen de ahí
+                corte = rollup.corte_vigente(cursor)
+                for tramo_desde, tramo_hasta in self._tramos(faltantes):
+                    if corte and tramo_desde < corte:
+                        fin_resumen = min(tramo_hasta, _dia_anterior(corte))
+                        consultar.llenar(rollup_consulta[tipo](cursor, tramo_desde, fin_resumen), nuevas)
+                        with self._lock:
+                            self.dias_desde_resumen += len(self._dias(tramo_desde, fin_resumen))
+                        tramo_desde = max(tramo_desde, corte)
+                    if tramo_desde <= tramo_hasta:
+                        consultar.llenar(consultar.directo(cursor, tramo_desde, tramo_hasta), nuevas)
+            self._guardar(tipo, nuevas)
+            encontradas.update(nuevas)
+        return [encontradas[dia] for dia in dias]
+
+    # ---------- API ----------
+    def totales(self, desde, hasta, cursor=None) -> dict:
+        total_neto, total_descuento, cancelados = 0, 0, 0
+        for neto, descuento, cantidad in self._cubetas_de("totales", desde, hasta, _ConsultaTotales(), cursor):
+            total_neto += neto
+            total_descuento += descuento
+            cancelados += cantidad
+        return {
+            "total_neto": float(total_neto),
+            "total_descuento": float(total_descuento),
+            "cantidad_status_1": int(cancelados)
+        }
+
+    def despliegue(self, desde, hasta, cursor=None) -> list:
+        por_cuenta = {}
+        for cubeta in self._cubetas_de("despliegue", desde, hasta, _ConsultaDespliegue(), cursor):
+            for cuenta, (neto, descuento, cantidad) in cubeta.items():
+                acumulado = por_cuenta.setdefault(cuenta, [0, 0, 0])
+                acumulado[0] += neto
+                acumulado[1] += descuento
+                acumulado[2] += cantidad
+        return [
+            {
+                "cuenta": cuenta,
+                "total_neto": float(neto),
+                "total_descuento": float(descuento),
+                "cantidad_recibos": int(cantidad)
+            }
+            for cuenta, (neto, descuento, cantidad) in sorted(por_cuenta.items())
+        ]
+
+    def invalidar(self, desde=None, hasta=None):
+        """Descarta las cubetas del intervalo (o todas), p. ej. tras corregir o cancelar recibos viejos."""
+        with self._lock:
+            if desde is None and hasta is None:
+                self._cubetas.clear()
+                return
+            for llave in [k for k in self._cubetas if (desde is None or k[1] >= desde) and (hasta is None or k[1] <= hasta)]:
+                del self._cubetas[llave]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "dias_en_cache": len(self._cubetas),
+                "max_dias": self.max_dias,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "dias_desde_resumen": self.dias_desde_resumen,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+            }
+
+
+@contextmanager
+def _cursor(cursor=None):
+    """El cursor que ya trae quien llama (p. ej. el tablero, todo en una conexión) o uno nuevo del pool."""
+    if cursor is not None:
+        yield cursor
+        return
+    with conexion() as conn:
+        yield conn.cursor()
+
+
+def _dia_anterior(dia):
+    return (datetime.strptime(dia, "%y%m%d") - timedelta(days=1)).strftime("%y%m%d")
+
+
+class _ConsultaTotales:
+    def vacia(self):
+        return (0, 0, 0)
+
+    def directo(self, cursor, desde, hasta):
+        with etapa("consulta"):
+            cursor.execute("""
+                SELECT
+                    id_fecha,
+                    COALESCE(SUM(CASE WHEN id_status = 0 THEN id_neto ELSE 0 END), 0) AS total_neto,
+                    COALESCE(SUM(CASE WHEN id_status = 0 THEN id_descuento ELSE 0 END), 0) AS total_descuento,
+                    SUM(CASE WHEN id_status = 1 THEN 1 ELSE 0 END) AS cantidad_status_1
+                FROM TEARMO01
+                WHERE id_fecha BETWEEN %s AND %s
+                GROUP BY id_fecha
+            """, (desde, hasta))
+        with etapa("fetch"):
+            return cursor.fetchall()
+
+    def llenar(self, filas, cubetas):
+        for dia, neto, descuento, cancelados in filas:
+            if dia in cubetas:
+                cubetas[dia] = (neto, descuento, int(cancelados or 0))
+
+
+class _ConsultaDespliegue:
+    def vacia(self):
+        return {}
+
+    def directo(self, cursor, desde, hasta):
+        with etapa("consulta"):
+            cursor.execute("""
+                SELECT
+                    m.id_fecha,
+                    c.id_nombrecuenta,
+                    COALESCE(SUM(m.id_neto), 0) AS total_neto,
+                    COALESCE(SUM(m.id_descuento), 0) AS total_descuento,
+                    COUNT(*) AS cantidad_recibos
+                FROM TEARMO01 m
+                JOIN TEARCA01 c ON m.id_cuenta = c.id_codigoc
+                WHERE m.id_fecha BETWEEN %s AND %s
+                AND m.id_status = 0
+                GROUP BY m.id_fecha, c.id_nombrecuenta
+            """, (desde, hasta))
+        with etapa("fetch"):
+            return cursor.fetchall()
+
+    def llenar(self, filas, cubetas):
+        for dia, cuenta, neto, descuento, cantidad in filas:
+            if dia in cubetas:
+                cubetas[dia][cuenta] = (neto, descuento, int(cantidad))
+
+
+rollup_consulta = {
+    "totales": rollup.totales_por_dia,
+    "despliegue": rollup.despliegue_por_dia,
+}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache() -> CacheAgregados:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                # AGREGADOS_CACHE=0 no guarda cubetas, pero sigue usando la tabla resumen
+                guardar = os.getenv("AGREGADOS_CACHE", "1") == "1"
+                _cache = CacheAgregados(
+                    max_dias=int(os.getenv("AGREGADOS_MAX_DIAS", "5000")) if guardar else 0,
+                    dias_abiertos=int(os.getenv("AGREGADOS_DIAS_ABIERTOS", "1")),
+                )
+    return _cache
@@ -0,0 +1,210 @@
+"""
+Series de recaudación para graficar sin bajar los recibos: sumas de id_neto/id_descuento,
+recibos, cancelados y tasa de cancelación por día, semana (ISO) o mes, opcionalmente por
+cuenta, forma de pago o status, y comparadas contra el periodo anterior o el mismo rango del
+año pasado.
+
+MySQL agrupa por día (y grupo) en una sola consulta que cubre el rango y el de comparación;
+aquí sólo se juntan esos días en semanas o meses y se emparejan los periodos.
+"""
+from datetime import datetime, timedelta
+
+from contribuyentes import filtro_contribuyente
+from metricas import etapa
+from pool import conexion
+
+
+PERIODOS = ("dia", "semana", "mes")
+GRUPOS = {
+    "cuenta": "COALESCE(c.id_nombrecuenta, m.id_cuenta)",
+    "forma_pago": "m.id_formapago",
+    "status": "m.id_status",
+}
+COMPARACIONES = ("anterior", "anio", "ninguna")
+MAX_DIAS = 3 * 366
+
+
+def _fecha(valor, campo):
+    try:
+        if len(valor) != 6:
+            raise ValueError
+        return datetime.strptime(valor, "%y%m%d").date()
+    except ValueError:
+        raise ValueError(f"'{campo}' debe ser una fecha yymmdd")
+
+
+def _rango_comparacion(desde, hasta, comparar):
+    if comparar == "anterior":
+        dias = (hasta - desde).days + 1
+        return desde - timedelta(days=dias), desde - timedelta(days=1)
+    if comparar == "anio":
+        def un_anio_antes(d):
+            try:
+                return d.replace(year=d.year - 1)
+            except ValueError:  # 29 de febrero
+                return d.replace(year=d.year - 1, day=28)
+        return un_anio_antes(desde), un_anio_antes(hasta)
+    return None
+
+
+def _etiqueta(dia, periodo):
+    if periodo == "dia":
+        return dia.isoformat()
+    if periodo == "mes":
+        return f"{dia.year}-{dia.month:02d}"
+    anio, semana, _ = dia.isocalendar()
+    return f"{anio}-W{semana:02d}"
+
+
+def _etiquetas(desde, hasta, periodo):
+    """Etiquetas de periodo del rango, en orden y sin repetir (también las que no tuvieron recibos)."""
+    vistas = {}
+    dia = desde
+    while dia <= hasta:
+        vistas.setdefault(_etiqueta(dia, periodo), None)
+        dia += timedelta(days=1)
+    return list(vistas)
+
+
+def _diarios(rangos, por, contribuyente):
+    """Una fila por (día, grupo) de todos los rangos: (dia, grupo, neto, descuento, recibos, cancelados)."""
+    grupo = GRUPOS[por] if por else "NULL"
+    # Agrupando por status se suma todo; si no, neto y descuento son sólo de los vigentes, como en /recibos/totales
+    vigente = "1 = 1" if por == "status" else "m.id_status = 0"
+    sql = f"""
+        SELECT
+            m.id_fecha,
+            {grupo} AS grupo,
+            COALESCE(SUM(CASE WHEN {vigente} THEN m.id_neto ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN {vigente} THEN m.id_descuento ELSE 0 END), 0),
+            SUM(CASE WHEN m.id_status = 0 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN m.id_status = 1 THEN 1 ELSE 0 END)
+        FROM TEARMO01 m
+        {"LEFT JOIN TEARCA01 c ON m.id_cuenta = c.id_codigoc" if por == "cuenta" else ""}
+        WHERE ({" OR ".join(["m.id_fecha BETWEEN %s AND %s"] * len(rangos))})
+    """
+    params = [d.strftime("%y%m%d") for rango in rangos for d in rango]
+    if contribuyente:
+        filtro, params_filtro = filtro_contribuyente("recibos", "m.id_contribuyente", contribuyente)
+        sql += filtro
+        params += params_filtro
+    sql += " GROUP BY m.id_fecha, grupo"
+    with conexion() as conn:
+        cursor = conn.cursor()
+        with etapa("consulta"):
+            cursor.execute(sql, params)
+        with etapa("fetch"):
+            return cursor.fetchall()
+
+
+def _vacio():
+    return [0.0, 0.0, 0, 0]
+
+
+def _cubetas(filas, desde, hasta, periodo):
+    """{(etiqueta, grupo): [neto, descuento, recibos, cancelados]} de las filas diarias dentro del rango."""
+    cubetas = {}
+    inicio, fin = desde.strftime("%y%m%d"), hasta.strftime("%y%m%d")
+    for dia, grupo, neto, descuento, recibos, cancelados in filas:
+        if not inicio <= dia <= fin:
+            continue
+        llave = (_etiqueta(datetime.strptime(dia, "%y%m%d").date(), periodo), grupo)
+        acumulado = cubetas.setdefault(llave, _vacio())
+        acumulado[0] += float(neto or 0)
+        acumulado[1] += float(descuento or 0)
+        acumulado[2] += int(recibos or 0)
+        acumulado[3] += int(cancelados or 0)
+    return cubetas
+
+
+def _medidas(valores) -> dict:
+    neto, descuento, recibos, cancelados = valores
+    emitidos = recibos + cancelados
+    return {
+        "total_neto": round(neto, 2),
+        "total_descuento": round(descuento, 2),
+        "recibos": recibos,
+        "cancelados": cancelados,
+        "tasa_cancelacion": round(cancelados / emitidos, 4) if emitidos else 0.0,
+    }
+
+
+def _variacion(actual, anterior):
+    return round((actual - anterior) / anterior, 4) if anterior else None
+
+
+def _sumar(cubetas):
+    total = _vacio()
+    for valores in cubetas.values():
+        for i, v in enumerate(valores):
+            total[i] += v
+    return total
+
+
+def analitica(desde, hasta, periodo="dia", por=None, comparar="anterior", contribuyente=None) -> dict:
+    if periodo not in PERIODOS:
+        raise ValueError(f"periodo debe ser uno de {', '.join(PERIODOS)}")
+    if por is not None and por not in GRUPOS:
+        raise ValueError(f"por debe ser uno de {', '.join(GRUPOS)}")
+    if comparar not in COMPARACIONES:
+        raise ValueError(f"comparar debe ser uno de {', '.join(COMPARACIONES)}")
+    inicio, fin = _fecha(desde, "desde"), _fecha(hasta, "hasta")
+    if inicio > fin:
+        raise ValueError("'desde' es posterior a 'hasta'")
+    if (fin - inicio).days + 1 > MAX_DIAS:
+        raise ValueError(f"El rango no puede pasar de {MAX_DIAS} días")
+
+    rango_anterior = _rango_comparacion(inicio, fin, comparar)
+    rangos = [(inicio, fin)] + ([rango_anterior] if rango_anterior else [])
+    filas = _diarios(rangos, por, contribuyente)
+
+    actual = _cubetas(filas, inicio, fin, periodo)
+    etiquetas = _etiquetas(inicio, fin, periodo)
+    anterior, etiquetas_anteriores = {}, []
+    if rango_anterior:
+        anterior = _cubetas(filas, *rango_anterior, periodo)
+        etiquetas_anteriores = _etiquetas(*rango_anterior, periodo)
+
+    # Sin agrupar, los periodos sin recibos salen en cero para que la gráfica no tenga huecos
+    grupos = sorted({g for _, g in actual} | {g for _, g in anterior}, key=lambda g: (g is None, str(g))) if por else [None]
+
+    series = []
+    for i, etiqueta in enumerate(etiquetas):
+        # El i-ésimo periodo del rango se compara con el i-ésimo del rango de comparación
+        etiqueta_anterior = etiquetas_anteriores[i] if i < len(etiquetas_anteriores) else None
+        for grupo in grupos:
+            valores = actual.get((etiqueta, grupo))
+            previos = anterior.get((etiqueta_anterior, grupo)) if etiqueta_anterior else None
+            if por and valores is None and previos is None:
+                continue
+            fila = {"periodo": etiqueta}
+            if por:
+                fila[por] = grupo
+            fila.update(_medidas(valores or _vacio()))
+            if rango_anterior:
+                previas = _medidas(previos or _vacio())
+                fila["anterior"] = dict(previas, periodo=etiqueta_anterior)
+                fila["variacion_neto"] = _variacion(fila["total_neto"], previas["total_neto"])
+            series.append(fila)
+
+    resultado = {
+        "desde": desde,
+        "hasta": hasta,
+        "periodo": periodo,
+        "por": por,
+        "series": series,
+        "totales": _medidas(_sumar(actual)),
+    }
+    if rango_anterior:
+        totales_anteriores = _medidas(_sumar(anterior))
+        resultado["comparacion"] = {
+            "tipo": comparar,
+            "desde": rango_anterior[0].strftime("%y%m%d"),
+            "hasta": rango_anterior[1].strftime("%y%m%d"),
+            "totales": totales_anteriores,
+            "variacion": {
+                campo: _variacion(resultado["totales"][campo], totales_anteriores[campo])
+                for campo in ("total_neto", "total_descuento", "recibos", "cancelados")
+            },
+        }
+    return resultado
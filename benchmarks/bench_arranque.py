@@ -0,0 +1,210 @@
+"""
+Arranque en frío: cuánto tarda un proceso nuevo (como un dyno o un worker del Procfile) en
+contestar su primera petición, y cuánto cuesta importar cada módulo. Cada repetición es un
+intérprete nuevo con -X importtime sobre la base SQLite sintética.
+
+    python benchmarks/bench_arranque.py --repeticiones 5
+    python benchmarks/bench_arranque.py --modos perezoso --ruta "/recibos/totales?desde={hoy}&hasta={hoy}"
+    python benchmarks/bench_arranque.py --comparar benchmarks/resultados/arranque_anterior.json
+
+Modos: "precalentado" (reportlab/openpyxl en segundo plano después del arranque, lo normal) y
+"perezoso" (PRECALENTAR_EXPORTACION=0: se importan con el primer reporte). En los dos se mide
+también el primer PDF, que es donde el modo perezoso paga la importación.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, AQUI)
+
+from bench_endpoints import commit_actual, percentil
+
+MODOS = {
+    "precalentado": {"PRECALENTAR_EXPORTACION": "1"},
+    "perezoso": {"PRECALENTAR_EXPORTACION": "0"},
+}
+# Módulos de terceros que se reportan aunque no los importe main directamente
+PESADOS = ("fastapi", "pydantic", "pymysql", "reportlab.platypus", "openpyxl", "numpy", "pandas", "requests", "PIL.Image")
+
+_LINEA = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+# -----------------------
+# Una repetición (proceso hijo)
+# -----------------------
+def caso(db, ruta):
+    inicio = time.perf_counter()
+    import sinteticos
+    sinteticos.instalar(db)
+    t_sinteticos = time.perf_counter()
+    import main
+    t_import = time.perf_counter()
+    from fastapi.testclient import TestClient
+
+    hoy = date.today().strftime("%y%m%d")
+    with TestClient(main.app) as cliente:
+        t_startup = time.perf_counter()
+        r = cliente.get(ruta.format(hoy=hoy))
+        t_primera = time.perf_counter()
+        cargados = [m for m in PESADOS if m in sys.modules]
+        if os.getenv("PRECALENTAR_EXPORTACION", "1") != "0":
+            # El primer PDF se mide con el precalentamiento ya terminado
+            from plantillas import PLANTILLAS
+            limite = time.monotonic() + 30
+            while not all(p.compilada for p in PLANTILLAS.values()) and time.monotonic() < limite:
+                time.sleep(0.05)
+        t_primera_pdf = time.perf_counter()
+        pdf = cliente.get(f"/recibos/reporte?desde={hoy}&hasta={hoy}")
+        t_pdf = time.perf_counter()
+
+    print(json.dumps({
+        "fin_primera": time.time() - (time.perf_counter() - t_primera),
+        "status": r.status_code,
+        "status_pdf": pdf.status_code,
+        # sinteticos (el sustituto de MySQL) no cuenta como arranque de la aplicación
+        "import_main_ms": round((t_import - t_sinteticos) * 1000, 1),
+        "startup_ms": round((t_startup - t_import) * 1000, 1),
+        "primera_peticion_ms": round((t_primera - t_startup) * 1000, 1),
+        "primer_pdf_ms": round((t_pdf - t_primera_pdf) * 1000, 1),
+        "sinteticos_ms": round((t_sinteticos - inicio) * 1000, 1),
+        "cargados_en_primera": cargados,
+    }))
+
+
+def importaciones(stderr):
+    """{módulo: (propio_ms, acumulado_ms, profundidad)} de la salida de -X importtime (primera aparición)."""
+    modulos = {}
+    for linea in stderr.splitlines():
+        m = _LINEA.match(linea)
+        if m and m.group(4) not in modulos:
+            modulos[m.group(4)] = (int(m.group(1)) / 1000, int(m.group(2)) / 1000, len(m.group(3)) // 2)
+    return modulos
+
+
+def modulos_de_main(modulos):
+    """Los que importa main directamente (profundidad 1 debajo de main) más los de PESADOS."""
+    nombres = list(modulos)
+    if "main" not in modulos:
+        return {}
+    fin = nombres.index("main")
+    inicio = fin
+    # -X importtime escribe a cada módulo después de sus dependencias: las de main van antes que él
+    while inicio > 0 and modulos[nombres[inicio - 1]][2] >= 1:
+        inicio -= 1
+    directos = {n: modulos[n][1] for n in nombres[inicio:fin] if modulos[n][2] == 1}
+    directos.update({n: modulos[n][1] for n in PESADOS if n in modulos})
+    return directos
+
+
+# -----------------------
+# Orquestador
+# -----------------------
+def medir(modo, db, ruta):
+    entorno = dict(os.environ, **MODOS[modo])
+    antes = time.time()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", __file__, "--caso", "--db", db, "--ruta", ruta],
+        capture_output=True, text=True, env=entorno,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else str(proc.returncode))
+    r = json.loads(proc.stdout.strip().splitlines()[-1])
+    # Desde que se lanza el intérprete hasta la primera respuesta (incluye el arranque de Python)
+    r["hasta_primera_ms"] = round((r.pop("fin_primera") - antes) * 1000 - r["sinteticos_ms"], 1)
+    r["modulos_ms"] = modulos_de_main(importaciones(proc.stderr))
+    return r
+
+
+def resumen(corridas):
+    campos = ("hasta_primera_ms", "import_main_ms", "startup_ms", "primera_peticion_ms", "primer_pdf_ms")
+    salida = {c: round(percentil([r[c] for r in corridas], 50), 1) for c in campos}
+    modulos = {}
+    for r in corridas:
+        for nombre, ms in r["modulos_ms"].items():
+            modulos.setdefault(nombre, []).append(ms)
+    salida["modulos_ms"] = dict(sorted(
+        ((n, round(percentil(v, 50), 1)) for n, v in modulos.items()), key=lambda x: -x[1]
+    ))
+    salida["cargados_en_primera"] = corridas[-1]["cargados_en_primera"]
+    salida["status"] = sorted({r["status"] for r in corridas} | {r["status_pdf"] for r in corridas})
+    return salida
+
+
+def comparar(actual, ruta_anterior, umbral):
+    with open(ruta_anterior, encoding="utf-8") as f:
+        anterior = json.load(f)
+    regresiones = 0
+    print(f"\nComparación contra {anterior['commit']} ({anterior['fecha']}); umbral {umbral:.0%}")
+    for modo, r in actual["resultados"].items():
+        previo = anterior["resultados"].get(modo)
+        if not previo:
+            continue
+        for campo in ("hasta_primera_ms", "import_main_ms", "primer_pdf_ms"):
+            cambio = r[campo] / previo[campo] - 1 if previo[campo] else 0.0
+            marca = "  REGRESIÓN" if cambio > umbral else ""
+            regresiones += bool(marca)
+            print(f"  {modo:<13s} {campo:<20s} {previo[campo]:>8.1f} -> {r[campo]:>8.1f} ms {cambio:+7.1%}{marca}")
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--modos", nargs="+", choices=sorted(MODOS), default=list(MODOS))
+    parser.add_argument("--ruta", default="/recibos/hoy", help="primera petición; {hoy} es la fecha de hoy")
+    parser.add_argument("--recibos", type=int, default=10000, help="tamaño de la base sintética")
+    parser.add_argument("--dir-db", default=AQUI)
+    parser.add_argument("--modulos", type=int, default=15, help="cuántos módulos listar")
+    parser.add_argument("--resultados", default=os.path.join(AQUI, "resultados"))
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    parser.add_argument("--umbral", type=float, default=0.2, help="aumento relativo que cuenta como regresión")
+    parser.add_argument("--caso", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.caso:
+        caso(args.db, args.ruta)
+        sys.exit(0)
+
+    import sinteticos
+    db = sinteticos.crear_sqlite(os.path.join(args.dir_db, f"bench_{args.recibos}.db"), args.recibos)
+
+    salida = {
+        "commit": commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "nucleos": os.cpu_count(),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("caso", "db", "comparar")},
+        "resultados": {},
+    }
+    for modo in args.modos:
+        corridas = [medir(modo, db, args.ruta) for _ in range(args.repeticiones)]
+        r = salida["resultados"][modo] = resumen(corridas)
+        print(f"\n{modo} (mediana de {args.repeticiones}, status {r['status']})")
+        print(f"  primera respuesta {r['hasta_primera_ms']:>8.1f} ms desde que arranca el intérprete")
+        print(f"  import main       {r['import_main_ms']:>8.1f} ms")
+        print(f"  startup           {r['startup_ms']:>8.1f} ms")
+        print(f"  primera petición  {r['primera_peticion_ms']:>8.1f} ms  ({args.ruta})")
+        print(f"  primer PDF        {r['primer_pdf_ms']:>8.1f} ms")
+        print(f"  ya importados en la primera respuesta: {', '.join(r['cargados_en_primera']) or '-'}")
+        print("  importación por módulo (acumulado, incluye lo que se importa después de arrancar):")
+        for nombre, ms in list(r["modulos_ms"].items())[:args.modulos]:
+            print(f"    {nombre:<24s} {ms:>8.1f} ms")
+
+    os.makedirs(args.resultados, exist_ok=True)
+    archivo = os.path.join(args.resultados, f"arranque_{datetime.now():%Y%m%d_%H%M%S}_{salida['commit']}.json")
+    with open(archivo, "w", encoding="utf-8") as f:
+        json.dump(salida, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados en {archivo}")
+
+    if args.comparar:
+        sys.exit(1 if comparar(salida, args.comparar, args.umbral) else 0)
@@ -0,0 +1,52 @@
+"""
+Muestra que N consultas lentas ya no se serializan dentro de un worker.
+
+Simula una consulta de `demora` segundos y la lanza N veces en paralelo, primero
+llamándola directo desde corutinas (como antes) y luego a través de `ejecutar`.
+
+    python benchmarks/bench_concurrencia.py --n 8 --demora 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ejecucion import ejecutar, cerrar_executor
+
+
+def consulta_lenta(demora):
+    time.sleep(demora)
+    return demora
+
+
+async def directo(demora):
+    return consulta_lenta(demora)
+
+
+async def medir(n, demora, fn):
+    inicio = time.perf_counter()
+    await asyncio.gather(*(fn(demora) for _ in range(n)))
+    return time.perf_counter() - inicio
+
+
+async def principal(n, demora):
+    serial = await medir(n, demora, directo)
+    concurrente = await medir(n, demora, lambda d: ejecutar(consulta_lenta, d))
+    print(f"{n} consultas de {demora:.2f}s")
+    print(f"  directo en el event loop: {serial:.2f}s")
+    print(f"  vía ejecutar():           {concurrente:.2f}s")
+    cerrar_executor()
+    # Con el executor las consultas se traslapan: el total debe quedar cerca de una sola demora
+    assert concurrente < serial / 2, "las consultas siguen serializadas"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=8)
+    parser.add_argument("--demora", type=float, default=0.5)
+    args = parser.parse_args()
+    os.environ.setdefault("DB_EXECUTOR_WORKERS", str(args.n))
+    asyncio.run(principal(args.n, args.demora))
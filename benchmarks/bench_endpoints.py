@@ -0,0 +1,201 @@
+"""
+Latencia (p50/p95/p99), throughput y memoria máxima de cada endpoint de main.py sobre datos
+sintéticos (benchmarks/sinteticos.py) en una base SQLite local. Cada endpoint corre en su
+propio proceso para que la memoria máxima sea sólo suya. Los resultados se guardan en
+benchmarks/resultados/<fecha>_<commit>.json; con --comparar se marcan las regresiones.
+
+    python benchmarks/bench_endpoints.py --recibos 10000 100000 --peticiones 20 --concurrencia 4
+    python benchmarks/bench_endpoints.py --recibos 100000 --comparar benchmarks/resultados/anterior.json
+    python benchmarks/bench_endpoints.py --solo recibos_json recibos_pdf
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, AQUI)
+
+# nombre -> (método, ruta); {desde}/{hasta} es el rango medido, {hoy} la fecha de hoy
+ENDPOINTS = {
+    "recibos_json": ("GET", "/recibos?desde={desde}&hasta={hasta}"),
+    "recibos_ndjson": ("GET", "/recibos?desde={desde}&hasta={hasta}&formato=ndjson"),
+    "recibos_pagina": ("GET", "/recibos?desde={desde}&hasta={hasta}&limit=500"),
+    "recibos_filtrar": ("GET", "/recibos/filtrar?desde={desde}&hasta={hasta}&contribuyente=perez"),
+    "recibos_hoy": ("GET", "/recibos/hoy"),
+    "totales": ("GET", "/recibos/totales?desde={desde}&hasta={hasta}"),
+    "totales_contribuyente": ("GET", "/recibos/totales?desde={desde}&hasta={hasta}&contribuyente=perez"),
+    "despliegue": ("GET", "/recibos/totales/despliegue?desde={desde}&hasta={hasta}"),
+    "cedulas_json": ("GET", "/cedulas?desde={desde}&hasta={hasta}"),
+    "cedulas_filtrar": ("GET", "/cedulas/filtrar?desde={desde}&hasta={hasta}&contribuyente=perez"),
+    "contribuyentes_buscar": ("GET", "/contribuyentes/buscar?q=mar"),
+    "recibos_pdf": ("GET", "/recibos/reporte?desde={desde}&hasta={hasta}"),
+    "recibos_excel": ("GET", "/recibos/excel?desde={desde}&hasta={hasta}"),
+    "cedulas_pdf": ("GET", "/cedulas/reporte?desde={desde}&hasta={hasta}"),
+    "cedulas_excel": ("GET", "/cedulas/excel?desde={desde}&hasta={hasta}"),
+    "despliegue_pdf": ("GET", "/recibos/totales/despliegue/reporte?desde={desde}&hasta={hasta}"),
+}
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# -----------------------
+# Un endpoint (proceso hijo)
+# -----------------------
+def caso(nombre, db, dias_rango, peticiones, concurrencia):
+    import sinteticos
+    sinteticos.instalar(db)
+    from fastapi.testclient import TestClient
+    import main
+
+    hoy = date.today()
+    ruta = ENDPOINTS[nombre][1].format(
+        desde=(hoy - timedelta(days=dias_rango - 1)).strftime("%y%m%d"), hasta=hoy.strftime("%y%m%d"),
+    )
+    metodo = ENDPOINTS[nombre][0]
+
+    with TestClient(main.app) as cliente:
+        # Índices de contribuyentes listos y una petición de calentamiento fuera de la medición
+        from contribuyentes import obtener_indice
+        obtener_indice("recibos").refrescar()
+        obtener_indice("cedulas").refrescar()
+        cliente.request(metodo, ruta)
+        base = rss_mb()
+
+        def una(_):
+            inicio = time.perf_counter()
+            r = cliente.request(metodo, ruta)
+            return time.perf_counter() - inicio, r.status_code, len(r.content)
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrencia) as ex:
+            medidas = list(ex.map(una, range(peticiones)))
+        total = time.perf_counter() - inicio
+
+    latencias = [m[0] * 1000 for m in medidas]
+    print(json.dumps({
+        "endpoint": nombre,
+        "ruta": ruta,
+        "peticiones": peticiones,
+        "concurrencia": concurrencia,
+        "status": sorted({m[1] for m in medidas}),
+        "bytes": medidas[-1][2],
+        "p50_ms": round(percentil(latencias, 50), 2),
+        "p95_ms": round(percentil(latencias, 95), 2),
+        "p99_ms": round(percentil(latencias, 99), 2),
+        "media_ms": round(sum(latencias) / len(latencias), 2),
+        "rps": round(peticiones / total, 2),
+        "rss_base_mb": round(base, 1),
+        "rss_max_mb": round(rss_mb(), 1),
+    }))
+
+
+# -----------------------
+# Orquestador
+# -----------------------
+def commit_actual():
+    try:
+        return subprocess.run(["git", "-C", RAIZ, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "sin-git"
+
+
+def comparar(actual, ruta_anterior, umbral):
+    with open(ruta_anterior, encoding="utf-8") as f:
+        anterior = json.load(f)
+    previos = {(r["recibos"], r["endpoint"]): r for r in anterior["resultados"]}
+    regresiones = 0
+    print(f"\nComparación contra {anterior['commit']} ({anterior['fecha']}); umbral {umbral:.0%}")
+    for r in actual["resultados"]:
+        previo = previos.get((r["recibos"], r["endpoint"]))
+        if not previo:
+            continue
+        cambio_p95 = r["p95_ms"] / previo["p95_ms"] - 1 if previo["p95_ms"] else 0.0
+        cambio_mem = r["rss_max_mb"] / previo["rss_max_mb"] - 1 if previo["rss_max_mb"] else 0.0
+        marca = "  REGRESIÓN" if cambio_p95 > umbral or cambio_mem > umbral else ""
+        regresiones += bool(marca)
+        print(f"  {r['recibos']:>8d} {r['endpoint']:<24s} p95 {cambio_p95:+7.1%}  memoria {cambio_mem:+7.1%}{marca}")
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recibos", type=int, nargs="+", default=[10000, 100000],
+                        help="tamaños de TEARMO01 (10k a 5M); TEARMM01 lleva la mitad")
+    parser.add_argument("--dias", type=int, default=730, help="días que abarcan los datos")
+    parser.add_argument("--dias-rango", type=int, default=30, help="días del rango que se consulta")
+    parser.add_argument("--peticiones", type=int, default=20)
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--solo", nargs="+", choices=sorted(ENDPOINTS), help="sólo estos endpoints")
+    parser.add_argument("--dir-db", default=AQUI, help="dónde se guardan las bases SQLite generadas")
+    parser.add_argument("--resultados", default=os.path.join(AQUI, "resultados"))
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    parser.add_argument("--umbral", type=float, default=0.2, help="aumento relativo que cuenta como regresión")
+    parser.add_argument("--caso", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.caso:
+        caso(args.caso, args.db, args.dias_rango, args.peticiones, args.concurrencia)
+        sys.exit(0)
+
+    import sinteticos
+
+    salida = {
+        "commit": commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "nucleos": os.cpu_count(),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("caso", "db", "comparar")},
+        "resultados": [],
+    }
+    print(f"{'recibos':>8s} {'endpoint':<24s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'req/s':>7s} {'MB máx':>7s} {'KB':>8s}")
+    for n in args.recibos:
+        inicio = time.perf_counter()
+        db = sinteticos.crear_sqlite(os.path.join(args.dir_db, f"bench_{n}.db"), n, dias=args.dias)
+        print(f"-- base de {n} recibos lista ({time.perf_counter() - inicio:.1f}s)")
+        for nombre in args.solo or ENDPOINTS:
+            proc = subprocess.run(
+                [sys.executable, __file__, "--caso", nombre, "--db", db, "--dias-rango", str(args.dias_rango),
+                 "--peticiones", str(args.peticiones), "--concurrencia", str(args.concurrencia)],
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(f"{n:>8d} {nombre:<24s} ERROR: {proc.stderr.strip().splitlines()[-1] if proc.stderr else proc.returncode}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            r["recibos"] = n
+            salida["resultados"].append(r)
+            print(f"{n:>8d} {nombre:<24s} {r['p50_ms']:>7.1f}ms {r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms "
+                  f"{r['rps']:>7.2f} {r['rss_max_mb']:>7.1f} {r['bytes'] / 1024:>8.0f}"
+                  + ("" if r["status"] == [200] else f"  status {r['status']}"))
+
+    os.makedirs(args.resultados, exist_ok=True)
+    archivo = os.path.join(args.resultados, f"{datetime.now():%Y%m%d_%H%M%S}_{salida['commit']}.json")
+    with open(archivo, "w", encoding="utf-8") as f:
+        json.dump(salida, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados en {archivo}")
+
+    if args.comparar:
+        sys.exit(1 if comparar(salida, args.comparar, args.umbral) else 0)
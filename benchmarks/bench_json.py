@@ -0,0 +1,76 @@
+"""
+Compara la serialización de listados de recibos: el camino anterior (lista de dicts ->
+jsonable_encoder -> JSONResponse) contra filas_json sobre un ConjuntoFilas armado directo
+de las tuplas del cursor. Verifica que ambos produzcan el mismo JSON.
+
+    python benchmarks/bench_json.py --filas 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from columnar import ConjuntoFilas
+from database import COLUMNAS_RECIBO
+from serializacion import filas_json
+
+NOMBRES = ["JUAN PÉREZ CANUL", "MARIA DOLORES PECH", "COMERCIALIZADORA DEL GOLFO SA DE CV", "JOSÉ CHI"]
+CONCEPTOS = ["AGUA POTABLE", "PREDIAL URBANO", "LICENCIA DE FUNCIONAMIENTO", "PANTEÓN"]
+FORMAS = ["EFECTIVO", "TARJETA", "TRANSFERENCIA"]
+
+
+def tuplas_sinteticas(n):
+    """Tuplas como las entrega pymysql para el SELECT de recibos (DECIMAL -> Decimal)."""
+    rnd = random.Random(n)
+    return [
+        (
+            str(100000 + i), f"25{rnd.randint(1, 12):02d}{rnd.randint(1, 28):02d}",
+            Decimal(f"{rnd.uniform(50, 5000):.2f}"), Decimal(f"{rnd.uniform(0, 100):.2f}"),
+            rnd.choice(CONCEPTOS), rnd.choice(NOMBRES), rnd.choice(["000000", "000010", None]),
+            rnd.choice(FORMAS),
+        )
+        for i in range(n)
+    ]
+
+
+def anterior(tuplas):
+    registros = [dict(zip(COLUMNAS_RECIBO, t)) for t in tuplas]
+    return JSONResponse(jsonable_encoder(registros)).body
+
+
+def directo(tuplas):
+    return filas_json(ConjuntoFilas.desde_filas(COLUMNAS_RECIBO, tuplas))
+
+
+def medir(fn, tuplas, repeticiones):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cuerpo = fn(tuplas)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, cuerpo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filas", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'filas':>8s}  {'anterior':>10s}  {'directo':>10s}  {'mejora':>7s}  {'KB':>8s}")
+    for n in args.filas:
+        tuplas = tuplas_sinteticas(n)
+        t_anterior, cuerpo_anterior = medir(anterior, tuplas, args.repeticiones)
+        t_directo, cuerpo_directo = medir(directo, tuplas, args.repeticiones)
+        assert json.loads(cuerpo_anterior) == json.loads(cuerpo_directo), "los JSON no coinciden"
+        print(f"{n:>8d}  {t_anterior * 1000:>8.1f}ms  {t_directo * 1000:>8.1f}ms  "
+              f"{t_anterior / t_directo:>6.1f}x  {len(cuerpo_directo) / 1024:>8.0f}")
@@ -0,0 +1,66 @@
+"""
+Compara build_pdf_advanced (una sola tabla de Paragraphs) contra el motor por bloques
+con 1k/10k/100k filas sintéticas de recibos. Cada caso corre en su propio proceso para
+medir la memoria máxima de forma independiente.
+
+    python benchmarks/bench_pdf.py --filas 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+HEADERS = ["Recibo", "Fecha", "Contribuyente", "Concepto", "Neto", "Descuento", "% Desc.", "Forma Pago"]
+NOMBRES = ["JUAN PEREZ CANUL", "MARIA DOLORES PECH", "COMERCIALIZADORA DEL GOLFO SA DE CV", "JOSE CHI"]
+CONCEPTOS = ["AGUA POTABLE", "PREDIAL URBANO EJERCICIO VIGENTE", "LICENCIA DE FUNCIONAMIENTO", "PANTEON"]
+
+
+def filas_sinteticas(n):
+    rnd = random.Random(n)
+    for i in range(n):
+        yield [
+            str(100000 + i), "15-01-2025", rnd.choice(NOMBRES), rnd.choice(CONCEPTOS),
+            round(rnd.uniform(50, 5000), 2), round(rnd.uniform(0, 100), 2), "0%", "EFECTIVO",
+        ]
+
+
+def caso(modo, n):
+    from reportlab.lib.units import mm
+    anchos = [22*mm, 22*mm, 55*mm, 65*mm, 25*mm, 25*mm, 18*mm, 28*mm]
+    inicio = time.perf_counter()
+    if modo == "tabla":
+        from reportes import build_pdf_advanced
+        filas = [[c if i not in (4, 5) else f"${c:,.2f}" for i, c in enumerate(f)] for f in filas_sinteticas(n)]
+        tam = len(build_pdf_advanced("Bench", "Sintético", HEADERS, filas, col_widths=anchos, logo_url=None))
+    else:
+        from reportes import build_pdf_por_bloques
+        from render import archivo_temporal
+        salida = archivo_temporal()
+        build_pdf_por_bloques(salida, "Bench", "Sintético", HEADERS, filas_sinteticas(n),
+                              col_widths=anchos, columnas_suma=(4, 5), logo_url=None)
+        tam = salida.tell()
+    segundos = time.perf_counter() - inicio
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{modo:8s} {n:>7d} filas  {segundos:8.2f}s  {rss_mb:8.1f} MB máx  {tam / 1024:9.0f} KB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filas", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--modos", nargs="+", default=["tabla", "bloques"])
+    parser.add_argument("--caso", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.caso:
+        caso(args.caso[0], int(args.caso[1]))
+        sys.exit(0)
+
+    for n in args.filas:
+        for modo in args.modos:
+            subprocess.run([sys.executable, __file__, "--caso", modo, str(n)], check=False)
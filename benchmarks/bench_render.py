@@ -0,0 +1,69 @@
+"""
+Throughput de PDFs según el número de procesos de render. Lanza `--reportes` reportes
+concurrentes (hilos, como los del executor) de `--filas` filas cada uno y mide cuántos
+reportes por segundo salen con RENDER_WORKERS=0 (hilos, todo bajo el GIL) y con 1, 2, 4...
+procesos. Cada configuración corre en su propio proceso.
+
+    python benchmarks/bench_render.py --workers 0 1 2 4 --reportes 8 --filas 5000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+
+def caso(workers, reportes, filas):
+    os.environ["RENDER_WORKERS"] = str(workers)
+    os.environ["RENDER_COLA"] = str(reportes)
+    from reportlab.lib.units import mm
+    from bench_pdf import HEADERS, filas_sinteticas
+    import render
+
+    anchos = [22*mm, 22*mm, 55*mm, 65*mm, 25*mm, 25*mm, 18*mm, 28*mm]
+    datos = [tuple(f) for f in filas_sinteticas(filas)]
+    pool = render.obtener_pool_render()
+    if pool is not None:
+        # Los procesos arrancan antes de medir, como en el startup de la app
+        pool.precalentar()
+        pool._obtener_executor().submit(int).result()
+
+    def uno(_):
+        from io import BytesIO
+        salida = BytesIO()
+        render.renderizar_pdf(salida, "Bench", "Sintético", HEADERS, datos, logo_url=None,
+                              col_widths=anchos, columnas_suma=(4, 5))
+        return salida.tell()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=reportes) as ex:
+        tamanos = list(ex.map(uno, range(reportes)))
+    segundos = time.perf_counter() - inicio
+    if pool is not None:
+        pool.cerrar()
+    print(f"{workers:>7d}  {reportes:>8d}  {filas:>7d}  {segundos:>8.2f}s  {reportes / segundos:>9.2f}  "
+          f"{sum(tamanos) / reportes / 1024:>7.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--reportes", type=int, default=8)
+    parser.add_argument("--filas", type=int, default=5000)
+    parser.add_argument("--caso", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.caso is not None:
+        caso(args.caso, args.reportes, args.filas)
+        sys.exit(0)
+
+    print(f"núcleos: {os.cpu_count()}")
+    print(f"{'workers':>7s}  {'reportes':>8s}  {'filas':>7s}  {'tiempo':>9s}  {'PDFs/s':>9s}  {'KB/PDF':>7s}")
+    for w in args.workers:
+        subprocess.run([sys.executable, __file__, "--caso", str(w),
+                        "--reportes", str(args.reportes), "--filas", str(args.filas)], check=True)
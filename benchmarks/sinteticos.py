@@ -0,0 +1,304 @@
+"""
+Datos sintéticos de TEARMO01 / TEARMM01 / TEARCA01 y una base local para los benchmarks.
+
+    python benchmarks/sinteticos.py --recibos 100000 --db /tmp/bench.db          # SQLite
+    python benchmarks/sinteticos.py --recibos 1000000 --mysql                   # MySQL/MariaDB de BENCH_DB_*
+
+--mysql borra y vuelve a crear las tablas, así que nunca usa las DB_* de la app: se conecta
+con BENCH_DB_HOST/PORT/USER/PASSWORD/NAME y se niega a correr si la base no termina en
+"_bench", salvo que se pase --confirmar-borrado <nombre de la base>.
+
+Con SQLite, `instalar(ruta)` pone en el pool de conexiones una fábrica que traduce el SQL
+de la app (%s, LEFT) y devuelve DECIMAL como Decimal con dos decimales, igual que pymysql.
+CRC32, CONCAT_WS, BIT_XOR y GET_LOCK se emulan con funciones de Python; NOW() - INTERVAL no: el
+resumen (ROLLUP_ENABLED) queda fuera de los benchmarks con SQLite.
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+import zlib
+from datetime import date, timedelta
+from decimal import Decimal
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+NOMBRES = ["JUAN", "MARÍA", "JOSÉ", "ANA", "LUIS", "GUADALUPE", "JESÚS", "ROSA", "CARLOS", "MARTHA",
+           "FRANCISCO", "VERÓNICA", "MIGUEL", "PATRICIA", "RAMÓN", "SOFÍA", "ÁNGEL", "ISABEL"]
+APELLIDOS = ["PÉREZ", "PECH", "CHI", "CANUL", "MAY", "GONZÁLEZ", "HERNÁNDEZ", "LÓPEZ", "MARTÍNEZ",
+             "UC", "POOT", "DZUL", "COUOH", "RODRÍGUEZ", "SÁNCHEZ", "RAMÍREZ", "CRUZ", "EK"]
+EMPRESAS = ["COMERCIALIZADORA DEL GOLFO SA DE CV", "ABARROTES LA PALMA", "FERRETERÍA EL CANDADO",
+            "SERVICIOS TURÍSTICOS DEL SURESTE", "CONSTRUCTORA PENINSULAR SA DE CV"]
+CONCEPTOS = ["AGUA POTABLE", "PREDIAL URBANO EJERCICIO VIGENTE", "LICENCIA DE FUNCIONAMIENTO", "PANTEÓN",
+             "RECOLECCIÓN DE BASURA", "DERECHO DE PISO", "CONSTANCIA DE NO ADEUDO", "MULTA DE TRÁNSITO"]
+MOTIVOS = ["COBRO DE PISO", "INFRACCIÓN REGLAMENTO", "USO DE VÍA PÚBLICA", "ANUNCIO PUBLICITARIO", "EVENTO"]
+CALLES = ["CALLE 20", "CALLE 31 x 42", "AV. COLÓN", "CALLE 60 NORTE", "PERIFÉRICO KM 3", None]
+FORMAS = ["EFECTIVO", "EFECTIVO", "EFECTIVO", "TARJETA", "TRANSFERENCIA", "CHEQUE"]
+
+TABLAS = {
+    "TEARMO01": """(
+        id_recibo VARCHAR(16), id_fecha CHAR(6), id_neto DECIMAL(12,2), id_descuento DECIMAL(12,2),
+        id_concepto1 VARCHAR(120), id_contribuyente VARCHAR(120), id_dispo6 VARCHAR(6),
+        id_formapago VARCHAR(32), id_status INT, id_cuenta VARCHAR(16))""",
+    "TEARCA01": "(id_codigoc VARCHAR(16), id_nombrecuenta VARCHAR(120))",
+    "TEARMM01": """(
+        codigo VARCHAR(16), motivo VARCHAR(120), fecham CHAR(6), contribuyente VARCHAR(120),
+        direccion VARCHAR(120), precio_unitario DECIMAL(12,2), cantidad DECIMAL(12,2),
+        recibo_teso VARCHAR(16), fecha_rteso CHAR(6))""",
+}
+INDICES = [
+    "CREATE INDEX ix_tearmo01_fecha ON TEARMO01 (id_fecha, id_recibo)",
+    "CREATE INDEX ix_tearmo01_contrib ON TEARMO01 (id_contribuyente)",
+    "CREATE INDEX ix_tearmm01_fecha ON TEARMM01 (fecham, codigo)",
+    "CREATE INDEX ix_tearmm01_contrib ON TEARMM01 (contribuyente)",
+]
+
+
+# -----------------------
+# Generador
+# -----------------------
+def contribuyentes(rnd, n):
+    nombres = {rnd.choice(EMPRESAS) for _ in range(len(EMPRESAS))}
+    while len(nombres) < n:
+        nombres.add(f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}")
+    return sorted(nombres)
+
+
+def cuentas(n=40):
+    return [(f"{k:04d}", f"CUENTA {k:02d} - {CONCEPTOS[k % len(CONCEPTOS)]}") for k in range(1, n + 1)]
+
+
+def recibos(n, dias, semilla=1, hoy=None):
+    """Tuplas de TEARMO01: ~n/dias recibos por día hábil, montos log-normales, 3% cancelados."""
+    rnd = random.Random(semilla)
+    hoy = hoy or date.today()
+    nombres = contribuyentes(rnd, max(50, n // 40))
+    ids_cuenta = [c for c, _ in cuentas()]
+    for i in range(n):
+        # Los ids crecen con la fecha, como en producción
+        dia = hoy - timedelta(days=dias - 1 - (i * dias) // n)
+        neto = Decimal(f"{min(rnd.lognormvariate(5.5, 1.0), 250000):.2f}")
+        descuento = Decimal(f"{neto * Decimal(rnd.choice([0, 0, 0, 5, 10, 50])) / 100:.2f}")
+        yield (
+            f"{1000000 + i}", dia.strftime("%y%m%d"), neto, descuento, rnd.choice(CONCEPTOS),
+            rnd.choice(nombres), rnd.choice(["000000", "000000", "000010", "000050", None]),
+            rnd.choice(FORMAS), 1 if rnd.random() < 0.03 else 0, rnd.choice(ids_cuenta),
+        )
+
+
+def cedulas(n, dias, semilla=2, hoy=None, recibos_total=None):
+    """Tuplas de TEARMM01; ~70% ya tienen recibo de tesorería."""
+    rnd = random.Random(semilla)
+    hoy = hoy or date.today()
+    nombres = contribuyentes(random.Random(1), max(50, (recibos_total or n) // 40))
+    for i in range(n):
+        dia = hoy - timedelta(days=dias - 1 - (i * dias) // n)
+        pagada = rnd.random() < 0.7
+        yield (
+            f"{i % 1000000:06d}{rnd.randint(0, 999):03d}E", rnd.choice(MOTIVOS), dia.strftime("%y%m%d"),
+            rnd.choice(nombres), rnd.choice(CALLES), Decimal(f"{rnd.uniform(20, 2000):.2f}"),
+            Decimal(rnd.choice([1, 1, 1, 2, 3, 5])),
+            f"{1000000 + rnd.randint(0, max(1, (recibos_total or n) - 1))}" if pagada else None,
+            (dia + timedelta(days=rnd.randint(0, 5))).strftime("%y%m%d") if pagada else None,
+        )
+
+
+# -----------------------
+# Carga
+# -----------------------
+def _lotes(filas, tam=20000):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= tam:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def cargar(conn, marcador, n_recibos, n_cedulas, dias):
+    cursor = conn.cursor()
+    for tabla, columnas in TABLAS.items():
+        cursor.execute(f"DROP TABLE IF EXISTS {tabla}")
+        cursor.execute(f"CREATE TABLE {tabla} {columnas}")
+    def insertar(tabla, filas, n_cols):
+        sql = f"INSERT INTO {tabla} VALUES ({', '.join([marcador] * n_cols)})"
+        for lote in _lotes(filas):
+            cursor.executemany(sql, lote)
+    insertar("TEARCA01", cuentas(), 2)
+    insertar("TEARMO01", recibos(n_recibos, dias), 10)
+    insertar("TEARMM01", cedulas(n_cedulas, dias, recibos_total=n_recibos), 9)
+    for sql in INDICES:
+        cursor.execute(sql)
+    conn.commit()
+
+
+def conexion_mysql_bench(confirmacion=None):
+    """Conexión a la base de BENCH_DB_*; ValueError si no es claramente una base de benchmarks."""
+    import pymysql
+    nombre = os.getenv("BENCH_DB_NAME")
+    if not nombre:
+        raise ValueError("Falta BENCH_DB_NAME (y BENCH_DB_HOST/PORT/USER/PASSWORD): --mysql no usa las DB_* de la app")
+    if not nombre.endswith("_bench") and confirmacion != nombre:
+        raise ValueError(f"La base '{nombre}' no termina en _bench; para borrar sus tablas pase --confirmar-borrado {nombre}")
+    return pymysql.connect(
+        host=os.getenv("BENCH_DB_HOST", "localhost"),
+        port=int(os.getenv("BENCH_DB_PORT", "3306")),
+        user=os.getenv("BENCH_DB_USER"),
+        password=os.getenv("BENCH_DB_PASSWORD"),
+        database=nombre,
+    ), nombre
+
+
+def crear_sqlite(ruta, n_recibos, n_cedulas=None, dias=730):
+    """Crea (o reutiliza, si ya tiene el mismo tamaño) la base SQLite de benchmarks."""
+    n_cedulas = n_recibos // 2 if n_cedulas is None else n_cedulas
+    marca = f"{ruta}.{n_recibos}.{n_cedulas}.{dias}.{date.today():%y%m%d}"
+    if os.path.exists(ruta) and os.path.exists(marca):
+        return ruta
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    conn = sqlite3.connect(ruta)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    sqlite3.register_adapter(Decimal, str)
+    cargar(conn, "?", n_recibos, n_cedulas, dias)
+    conn.close()
+    open(marca, "w").close()
+    return ruta
+
+
+# -----------------------
+# Conexión tipo pymysql sobre SQLite
+# -----------------------
+_LEFT = re.compile(r"\bLEFT\(")
+
+
+def _decimal(valor: bytes):
+    return Decimal(valor.decode()).quantize(Decimal("0.01"))
+
+
+sqlite3.register_converter("DECIMAL", _decimal)
+
+
+class CursorSQLite:
+    def __init__(self, conn):
+        self._cursor = conn.cursor()
+
+    def execute(self, sql, params=()):
+        if sql.startswith("SET SESSION"):
+            # Variables de sesión de MySQL (MAX_EXECUTION_TIME de pool.py): sin equivalente en SQLite
+            return 0
+        sql = _LEFT.sub("IZQ(", sql.replace("%s", "?"))
+        self._cursor.execute(sql, tuple(params) if params else ())
+        return self._cursor.rowcount
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, n):
+        return self._cursor.fetchmany(n)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class _BitXor:
+    def __init__(self):
+        self.valor = 0
+
+    def step(self, valor):
+        if valor is not None:
+            self.valor ^= int(valor)
+
+    def finalize(self):
+        return self.valor
+
+
+def _concat_ws(separador, *valores):
+    return separador.join(str(v) for v in valores if v is not None)
+
+
+class ConexionSQLite:
+    """Lo mínimo de pymysql.Connection que usan database.py, pool.py y compañía."""
+
+    def __init__(self, ruta):
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self._conn.create_function("IZQ", 2, lambda texto, n: None if texto is None else str(texto)[:n])
+        # Lo que usa la versión de un rango (condicional.py)
+        self._conn.create_function("CRC32", 1, lambda texto: None if texto is None else zlib.crc32(str(texto).encode()))
+        self._conn.create_function("CONCAT_WS", -1, _concat_ws)
+        self._conn.create_aggregate("BIT_XOR", 1, _BitXor)
+        # Candados con nombre (rollup.py, snapshot.py): una sola conexión por proceso en los benchmarks
+        self._conn.create_function("GET_LOCK", 2, lambda nombre, espera: 1)
+        self._conn.create_function("RELEASE_LOCK", 1, lambda nombre: 1)
+
+    def cursor(self, clase=None):
+        return CursorSQLite(self._conn)
+
+    def ping(self, reconnect=False):
+        self._conn.execute("SELECT 1")
+
+    def thread_id(self):
+        return 0
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def instalar(ruta):
+    """Hace que el pool de la app preste conexiones a la base SQLite `ruta`."""
+    import pool
+    pool._pool = None
+    return pool.obtener_pool(fabrica=lambda: ConexionSQLite(ruta))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recibos", type=int, default=100000)
+    parser.add_argument("--cedulas", type=int, default=None, help="por defecto la mitad de los recibos")
+    parser.add_argument("--dias", type=int, default=730)
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench.db"))
+    parser.add_argument("--mysql", action="store_true", help="cargar en la base MySQL de BENCH_DB_* (¡borra las tablas!)")
+    parser.add_argument("--confirmar-borrado", metavar="BASE", help="nombre de la base de BENCH_DB_NAME si no termina en _bench")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    n_cedulas = args.recibos // 2 if args.cedulas is None else args.cedulas
+    if args.mysql:
+        from dotenv import load_dotenv
+        load_dotenv()
+        try:
+            conn, destino = conexion_mysql_bench(args.confirmar_borrado)
+        except ValueError as exc:
+            parser.error(str(exc))
+        cargar(conn, "%s", args.recibos, n_cedulas, args.dias)
+        conn.close()
+    else:
+        destino = crear_sqlite(args.db, args.recibos, n_cedulas, args.dias)
+    print(f"{args.recibos} recibos, {n_cedulas} cédulas en {destino} ({time.perf_counter() - inicio:.1f}s)")
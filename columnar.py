@@ -0,0 +1,70 @@
+class ConjuntoFilas:
+    """
+    Resultado de una consulta guardado por columnas (una lista por columna) en lugar de una
+    lista de dicts. Las transformaciones se hacen por columna y se memorizan por valor distinto:
+    un rango de 100k recibos tiene unos cientos de fechas, así que yymmdd_to_human corre unos
+    cientos de veces y no 100k.
+    """
+
+    __slots__ = ("columnas", "_datos")
+
+    def __init__(self, columnas, datos=None):
+        self.columnas = tuple(columnas)
+        self._datos = datos if datos is not None else {c: [] for c in self.columnas}
+
+    @classmethod
+    def desde_filas(cls, columnas, filas):
+        """Transpone tuplas del cursor a columnas (zip en C, sin bucle por fila en Python)."""
+        columnas = tuple(columnas)
+        if not filas:
+            return cls(columnas)
+        return cls(columnas, {c: list(valores) for c, valores in zip(columnas, zip(*filas))})
+
+    def __len__(self):
+        return len(self._datos[self.columnas[0]]) if self.columnas else 0
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, columna):
+        return self._datos[columna]
+
+    def extender(self, otro):
+        for c in self.columnas:
+            self._datos[c].extend(otro[c])
+        return self
+
+    def reemplazar(self, columna, valores):
+        self._datos[columna] = list(valores)
+        return self
+
+    def mapear(self, columna, fn):
+        """Aplica `fn` a la columna evaluándola una sola vez por valor distinto."""
+        valores = self._datos[columna]
+        memo = {v: fn(v) for v in set(valores)}
+        return list(map(memo.__getitem__, valores))
+
+    def combinar(self, columnas, fn):
+        """Como mapear, pero `fn` recibe los valores de varias columnas de la misma fila."""
+        tuplas = list(zip(*(self._datos[c] for c in columnas)))
+        memo = {t: fn(*t) for t in set(tuplas)}
+        return list(map(memo.__getitem__, tuplas))
+
+    def recortar(self, n):
+        for c in self.columnas:
+            del self._datos[c][n:]
+        return self
+
+    def omitir(self, n):
+        """Quita las primeras `n` filas."""
+        for c in self.columnas:
+            del self._datos[c][:n]
+        return self
+
+    def filas(self, *columnas):
+        """Tuplas con las columnas pedidas (o todas), en el orden de la consulta."""
+        return zip(*(self._datos[c] for c in (columnas or self.columnas)))
+
+    def registros(self):
+        """Lista de dicts {columna: valor}, para las respuestas JSON."""
+        return [dict(zip(self.columnas, fila)) for fila in self.filas()]
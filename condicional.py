@@ -0,0 +1,214 @@
+"""
+GET condicional para los rangos de recibos y cédulas.
+
+Antes de traer filas se calcula la versión del rango (database.versionRecibos/versionCedulas:
+COUNT, MAX del folio y BIT_XOR de CRC32 por fila, todo en MySQL). Con ella:
+
+  - ETag (débil: el PDF trae la fecha de impresión) en cada respuesta;
+  - If-None-Match que coincide -> 304 sin leer ni serializar filas;
+  - Cache-Control largo para los rangos cerrados (terminan antes de hoy) y no-cache para
+    los abiertos, que el navegador revalida con el mismo ETag;
+  - los PDF/Excel de rangos cerrados se guardan en disco por versión y se sirven tal cual.
+
+La versión de un rango cerrado se recuerda VERSION_TTL segundos (para correcciones a días
+viejos basta con POST /cache/agregados/invalidar o esperar el TTL). No hay Last-Modified: las
+tablas no guardan cuándo cambió una fila, y la hora en que un proceso vio la versión por primera
+vez difiere entre workers y reinicios; la revalidación va sólo por ETag.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from database import versionRecibos, versionCedulas, versionConciliacion
+from trabajos import AlmacenArtefactos, Trabajo
+
+
+FUENTES = {
+    "recibos": versionRecibos,
+    "cedulas": versionCedulas,
+    "conciliacion": versionConciliacion,
+}
+# Nunca se tratan como cerrados: el recibo de una cédula vieja se puede cancelar o corregir hoy
+SIEMPRE_ABIERTOS = {"conciliacion"}
+
+
+class VersionRango:
+    __slots__ = ("firma", "cerrado", "filas")
+
+    def __init__(self, firma, cerrado, filas=0):
+        self.firma = firma
+        self.cerrado = cerrado
+        # El COUNT de la firma: sirve de presupuesto de filas (admision.py) sin otra consulta
+        self.filas = filas
+
+    def etag(self, representacion) -> str:
+        # Misma versión de datos, distinta representación (json, recibos_pdf...) -> distinto ETag
+        return f'W/"{representacion}-{self.firma}"'
+
+    def encabezados(self, representacion, max_age_cerrado) -> dict:
+        return {
+            "ETag": self.etag(representacion),
+            "Cache-Control": f"private, max-age={max_age_cerrado}" if self.cerrado else "private, no-cache",
+        }
+
+
+def _sin_debil(etag: str) -> str:
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def no_modificado(headers, version: VersionRango, representacion) -> bool:
+    """Evalúa If-None-Match (comparación débil)."""
+    si_no_coincide = headers.get("if-none-match")
+    if si_no_coincide is None:
+        return False
+    if si_no_coincide.strip() == "*":
+        return True
+    actual = _sin_debil(version.etag(representacion))
+    return any(_sin_debil(e) == actual for e in si_no_coincide.split(","))
+
+
+class CacheVersiones:
+    def __init__(self, ttl_cerrado=300.0, max_entradas=10000):
+        self.ttl_cerrado = ttl_cerrado
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._versiones = OrderedDict()
+        self.calculadas = 0
+        self.aciertos = 0
+
+    def version(self, tipo, desde, hasta, contribuyente=None) -> VersionRango:
+        llave = (tipo, desde, hasta, contribuyente)
+        cerrado = hasta < datetime.now().strftime("%y%m%d") and tipo not in SIEMPRE_ABIERTOS
+        ahora = time.monotonic()
+        if cerrado:
+            with self._lock:
+                guardada = self._versiones.get(llave)
+                if guardada is not None and guardada[1] > ahora:
+                    self._versiones.move_to_end(llave)
+                    self.aciertos += 1
+                    return guardada[0]
+
+        firma_datos = FUENTES[tipo](desde, hasta, contribuyente)
+        firma = hashlib.sha1(repr((llave, firma_datos)).encode()).hexdigest()[:24]
+        with self._lock:
+            self.calculadas += 1
+            version = VersionRango(firma, cerrado, firma_datos[0] or 0)
+            if cerrado:
+                self._versiones[llave] = (version, ahora + self.ttl_cerrado)
+                self._versiones.move_to_end(llave)
+                while len(self._versiones) > self.max_entradas:
+                    self._versiones.popitem(last=False)
+        return version
+
+    def invalidar(self):
+        with self._lock:
+            self._versiones.clear()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"rangos_cerrados": len(self._versiones), "calculadas": self.calculadas, "aciertos": self.aciertos}
+
+
+class CacheRender:
+    """PDF/Excel ya generados, por (tipo, parámetros, versión), en un AlmacenArtefactos propio."""
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self._lock = threading.Lock()
+        self._generando = {}
+        self.aciertos = 0
+        self.generados = 0
+
+    @staticmethod
+    def llave(tipo, parametros, version) -> str:
+        return hashlib.sha256(repr((tipo, sorted(parametros.items()), version.firma)).encode()).hexdigest()[:32]
+
+    def _candado(self, llave):
+        with self._lock:
+            return self._generando.setdefault(llave, threading.Lock())
+
+    def existe(self, tipo, parametros, version) -> bool:
+        return self.almacen.archivo(self.llave(tipo, parametros, version)) is not None
+
+    def obtener(self, tipo, parametros, version, generar):
+        """
+        (ruta, metadatos) del archivo de esa versión; si no existe se genera con
+        `generar(salida) -> (nombre, media_type)`. Dos peticiones iguales a la vez generan una vez.
+        """
+        llave = self.llave(tipo, parametros, version)
+        encontrado = self.almacen.archivo(llave)
+        if encontrado is None:
+            candado = self._candado(llave)
+            with candado:
+                encontrado = self.almacen.archivo(llave)
+                if encontrado is None:
+                    self._generar(llave, tipo, parametros, generar)
+                    encontrado = self.almacen.archivo(llave)
+            with self._lock:
+                if self._generando.get(llave) is candado:
+                    del self._generando[llave]
+            return encontrado
+        with self._lock:
+            self.aciertos += 1
+        return encontrado
+
+    def _generar(self, llave, tipo, parametros, generar):
+        salida = self.almacen.temporal(llave)
+        try:
+            nombre, media_type = generar(salida)
+        except BaseException:
+            salida.close()
+            try:
+                os.remove(salida.name)
+            except OSError:
+                pass
+            raise
+        entrada = Trabajo(tipo, parametros, llave)
+        entrada.id = llave
+        entrada.estado = "listo"
+        entrada.nombre, entrada.media_type = nombre, media_type
+        entrada.terminado = time.time()
+        self.almacen.publicar(entrada, salida)
+        with self._lock:
+            self.generados += 1
+        self.almacen.purgar()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"aciertos": self.aciertos, "generados": self.generados, "almacen": self.almacen.estadisticas()}
+
+
+_versiones = None
+_render = None
+_lock = threading.Lock()
+
+
+def obtener_versiones() -> CacheVersiones:
+    global _versiones
+    if _versiones is None:
+        with _lock:
+            if _versiones is None:
+                _versiones = CacheVersiones(ttl_cerrado=float(os.getenv("VERSION_TTL", "300")))
+    return _versiones
+
+
+def obtener_cache_render() -> CacheRender:
+    global _render
+    if _render is None:
+        with _lock:
+            if _render is None:
+                _render = CacheRender(AlmacenArtefactos(
+                    os.getenv("CACHE_REPORTES_DIR", os.path.join(tempfile.gettempdir(), "reportes_versiones")),
+                    ttl=float(os.getenv("CACHE_REPORTES_TTL", "86400")),
+                    max_bytes=int(float(os.getenv("CACHE_REPORTES_MB", "256")) * 1024 * 1024),
+                ))
+    return _render
+
+
+def max_age_cerrado() -> int:
+    return int(os.getenv("CACHE_MAX_AGE_CERRADO", "86400"))
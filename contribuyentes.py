@@ -0,0 +1,228 @@
+import logging
+import os
+import threading
+import time
+import unicodedata
+
+from pool import conexion
+
+log = logging.getLogger(__name__)
+
+
+def normalizar(texto) -> str:
+    """Minúsculas, sin acentos y con espacios simples: 'José  Pérez' -> 'jose perez'."""
+    if texto is None:
+        return ""
+    descompuesto = unicodedata.normalize("NFKD", str(texto))
+    sin_acentos = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return " ".join(sin_acentos.casefold().split())
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceContribuyentes:
+    """
+    Índice de trigramas en memoria sobre los nombres distintos de contribuyente de una tabla.
+    Resuelve una búsqueda tipo LIKE '%term%' (sin distinguir acentos ni mayúsculas) en la lista
+    exacta de nombres, para que la consulta a MySQL sea un IN (...) que sí usa índice.
+
+    Con `columna_marca` (un folio numérico que sólo crece, como id_recibo) el refresco sólo lee
+    las filas posteriores a la marca, y filtro_contribuyente revisa con LIKE las que llegaron
+    después. Sin ella (TEARMM01 no tiene folio creciente: una cédula se puede capturar tarde con
+    fecha anterior) cada refresco relee todos los nombres.
+    """
+
+    def __init__(self, tabla, columna, columna_marca=None, refresco=60.0):
+        self.tabla = tabla
+        self.columna = columna
+        self.columna_marca = columna_marca
+        self.refresco = refresco
+
+        self._lock = threading.Lock()
+        self._valores = []
+        self._normalizados = []
+        self._posiciones = {}
+        self._postings = {}
+        self._marca = None
+        self._refrescado_en = 0.0
+        self._cargando = False
+        self.listo = False
+
+    # ---------- carga ----------
+    def _agregar(self, valores):
+        with self._lock:
+            for valor in valores:
+                if valor is None or valor in self._posiciones:
+                    continue
+                i = len(self._valores)
+                norm = normalizar(valor)
+                self._valores.append(valor)
+                self._normalizados.append(norm)
+                self._posiciones[valor] = i
+                for tri in _trigramas(norm):
+                    self._postings.setdefault(tri, set()).add(i)
+
+    def marca_sql(self, prefijo="") -> str:
+        """La marca como número (id_recibo es VARCHAR: '999' > '1000' como texto)."""
+        return f"CAST({prefijo}{self.columna_marca} AS UNSIGNED)"
+
+    def refrescar(self):
+        """Carga completa la primera vez (o siempre, sin marca); después sólo las filas posteriores a la marca."""
+        marca = None
+        with conexion() as conn:
+            cursor = conn.cursor()
+            if self.columna_marca is not None:
+                # Antes que los nombres: lo que llegue entre las dos consultas se relee en el siguiente refresco
+                cursor.execute(f"SELECT MAX({self.marca_sql()}) FROM {self.tabla}")
+                marca = cursor.fetchone()[0]
+            if self._marca is None:
+                cursor.execute(f"SELECT DISTINCT {self.columna} FROM {self.tabla}")
+            else:
+                cursor.execute(
+                    f"SELECT DISTINCT {self.columna} FROM {self.tabla} WHERE {self.marca_sql()} > %s",
+                    (self._marca,),
+                )
+            valores = [fila[0] for fila in cursor.fetchall()]
+        self._agregar(valores)
+        with self._lock:
+            if marca is not None:
+                self._marca = int(marca)
+            self._refrescado_en = time.monotonic()
+            self.listo = True
+
+    def _refrescar_en_fondo(self):
+        with self._lock:
+            if self._cargando:
+                return
+            self._cargando = True
+
+        def trabajo():
+            try:
+                self.refrescar()
+            except Exception:
+                # Se reintenta en la siguiente búsqueda; mientras, filtro_contribuyente usa LIKE
+                # o la lista vieja más el LIKE de las filas nuevas
+                log.exception("Falló el refresco del índice de contribuyentes de %s", self.tabla)
+            finally:
+                with self._lock:
+                    self._cargando = False
+
+        threading.Thread(target=trabajo, name=f"indice-{self.tabla}", daemon=True).start()
+
+    def _vigilar(self):
+        if not self.listo or time.monotonic() - self._refrescado_en > self.refresco:
+            self._refrescar_en_fondo()
+
+    def precargar(self):
+        self._vigilar()
+
+    # ---------- búsqueda ----------
+    def _buscar(self, termino):
+        term = normalizar(termino)
+        if not term:
+            return []
+        with self._lock:
+            if len(term) < 3:
+                candidatos = range(len(self._valores))
+            else:
+                listas = sorted((self._postings.get(tri, set()) for tri in _trigramas(term)), key=len)
+                candidatos = set.intersection(*listas) if listas else set()
+            return [self._valores[i] for i in candidatos if term in self._normalizados[i]]
+
+    def coincidencias(self, termino, maximo=None):
+        """
+        (nombres exactos que contienen `termino`, marca hasta la que el índice los cubre), o None
+        si el índice aún no está listo o hay más de `maximo` coincidencias (en ese caso conviene
+        seguir usando LIKE).
+        """
+        self._vigilar()
+        if not self.listo:
+            return None
+        with self._lock:
+            marca = self._marca
+        valores = self._buscar(termino)
+        if maximo is not None and len(valores) > maximo:
+            return None
+        return valores, marca
+
+    def fresco(self, segundos) -> bool:
+        """True si el índice se refrescó hace no más de `segundos` (un nombre nuevo ya estaría)."""
+        with self._lock:
+            return self.listo and time.monotonic() - self._refrescado_en <= segundos
+
+    def sugerencias(self, termino, limite=20):
+        """Autocompletado: primero los nombres que empiezan con el término, luego el resto."""
+        if not self.listo:
+            self.refrescar()
+        else:
+            self._vigilar()
+        term = normalizar(termino)
+        valores = self._buscar(termino)
+        valores.sort(key=lambda v: (not normalizar(v).startswith(term), normalizar(v)))
+        return valores[:limite]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "listo": self.listo,
+                "nombres": len(self._valores),
+                "trigramas": len(self._postings),
+                "marca": str(self._marca) if self._marca is not None else None,
+            }
+
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+_CONFIG = {
+    "recibos": ("TEARMO01", "id_contribuyente", "id_recibo"),
+    "cedulas": ("TEARMM01", "contribuyente", None),
+}
+
+
+def obtener_indice(tipo: str) -> IndiceContribuyentes:
+    with _indices_lock:
+        indice = _indices.get(tipo)
+        if indice is None:
+            tabla, columna, marca = _CONFIG[tipo]
+            indice = IndiceContribuyentes(
+                tabla, columna, marca,
+                refresco=float(os.getenv("CONTRIBUYENTES_REFRESCO", "60")),
+            )
+            _indices[tipo] = indice
+        return indice
+
+
+def filtro_contribuyente(tipo: str, columna: str, contribuyente: str):
+    """
+    Fragmento SQL y parámetros para filtrar por contribuyente, sin perder filas respecto al
+    LIKE '%term%' de siempre:
+      - con marca (recibos): IN (...) con los nombres del índice, más LIKE sólo en las filas
+        posteriores a la marca, que el índice todavía no vio (un contribuyente recién registrado);
+      - sin marca (cédulas): IN (...) sólo si el índice se refrescó hace menos de
+        CONTRIBUYENTES_FRESCO segundos (0 por defecto: nunca); si no, LIKE;
+      - LIKE si el índice no está listo o hay más de CONTRIBUYENTES_MAX_IN coincidencias.
+    `columna` puede llevar alias ("m.id_contribuyente"): la marca usa el mismo.
+    """
+    indice = obtener_indice(tipo)
+    like = f"%{contribuyente}%"
+    encontrado = indice.coincidencias(contribuyente, maximo=int(os.getenv("CONTRIBUYENTES_MAX_IN", "500")))
+    if encontrado is None:
+        return f" AND {columna} LIKE %s", [like]
+    valores, marca = encontrado
+    en_indice = f"{columna} IN ({', '.join(['%s'] * len(valores))})" if valores else None
+
+    if indice.columna_marca is not None and marca is not None:
+        prefijo = columna.rpartition(".")[0]
+        nuevos = f"({indice.marca_sql(prefijo + '.' if prefijo else '')} > %s AND {columna} LIKE %s)"
+        if en_indice is None:
+            return f" AND {nuevos}", [marca, like]
+        return f" AND ({en_indice} OR {nuevos})", list(valores) + [marca, like]
+
+    if not indice.fresco(float(os.getenv("CONTRIBUYENTES_FRESCO", "0"))):
+        return f" AND {columna} LIKE %s", [like]
+    if en_indice is None:
+        return " AND 1 = 0", []
+    return f" AND {en_indice}", list(valores)
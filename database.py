@@ -1,15 +1,15 @@
 import pymysql
+import pymysql.cursors
 import os
 import datetime
-from io import BytesIO
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import mm
-import requests
-from reportlab.platypus import Image as RLImage
-from reportlab.lib.utils import ImageReader
+from functools import lru_cache
+
+from pool import conexion
+import snapshot
+from agregados import obtener_cache
+from contribuyentes import filtro_contribuyente
+from columnar import ConjuntoFilas
+from metricas import etapa, contar_filas
 
 
 from datetime import datetime
@@ -37,35 +37,44 @@ def get_connection():
         user=DB_USER,
         password=DB_PASSWORD,
         database=DB_NAME,
-        port=DB_PORT
+        port=DB_PORT,
+        # Las conexiones se reutilizan desde el pool: sin transacciones abiertas entre préstamos
+        autocommit=True
     )
 
 def obtenerTotalesYDescuentos(desde_fecha, hasta_fecha, contribuyente=None):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    if contribuyente:
-        cursor.execute("""
-            SELECT 
-                COALESCE(SUM(CASE WHEN id_status = 0 THEN id_neto ELSE 0 END), 0) AS total_neto, 
-                COALESCE(SUM(CASE WHEN id_status = 0 THEN id_descuento ELSE 0 END), 0) AS total_descuento,
-                SUM(CASE WHEN id_status = 1 THEN 1 ELSE 0 END) AS cantidad_status_1
-            FROM TEARMO01
-            WHERE id_fecha BETWEEN %s AND %s
-            AND id_contribuyente LIKE %s
-        """, (desde_fecha, hasta_fecha, f"%{contribuyente}%"))
-    else:
-        cursor.execute("""
-            SELECT 
-                COALESCE(SUM(CASE WHEN id_status = 0 THEN id_neto ELSE 0 END), 0) AS total_neto, 
-                COALESCE(SUM(CASE WHEN id_status = 0 THEN id_descuento ELSE 0 END), 0) AS total_descuento,
-                SUM(CASE WHEN id_status = 1 THEN 1 ELSE 0 END) AS cantidad_status_1
-            FROM TEARMO01
-            WHERE id_fecha BETWEEN %s AND %s
-        """, (desde_fecha, hasta_fecha))
-
-    resultado = cursor.fetchone()
-    conn.close()
+    if not contribuyente:
+        try:
+            return obtener_cache().totales(desde_fecha, hasta_fecha)
+        except ValueError:
+            pass  # Fechas fuera de formato yymmdd: consulta directa
+
+    with conexion() as conn:
+        cursor = conn.cursor()
+
+        with etapa("consulta"):
+            if contribuyente:
+                filtro, params = filtro_contribuyente("recibos", "id_contribuyente", contribuyente)
+                cursor.execute("""
+                    SELECT 
+                        COALESCE(SUM(CASE WHEN id_status = 0 THEN id_neto ELSE 0 END), 0) AS total_neto, 
+                        COALESCE(SUM(CASE WHEN id_status = 0 THEN id_descuento ELSE 0 END), 0) AS total_descuento,
+                        SUM(CASE WHEN id_status = 1 THEN 1 ELSE 0 END) AS cantidad_status_1
+                    FROM TEARMO01
+                    WHERE id_fecha BETWEEN %s AND %s
+                """ + filtro, [desde_fecha, hasta_fecha] + params)
+            else:
+                cursor.execute("""
+                    SELECT 
+                        COALESCE(SUM(CASE WHEN id_status = 0 THEN id_neto ELSE 0 END), 0) AS total_neto, 
+                        COALESCE(SUM(CASE WHEN id_status = 0 THEN id_descuento ELSE 0 END), 0) AS total_descuento,
+                        SUM(CASE WHEN id_status = 1 THEN 1 ELSE 0 END) AS cantidad_status_1
+                    FROM TEARMO01
+                    WHERE id_fecha BETWEEN %s AND %s
+                """, (desde_fecha, hasta_fecha))
+
+        with etapa("fetch"):
+            resultado = cursor.fetchone()
 
     return {
         "total_neto": float(resultado[0]),
@@ -74,124 +83,192 @@ def obtenerTotalesYDescuentos(desde_fecha, hasta_fecha, contribuyente=None):
     }
 
 
-def obtenerRecibosConIntervaloYContribuyente(desde_fecha, hasta_fecha, contribuyente):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT id_recibo, id_fecha, id_neto, id_descuento, id_concepto1, id_contribuyente, id_dispo6
-        FROM TEARMO01 
-        WHERE id_fecha BETWEEN %s AND %s
-        AND id_contribuyente LIKE %s
-        ORDER BY id_fecha DESC
-    """, (desde_fecha, hasta_fecha, f"%{contribuyente}%"))
-
-    resultados = cursor.fetchall()
-    conn.close()
-
-    if not resultados:
-        return []
-
-    recibos = [
-        {
-            "recibo": row[0],
-            "fecha": row[1],
-            "neto": row[2],
-            "descuento": row[3],
-            "concepto": row[4],
-            "contribuyente": row[5],
-            "porcentaje_descuento": row[6]
-        } 
-        for row in resultados
-    ]
-    return recibos
-
-def obtenerRecibosConIntervalo(desde_fecha, hasta_fecha):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
+# -----------------------
+# Recibos (TEARMO01)
+# -----------------------
+COLUMNAS_RECIBO = ("recibo", "fecha", "neto", "descuento", "concepto", "contribuyente", "porcentaje_descuento", "forma_pago")
+
+def _porcentaje_descuento(valor):
+    return valor if valor and valor != "000000" else 0
+
+def _consultaRecibos(desde_fecha, hasta_fecha, contribuyente=None, despues_de=None, limite=None,
+                     nuevos_desde=None, hasta_recibo=None):
+    """
+    SQL y parámetros de los recibos del intervalo. `despues_de` es la llave (fecha, recibo,
+    repetidas) de la última fila ya entregada; `nuevos_desde` / `hasta_recibo` acotan por id_recibo
+    (> y <=), que crece conforme se cobran recibos. id_recibo es VARCHAR: se compara y ordena como
+    número (CAST), si no '10000' quedaría antes que '9999'.
+
+    (fecha, recibo) no es única en TEARMO01: la llave de `despues_de` se incluye (<=) y quien
+    pagina descarta las `repetidas` filas con esa llave que ya entregó (_omitir_entregadas). El
+    resto de las columnas desempata en el ORDER BY para que esas filas salgan siempre en el mismo
+    orden.
+    """
+    sql = """
         SELECT id_recibo, id_fecha, id_neto, id_descuento, id_concepto1, id_contribuyente, id_dispo6, id_formapago
         FROM TEARMO01 
         WHERE id_fecha BETWEEN %s AND %s
-        ORDER BY id_fecha DESC
-    """, (desde_fecha, hasta_fecha)) 
-
-    resultados = cursor.fetchall()
-    conn.close()
+    """
+    params = [desde_fecha, hasta_fecha]
+    if contribuyente:
+        filtro, params_filtro = filtro_contribuyente("recibos", "id_contribuyente", contribuyente)
+        sql += filtro
+        params += params_filtro
+    if despues_de:
+        fecha, recibo = despues_de[:2]
+        sql += " AND (id_fecha < %s OR (id_fecha = %s AND CAST(id_recibo AS UNSIGNED) <= %s))"
+        params += [fecha, fecha, int(recibo)]
+    if nuevos_desde is not None:
+        sql += " AND CAST(id_recibo AS UNSIGNED) > %s"
+        params.append(int(nuevos_desde))
+    if hasta_recibo is not None:
+        sql += " AND CAST(id_recibo AS UNSIGNED) <= %s"
+        params.append(int(hasta_recibo))
+    sql += """ ORDER BY id_fecha DESC, CAST(id_recibo AS UNSIGNED) DESC, id_recibo DESC, id_neto, id_descuento,
+        id_concepto1, id_contribuyente, id_dispo6, id_formapago"""
+    if limite:
+        sql += " LIMIT %s"
+        params.append(int(limite))
+    return sql, params
+
+def _normalizarRecibos(filas):
+    return filas.reemplazar("porcentaje_descuento", filas.mapear("porcentaje_descuento", _porcentaje_descuento))
+
+def _repetidas(despues_de) -> int:
+    """Filas con la llave de `despues_de` ya entregadas; un cursor viejo (fecha, recibo) entregó una."""
+    if not despues_de:
+        return 0
+    return int(despues_de[2]) if len(despues_de) > 2 else 1
+
+def _omitir_entregadas(lotes, n):
+    for lote in lotes:
+        if n:
+            quitar = min(n, len(lote))
+            lote.omitir(quitar)
+            n -= quitar
+            if not lote:
+                continue
+        yield lote
+
+def obtenerRecibos(desde_fecha, hasta_fecha, contribuyente=None, despues_de=None, limite=None,
+                   nuevos_desde=None, hasta_recibo=None) -> ConjuntoFilas:
+    """Recibos del intervalo como columnas; lo consumen por igual el JSON, el PDF y el Excel."""
+    repetidas = _repetidas(despues_de)
+    filas = _leer_tramos("recibos", _consultaRecibos, COLUMNAS_RECIBO, desde_fecha, hasta_fecha,
+                         limite + repetidas if limite else None,
+                         contribuyente=contribuyente, despues_de=despues_de,
+                         nuevos_desde=nuevos_desde, hasta_recibo=hasta_recibo)
+    return _normalizarRecibos(filas.omitir(repetidas))
+
+def lotesRecibos(desde_fecha, hasta_fecha, contribuyente=None, despues_de=None, limite=None, tam_lote=5000):
+    """Recibos del intervalo en lotes columnares leídos con un cursor sin búfer (SSCursor), sin cargarlos todos en memoria."""
+    repetidas = _repetidas(despues_de)
+    lotes = _lotes_tramos("recibos", _consultaRecibos, COLUMNAS_RECIBO, desde_fecha, hasta_fecha,
+                          limite + repetidas if limite else None, tam_lote,
+                          contribuyente=contribuyente, despues_de=despues_de)
+    for lote in _omitir_entregadas(lotes, repetidas):
+        yield _normalizarRecibos(lote)
 
-    if not resultados:
-        return []
+def obtenerRecibosConIntervaloYContribuyente(desde_fecha, hasta_fecha, contribuyente):
+    return obtenerRecibos(desde_fecha, hasta_fecha, contribuyente).registros()
 
-    recibos = [
-        {
-            "recibo": row[0],
-            "fecha": row[1],
-            "neto": row[2],
-            "descuento": row[3],
-            "concepto": row[4],
-            "contribuyente": row[5],
-            "porcentaje_descuento": row[6] if row[6] and row[6] != "000000" else 0,
-            "forma_pago": row[7]
-        } 
-        for row in resultados
-    ]
-    return recibos
+def obtenerRecibosConIntervalo(desde_fecha, hasta_fecha):
+    return obtenerRecibos(desde_fecha, hasta_fecha).registros()
 
 def obtenerRecibosHoy():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    fecha_hoy = datetime.datetime.today().strftime('%y%m%d')
-
-    cursor.execute("""
-        SELECT id_recibo, id_fecha, id_neto, id_descuento, id_concepto1, id_contribuyente, id_dispo6, id_formapago
-        FROM TEARMO01 
-        WHERE id_fecha = %s
-        ORDER BY id_fecha DESC
-    """, (fecha_hoy,)) 
-
-    resultados = cursor.fetchall()
-    conn.close()
-
-    if not resultados:
-        return []
+    fecha_hoy = datetime.now().strftime('%y%m%d')
+    return obtenerRecibos(fecha_hoy, fecha_hoy).registros()
+
+def ultimoId(filas) -> int:
+    """El id_recibo más alto de un lote, comparado como número."""
+    return max(int(recibo) for recibo in filas["recibo"])
+
+def obtenerRecibosHoyNuevos(nuevos_desde, hasta_recibo=None) -> ConjuntoFilas:
+    """Recibos de hoy con id_recibo > nuevos_desde (y <= hasta_recibo, si se da)."""
+    fecha_hoy = datetime.now().strftime('%y%m%d')
+    return obtenerRecibos(fecha_hoy, fecha_hoy, nuevos_desde=nuevos_desde, hasta_recibo=hasta_recibo)
+
+def ultimoRecibo():
+    """El id_recibo más alto de TEARMO01 (como número): marca de agua inicial del feed en vivo."""
+    with conexion() as conn:
+        cursor = conn.cursor()
+        with etapa("consulta"):
+            cursor.execute("SELECT MAX(CAST(id_recibo AS UNSIGNED)) FROM TEARMO01")
+        ultimo = cursor.fetchone()[0]
+        return int(ultimo) if ultimo is not None else None
+
+def obtenerRecibosPagina(desde_fecha, hasta_fecha, limite, despues_de=None):
+    """
+    Una página de recibos y la llave (fecha, recibo, repetidas) para pedir la siguiente, o None
+    si es la última. `repetidas` cuenta las filas con esa misma (fecha, recibo) ya entregadas,
+    sumando las de páginas anteriores si el grupo viene de atrás.
+    """
+    filas = obtenerRecibos(desde_fecha, hasta_fecha, despues_de=despues_de, limite=limite + 1)
+    siguiente = None
+    if len(filas) > limite:
+        fecha, recibo = filas["fecha"][limite - 1], filas["recibo"][limite - 1]
+        llave = (fecha, int(recibo))
+        repetidas = 0
+        for i in range(limite - 1, -1, -1):
+            if (filas["fecha"][i], int(filas["recibo"][i])) != llave:
+                break
+            repetidas += 1
+        else:
+            # Toda la página es del mismo grupo: se suman las que ya había entregado el cursor
+            if despues_de and (despues_de[0], int(despues_de[1])) == llave:
+                repetidas += _repetidas(despues_de)
+        siguiente = (fecha, recibo, repetidas)
+        filas.recortar(limite)
+    return filas, siguiente
+
+def _consultaVersionRecibos(desde_fecha, hasta_fecha, contribuyente=None):
+    """
+    Firma barata de los recibos del intervalo: (cantidad, id_recibo máximo, XOR de los CRC32 de
+    cada fila). Cambia si se agrega, cancela o corrige cualquier recibo del rango.
+    """
+    sql = """
+        SELECT COUNT(*), MAX(id_recibo),
+            COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', id_recibo, id_fecha, id_neto, id_descuento, id_status,
+                id_concepto1, id_contribuyente, id_dispo6, id_formapago, id_cuenta))), 0)
+        FROM TEARMO01
+        WHERE id_fecha BETWEEN %s AND %s
+    """
+    params = [desde_fecha, hasta_fecha]
+    if contribuyente:
+        filtro, params_filtro = filtro_contribuyente("recibos", "id_contribuyente", contribuyente)
+        sql += filtro
+        params += params_filtro
+    return sql, params
 
-    recibos = [
-        {
-            "recibo": row[0],
-            "fecha": row[1],
-            "neto": row[2],
-            "descuento": row[3],
-            "concepto": row[4],
-            "contribuyente": row[5],
-            "porcentaje_descuento": row[6] if row[6] else 0,
-            "forma_pago": row[7]
-        } 
-        for row in resultados
-    ]
-    return recibos
+def versionRecibos(desde_fecha, hasta_fecha, contribuyente=None):
+    return _version_tramos("recibos", _consultaVersionRecibos, desde_fecha, hasta_fecha, contribuyente)
 
 def obtenerDespliegueTotales(desde_fecha, hasta_fecha):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT 
-            c.id_nombrecuenta,
-            COALESCE(SUM(m.id_neto), 0) AS total_neto,
-            COALESCE(SUM(m.id_descuento), 0) AS total_descuento,
-            COUNT(*) AS cantidad_recibos
-        FROM TEARMO01 m
-        JOIN TEARCA01 c ON m.id_cuenta = c.id_codigoc
-        WHERE m.id_fecha BETWEEN %s AND %s
-        AND m.id_status = 0
-        GROUP BY c.id_nombrecuenta
-        ORDER BY c.id_nombrecuenta
-    """, (desde_fecha, hasta_fecha))
-
-    resultados = cursor.fetchall()
-    conn.close()
+    try:
+        return obtener_cache().despliegue(desde_fecha, hasta_fecha)
+    except ValueError:
+        pass
+
+    with conexion() as conn:
+        cursor = conn.cursor()
+
+        with etapa("consulta"):
+            cursor.execute("""
+                SELECT 
+                    c.id_nombrecuenta,
+                    COALESCE(SUM(m.id_neto), 0) AS total_neto,
+                    COALESCE(SUM(m.id_descuento), 0) AS total_descuento,
+                    COUNT(*) AS cantidad_recibos
+                FROM TEARMO01 m
+                JOIN TEARCA01 c ON m.id_cuenta = c.id_codigoc
+                WHERE m.id_fecha BETWEEN %s AND %s
+                AND m.id_status = 0
+                GROUP BY c.id_nombrecuenta
+                ORDER BY c.id_nombrecuenta
+            """, (desde_fecha, hasta_fecha))
+
+        with etapa("fetch"):
+            resultados = cursor.fetchall()
 
     if not resultados:
         return []
@@ -207,57 +284,107 @@ def obtenerDespliegueTotales(desde_fecha, hasta_fecha):
     ]
     return despliegue
 
-#LOGICA CEDULAS
-
-def obtenerCedulasConIntervalo(desde_fecha, hasta_fecha):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT
-            LEFT(codigo, 6),
-            motivo,
-            fecham,
-            contribuyente,
-            direccion,
-            precio_unitario,
-            cantidad,
-            recibo_teso,
-            fecha_rteso,
-            codigo
-        FROM TEARMM01 WHERE fecham BETWEEN %s AND %s
-        ORDER BY fecham DESC
-    """, (desde_fecha, hasta_fecha))
-
-    resultados = cursor.fetchall()
-    conn.close()
+def _leer(cursor, sql, params, columnas) -> ConjuntoFilas:
+    """Ejecuta y trae todo el resultado como columnas, midiendo cada etapa."""
+    with etapa("consulta"):
+        cursor.execute(sql, params)
+    with etapa("fetch"):
+        filas = cursor.fetchall()
+    contar_filas(len(filas))
+    with etapa("armado"):
+        return ConjuntoFilas.desde_filas(columnas, filas)
+
+def _leer_tramos(tipo, consulta, columnas, desde_fecha, hasta_fecha, limite=None, **filtros) -> ConjuntoFilas:
+    """
+    `consulta(desde, hasta, limite=..., **filtros)` por tramos (snapshot.py): los meses cerrados ya
+    copiados se leen del snapshot local y el resto de MySQL. Los tramos van del más reciente al más
+    viejo, como el ORDER BY ... DESC, así que basta con concatenarlos; `limite` se reparte entre ellos.
+    """
+    filas = None
+    for local, desde, hasta in snapshot.tramos(tipo, desde_fecha, hasta_fecha):
+        restante = limite - len(filas) if limite and filas is not None else limite
+        sql, params = consulta(desde, hasta, limite=restante, **filtros)
+        if local:
+            parte = snapshot.obtener_snapshot().leer(sql, params, columnas)
+        else:
+            with conexion() as conn:
+                parte = _leer(conn.cursor(), sql, params, columnas)
+        filas = parte if filas is None else filas.extender(parte)
+        if limite and len(filas) >= limite:
+            break
+    return filas
+
+def _version_mysql(sql, params):
+    with conexion() as conn:
+        cursor = conn.cursor()
+        with etapa("version"):
+            cursor.execute(sql, params)
+            return tuple(cursor.fetchone())
+
+def _version_tramos(tipo, consulta, desde_fecha, hasta_fecha, contribuyente=None):
+    """
+    Firma del rango por tramos, como _leer_tramos: los meses completos del snapshot usan la firma
+    de MySQL que se guardó al copiarlos (sin consulta), los pedazos de mes o con filtro de
+    contribuyente se calculan sobre la copia local y sólo el resto va a MySQL. Con más de un tramo devuelve
+    (cantidad total, firma de cada tramo...): el primer elemento sigue siendo la cantidad de filas.
+    """
+    tramos = snapshot.tramos(tipo, desde_fecha, hasta_fecha)
+    if len(tramos) == 1 and not tramos[0][0]:
+        return _version_mysql(*consulta(desde_fecha, hasta_fecha, contribuyente))
+    partes = []
+    for local, desde, hasta in tramos:
+        if not local:
+            partes.append(_version_mysql(*consulta(desde, hasta, contribuyente)))
+            continue
+        local_snapshot = snapshot.obtener_snapshot()
+        parte = None if contribuyente else local_snapshot.firma_meses(tipo, desde, hasta)
+        if parte is None:
+            filtro, params_filtro = ("", [])
+            if contribuyente:
+                filtro, params_filtro = filtro_contribuyente(tipo, snapshot.TABLAS[tipo].contribuyente, contribuyente)
+            parte = local_snapshot.version(tipo, desde, hasta, filtro, params_filtro)
+        partes.append(parte)
+    return (sum(p[0] or 0 for p in partes),) + tuple(partes)
+
+def _lotes_tramos(tipo, consulta, columnas, desde_fecha, hasta_fecha, limite, tam_lote, **filtros):
+    """Como _leer_tramos, pero en lotes: SSCursor para los tramos de MySQL y cursor de SQLite para los del snapshot."""
+    entregadas = 0
+    for local, desde, hasta in snapshot.tramos(tipo, desde_fecha, hasta_fecha):
+        sql, params = consulta(desde, hasta, limite=limite - entregadas if limite else None, **filtros)
+        if local:
+            lotes = snapshot.obtener_snapshot().lotes(sql, params, columnas, tam_lote)
+        else:
+            lotes = _lotes(sql, params, columnas, tam_lote)
+        for lote in lotes:
+            entregadas += len(lote)
+            yield lote
+        if limite and entregadas >= limite:
+            return
+
+def _lotes(sql, params, columnas, tam_lote):
+    with conexion() as conn:
+        cursor = conn.cursor(pymysql.cursors.SSCursor)
+        with etapa("consulta"):
+            cursor.execute(sql, params)
+        while True:
+            with etapa("fetch"):
+                lote = cursor.fetchmany(tam_lote)
+            if not lote:
+                break
+            contar_filas(len(lote))
+            with etapa("armado"):
+                conjunto = ConjuntoFilas.desde_filas(columnas, lote)
+            yield conjunto
+        cursor.close()
 
-    if not resultados:
-        return []
-
-    cedulas = [
-        {
-            "folio": row[0],
-            "motivo": row[1],
-            "fecham": row[2],
-            "contribuyente": row[3],
-            "direccion": row[4],
-            "precio_unitario": row[5],
-            "cantidad": row[6],
-            "recibo_teso": row[7],
-            "fecha_rteso": row[8],
-            "folio_electronico": row[9]
-        }
-        for row in resultados
-    ]
-    return cedulas
+#LOGICA CEDULAS
 
+COLUMNAS_CEDULA = ("folio", "motivo", "fecham", "contribuyente", "direccion", "precio_unitario", "cantidad",
+                   "recibo_teso", "fecha_rteso", "folio_electronico")
 
-def obtenerCedulasConIntervaloYContribuyente(desde_fecha, hasta_fecha, contribuyente):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
+def _consultaCedulas(desde_fecha, hasta_fecha, contribuyente=None, despues_de=None, limite=None):
+    """SQL y parámetros de las cédulas del intervalo; `despues_de` es (fecham, codigo)."""
+    sql = """
         SELECT LEFT(codigo, 6), motivo, fecham, contribuyente, direccion, precio_unitario,
             cantidad,
             recibo_teso,
@@ -265,35 +392,212 @@ def obtenerCedulasConIntervaloYContribuyente(desde_fecha, hasta_fecha, contribuy
             codigo
         FROM TEARMM01 
         WHERE fecham BETWEEN %s AND %s
-        AND contribuyente LIKE %s
-        ORDER BY fecham DESC
-    """, (desde_fecha, hasta_fecha, f"%{contribuyente}%"))
+    """
+    params = [desde_fecha, hasta_fecha]
+    if contribuyente:
+        filtro, params_filtro = filtro_contribuyente("cedulas", "contribuyente", contribuyente)
+        sql += filtro
+        params += params_filtro
+    if despues_de:
+        fecha, codigo = despues_de[:2]
+        sql += " AND (fecham < %s OR (fecham = %s AND codigo < %s))"
+        params += [fecha, fecha, codigo]
+    sql += " ORDER BY fecham DESC, codigo DESC"
+    if limite:
+        sql += " LIMIT %s"
+        params.append(int(limite))
+    return sql, params
+
+def obtenerCedulas(desde_fecha, hasta_fecha, contribuyente=None, despues_de=None, limite=None) -> ConjuntoFilas:
+    return _leer_tramos("cedulas", _consultaCedulas, COLUMNAS_CEDULA, desde_fecha, hasta_fecha, limite,
+                        contribuyente=contribuyente, despues_de=despues_de)
+
+def lotesCedulas(desde_fecha, hasta_fecha, contribuyente=None, despues_de=None, limite=None, tam_lote=5000):
+    """Cédulas del intervalo en lotes columnares leídos con un cursor sin búfer (SSCursor)."""
+    yield from _lotes_tramos("cedulas", _consultaCedulas, COLUMNAS_CEDULA, desde_fecha, hasta_fecha, limite, tam_lote,
+                             contribuyente=contribuyente, despues_de=despues_de)
+
+def _consultaVersionCedulas(desde_fecha, hasta_fecha, contribuyente=None):
+    """Firma (cantidad, codigo máximo, XOR de CRC32 por fila) de las cédulas del intervalo."""
+    sql = """
+        SELECT COUNT(*), MAX(codigo),
+            COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', codigo, fecham, motivo, contribuyente, direccion,
+                precio_unitario, cantidad, recibo_teso, fecha_rteso))), 0)
+        FROM TEARMM01
+        WHERE fecham BETWEEN %s AND %s
+    """
+    params = [desde_fecha, hasta_fecha]
+    if contribuyente:
+        filtro, params_filtro = filtro_contribuyente("cedulas", "contribuyente", contribuyente)
+        sql += filtro
+        params += params_filtro
+    return sql, params
 
-    resultados = cursor.fetchall()
-    conn.close()
+def versionCedulas(desde_fecha, hasta_fecha, contribuyente=None):
+    return _version_tramos("cedulas", _consultaVersionCedulas, desde_fecha, hasta_fecha, contribuyente)
 
-    if not resultados:
-        return []
+def versionMySQL(tipo, desde_fecha, hasta_fecha):
+    """La firma del rango calculada sólo en MySQL (la que guarda el snapshot de cada mes)."""
+    consulta = _consultaVersionRecibos if tipo == "recibos" else _consultaVersionCedulas
+    return _version_mysql(*consulta(desde_fecha, hasta_fecha))
 
-    cedulas = [
-        {
-            "folio": row[0],
-            "motivo": row[1],
-            "fecham": row[2],
-            "contribuyente": row[3],
-            "direccion": row[4],
-            "precio_unitario": row[5],
-            "cantidad": row[6],
-            "recibo_teso": row[7],
-            "fecha_rteso": row[8],
-            "folio_electronico": row[9]
-        }
-        for row in resultados
-    ]
-    return cedulas
+def obtenerCedulasConIntervalo(desde_fecha, hasta_fecha):
+    return obtenerCedulas(desde_fecha, hasta_fecha).registros()
+
+def obtenerCedulasConIntervaloYContribuyente(desde_fecha, hasta_fecha, contribuyente):
+    return obtenerCedulas(desde_fecha, hasta_fecha, contribuyente).registros()
+
+def obtenerCedulasPagina(desde_fecha, hasta_fecha, limite, despues_de=None):
+    """Una página de cédulas y la llave (fecham, codigo) para pedir la siguiente, o None si es la última."""
+    filas = obtenerCedulas(desde_fecha, hasta_fecha, despues_de=despues_de, limite=limite + 1)
+    siguiente = None
+    if len(filas) > limite:
+        siguiente = (filas["fecham"][limite - 1], filas["folio_electronico"][limite - 1])
+        filas.recortar(limite)
+    return filas, siguiente
+
+#LOGICA CONCILIACION (cédulas contra recibos de tesorería)
+
+COLUMNAS_CONCILIACION = ("folio", "fecham", "contribuyente", "motivo", "importe", "recibo_teso", "fecha_rteso",
+                         "fecha_recibo", "neto_recibo", "diferencia", "categoria", "folio_electronico")
+CATEGORIAS_CONCILIACION = ("pagada", "sin_pagar", "cancelada", "diferencia_monto", "recibo_inexistente")
+
+# id_recibo no es único en TEARMO01 (un recibo puede venir en varias filas): el join va contra
+# una fila por recibo, si no cada cédula se contaría una vez por fila. Sólo se agrupan los
+# recibos a los que apuntan las cédulas del intervalo, no la tabla completa. `cancelado` es 1
+# cuando todas las filas del recibo están canceladas.
+_FROM_CONCILIACION = """
+    FROM TEARMM01 c
+    LEFT JOIN (
+        SELECT id_recibo, MAX(id_fecha) AS id_fecha, SUM(id_neto) AS id_neto, MIN(id_status = 1) AS cancelado
+        FROM TEARMO01
+        WHERE id_recibo IN (SELECT recibo_teso FROM TEARMM01 WHERE fecham BETWEEN %s AND %s)
+        GROUP BY id_recibo
+    ) m ON m.id_recibo = c.recibo_teso
+    WHERE c.fecham BETWEEN %s AND %s
+"""
+# Importe de la cédula contra el neto del recibo al que apunta; el orden de los WHEN decide la categoría
+_CATEGORIA_CONCILIACION = """
+    CASE
+        WHEN c.recibo_teso IS NULL OR c.recibo_teso = '' THEN 'sin_pagar'
+        WHEN m.id_recibo IS NULL THEN 'recibo_inexistente'
+        WHEN m.cancelado = 1 THEN 'cancelada'
+        WHEN ABS(m.id_neto - ROUND(c.precio_unitario * c.cantidad, 2)) > %s THEN 'diferencia_monto'
+        ELSE 'pagada'
+    END
+"""
+
+def _tolerancia_conciliacion():
+    return float(os.getenv("CONCILIACION_TOLERANCIA", "0.01"))
+
+def _filtrosConciliacion(desde_fecha, hasta_fecha, contribuyente=None, categoria=None):
+    """FROM/WHERE del join y sus parámetros; `categoria` filtra en MySQL, no después."""
+    sql = _FROM_CONCILIACION
+    params = [desde_fecha, hasta_fecha, desde_fecha, hasta_fecha]
+    if contribuyente:
+        filtro, params_filtro = filtro_contribuyente("cedulas", "c.contribuyente", contribuyente)
+        sql += filtro
+        params += params_filtro
+    if categoria:
+        sql += f" AND {_CATEGORIA_CONCILIACION} = %s"
+        params += [_tolerancia_conciliacion(), categoria]
+    return sql, params
+
+def _consultaConciliacion(desde_fecha, hasta_fecha, contribuyente=None, categoria=None, despues_de=None, limite=None):
+    """
+    Cada cédula del intervalo con el recibo de tesorería al que apunta (LEFT JOIN por número de
+    recibo, una fila por recibo: MySQL hace el join y aquí sólo llegan las filas ya categorizadas). `despues_de` es (fecham, codigo).
+    """
+    origen, params_filtro = _filtrosConciliacion(desde_fecha, hasta_fecha, contribuyente, categoria)
+    sql = f"""
+        SELECT LEFT(c.codigo, 6), c.fecham, c.contribuyente, c.motivo,
+            ROUND(c.precio_unitario * c.cantidad, 2),
+            c.recibo_teso, c.fecha_rteso,
+            m.id_fecha, m.id_neto,
+            m.id_neto - ROUND(c.precio_unitario * c.cantidad, 2),
+            {_CATEGORIA_CONCILIACION},
+            c.codigo
+        {origen}
+    """
+    params = [_tolerancia_conciliacion()] + params_filtro
+    if despues_de:
+        fecha, codigo = despues_de[:2]
+        sql += " AND (c.fecham < %s OR (c.fecham = %s AND c.codigo < %s))"
+        params += [fecha, fecha, codigo]
+    sql += " ORDER BY c.fecham DESC, c.codigo DESC"
+    if limite:
+        sql += " LIMIT %s"
+        params.append(int(limite))
+    return sql, params
+
+def obtenerConciliacion(desde_fecha, hasta_fecha, contribuyente=None, categoria=None, despues_de=None,
+                        limite=None) -> ConjuntoFilas:
+    # Siempre de MySQL: el snapshot local no sirve para el join porque el recibo puede ser de un mes abierto
+    sql, params = _consultaConciliacion(desde_fecha, hasta_fecha, contribuyente, categoria, despues_de, limite)
+    with conexion() as conn:
+        return _leer(conn.cursor(), sql, params, COLUMNAS_CONCILIACION)
+
+def lotesConciliacion(desde_fecha, hasta_fecha, contribuyente=None, categoria=None, despues_de=None, tam_lote=5000):
+    """La conciliación en lotes con cursor sin búfer: un año entero sin tener ninguna de las dos tablas en memoria."""
+    sql, params = _consultaConciliacion(desde_fecha, hasta_fecha, contribuyente, categoria, despues_de)
+    yield from _lotes(sql, params, COLUMNAS_CONCILIACION, tam_lote)
+
+def obtenerConciliacionPagina(desde_fecha, hasta_fecha, limite, despues_de=None, contribuyente=None, categoria=None):
+    """Una página de la conciliación y la llave (fecham, codigo) para pedir la siguiente, o None si es la última."""
+    filas = obtenerConciliacion(desde_fecha, hasta_fecha, contribuyente, categoria, despues_de, limite + 1)
+    siguiente = None
+    if len(filas) > limite:
+        siguiente = (filas["fecham"][limite - 1], filas["folio_electronico"][limite - 1])
+        filas.recortar(limite)
+    return filas, siguiente
+
+def resumenConciliacion(desde_fecha, hasta_fecha, contribuyente=None) -> dict:
+    """Cédulas, importe y neto de recibos por categoría, agrupados en MySQL (no se traen filas)."""
+    origen, params_filtro = _filtrosConciliacion(desde_fecha, hasta_fecha, contribuyente)
+    sql = f"""
+        SELECT {_CATEGORIA_CONCILIACION} AS categoria,
+            COUNT(*),
+            COALESCE(SUM(ROUND(c.precio_unitario * c.cantidad, 2)), 0),
+            COALESCE(SUM(m.id_neto), 0)
+        {origen}
+        GROUP BY categoria
+    """
+    with conexion() as conn:
+        cursor = conn.cursor()
+        with etapa("consulta"):
+            cursor.execute(sql, [_tolerancia_conciliacion()] + params_filtro)
+        with etapa("fetch"):
+            resultados = cursor.fetchall()
+
+    categorias = {c: {"cedulas": 0, "importe": 0.0, "neto_recibos": 0.0} for c in CATEGORIAS_CONCILIACION}
+    for categoria, cedulas, importe, neto in resultados:
+        categorias[categoria] = {"cedulas": int(cedulas), "importe": round(float(importe), 2),
+                                 "neto_recibos": round(float(neto), 2)}
+    for valores in categorias.values():
+        valores["diferencia"] = round(valores["neto_recibos"] - valores["importe"], 2)
+    totales = {campo: sum(v[campo] for v in categorias.values()) for campo in ("cedulas", "importe", "neto_recibos")}
+    totales["importe"] = round(totales["importe"], 2)
+    totales["neto_recibos"] = round(totales["neto_recibos"], 2)
+    totales["diferencia"] = round(totales["neto_recibos"] - totales["importe"], 2)
+    return {"categorias": categorias, "totales": totales}
+
+def versionConciliacion(desde_fecha, hasta_fecha, contribuyente=None):
+    """Firma (cantidad, codigo máximo, XOR de CRC32) del join: cambia también si se cancela o corrige el recibo."""
+    origen, params = _filtrosConciliacion(desde_fecha, hasta_fecha, contribuyente)
+    sql = f"""
+        SELECT COUNT(*), MAX(c.codigo),
+            COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', c.codigo, c.fecham, c.contribuyente, c.motivo, c.precio_unitario,
+                c.cantidad, c.recibo_teso, c.fecha_rteso, m.id_recibo, m.id_fecha, m.id_neto, m.cancelado))), 0)
+        {origen}
+    """
+    with conexion() as conn:
+        cursor = conn.cursor()
+        with etapa("version"):
+            cursor.execute(sql, params)
+            return tuple(cursor.fetchone())
 
 # -----------------------
-# Utilidades PDF
+# Utilidades de formato (las usan los reportes y las plantillas; sin reportlab)
 # -----------------------
 def yymmdd_to_human(yymmdd: str) -> str:
     try:
@@ -304,129 +608,6 @@ def yymmdd_to_human(yymmdd: str) -> str:
 def _attachment_headers(filename: str) -> dict:
     return {"Content-Disposition": f'attachment; filename="{filename}"'}
 
-def _make_logo_flowable(url: str, max_w=35*mm, max_h=20*mm):
-    """Descarga el logo y devuelve un Flowable Image ajustado a un cuadro max_w x max_h."""
-    try:
-        resp = requests.get(url, timeout=8)
-        resp.raise_for_status()
-        img_bytes = BytesIO(resp.content)
-        ir = ImageReader(img_bytes)
-        iw, ih = ir.getSize()
-        scale = min(max_w / iw, max_h / ih)
-        w, h = iw * scale, ih * scale
-        img_bytes.seek(0)
-        return RLImage(img_bytes, width=w, height=h)
-    except Exception:
-        return None
-
-def build_pdf_advanced(
-    title: str,
-    subtitle: str,
-    headers: list[str],
-    rows: list[list],
-    col_widths=None,
-    landscape_mode=True,
-    extra_styles=None,
-    logo_url: str | None = LOGO_URL,
-) -> bytes:
-    buf = BytesIO()
-    pagesize = landscape(A4) if landscape_mode else A4
-    # Definición de colores institucionales
-    GOB_GUINDA = colors.HexColor("#691C32")
-    GOB_DORADO = colors.HexColor("#BC955C")
-    GOB_GRIS_F = colors.HexColor("#F2F2F2")
-
-    doc = SimpleDocTemplate(
-        buf,
-        pagesize=pagesize,
-        leftMargin=12*mm, rightMargin=12*mm,
-        topMargin=10*mm, bottomMargin=10*mm,
-        title=title
-    )
-    
-    styles = getSampleStyleSheet()
-    
-    # Estilos de texto personalizados
-    title_style = ParagraphStyle(
-        "GovTitle", parent=styles["Title"],
-        fontName="Helvetica-Bold", fontSize=16,
-        textColor=GOB_GUINDA, alignment=0 # Alineado a la izquierda
-    )
-    sub_style = ParagraphStyle(
-        "GovSub", parent=styles["Normal"],
-        fontName="Helvetica", fontSize=10,
-        textColor=colors.gray, leading=12
-    )
-    cell_style = ParagraphStyle(
-        "cell", parent=styles["Normal"], 
-        fontName="Helvetica", fontSize=8, leading=10
-    )
-
-    story = []
-
-    # ---------- ENCABEZADO INSTITUCIONAL ----------
-    logo_flow = _make_logo_flowable(logo_url, max_w=40*mm, max_h=25*mm) if logo_url else None
-    
-    # Textos del encabezado
-    header_info = [
-        Paragraph(title.upper(), title_style),
-        Paragraph(subtitle, sub_style),
-        Paragraph(f"Fecha de impresión: {datetime.now().strftime('%d/%m/%Y %H:%M')}", sub_style)
-    ]
-
-    # Tabla de encabezado para alinear logo y textos
-    header_data = [[logo_flow, header_info]]
-    header_tbl = Table(header_data, colWidths=[45*mm, None])
-    header_tbl.setStyle(TableStyle([
-        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-        ("BOTTOMPADDING", (0,0), (-1,-1), 10),
-    ]))
-    story.append(header_tbl)
-
-    # --- BARRA DECORATIVA (ESTILO GOBIERNO) ---
-    # Una línea guinda gruesa con una dorada delgada abajo
-    linea_guinda = Table([[""]], colWidths=[doc.width])
-    linea_guinda.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,-1), GOB_GUINDA),
-        ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0),
-        ('TOPPADDING', (0,0), (-1,-1), 0),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 0),
-    ]))
-    story.append(linea_guinda)
-    story.append(Spacer(1, 2)) # Espacio mínimo entre barras
-    
-    linea_dorada = Table([[""]], colWidths=[doc.width])
-    linea_dorada.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,-1), GOB_DORADO),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 2),
-    ]))
-    story.append(linea_dorada)
-    story.append(Spacer(1, 8))
-
-    # ---------- TABLA DE DATOS ----------
-    if not rows:
-        story.append(Paragraph("No se encontraron registros.", styles["Italic"]))
-    else:
-        wrapped_rows = [[Paragraph(str(c) if c else "", cell_style) for c in r] for r in rows]
-        # Headers con fondo guinda y texto blanco
-        header_pars = [Paragraph(f"<b>{h}</b>", ParagraphStyle("h", textColor=colors.white, fontSize=9, alignment=1)) for h in headers]
-        data = [header_pars] + wrapped_rows
-
-        table = Table(data, colWidths=col_widths, repeatRows=1)
-        
-        base_style = [
-            ("BACKGROUND", (0,0), (-1,0), GOB_GUINDA), # Encabezado guinda
-            ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-            ("GRID", (0,0), (-1,-1), 0.1, colors.gray), # Cuadrícula muy fina
-            ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.white, GOB_GRIS_F]), # Alternancia de gris muy tenue
-        ]
-        
-        if extra_styles:
-            base_style.extend(extra_styles)
-            
-        table.setStyle(TableStyle(base_style))
-        story.append(table)
-
-    doc.build(story)
-    return buf.getvalue()
\ No newline at end of file
+@lru_cache(maxsize=4096)
+def formato_moneda(valor) -> str:
+    return f"${float(valor):,.2f}"
\ No newline at end of file
@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metricas import en_peticion
+
+
+class TiempoAgotado(Exception):
+    """La llamada bloqueante excedió su tiempo máximo."""
+
+
+class ClienteDesconectado(Exception):
+    """El cliente cerró la conexión antes de recibir la respuesta."""
+
+
+class Llamada:
+    """Registro de las conexiones MySQL que usa una llamada, para poder cancelarla."""
+
+    def __init__(self, timeout=None):
+        self._lock = threading.Lock()
+        self._hilos_mysql = set()
+        self.cancelada = False
+        # pool.conexion lo usa como MAX_EXECUTION_TIME de los SELECT de la llamada
+        self.timeout = timeout
+
+    def registrar(self, conn):
+        try:
+            hilo = conn.thread_id()
+        except Exception:
+            return
+        with self._lock:
+            self._hilos_mysql.add(hilo)
+
+    def olvidar(self, conn):
+        try:
+            hilo = conn.thread_id()
+        except Exception:
+            return
+        with self._lock:
+            self._hilos_mysql.discard(hilo)
+
+    def cancelar(self):
+        """Marca la llamada como cancelada y pide a MySQL que aborte sus consultas en curso."""
+        with self._lock:
+            self.cancelada = True
+            pendientes = bool(self._hilos_mysql)
+        if pendientes:
+            threading.Thread(target=_matar_consultas, args=(self,), daemon=True).start()
+
+
+# MySQL abortó el SELECT por MAX_EXECUTION_TIME (ER_QUERY_TIMEOUT); MariaDB, por
+# max_statement_time (ER_STATEMENT_TIMEOUT)
+ER_QUERY_TIMEOUT = 3024
+ER_STATEMENT_TIMEOUT = 1969
+
+_llamada_actual = contextvars.ContextVar("llamada_actual", default=None)
+
+
+def llamada_actual():
+    return _llamada_actual.get()
+
+
+def _matar_consultas(llamada):
+    from database import get_connection
+    try:
+        conn = get_connection()
+    except Exception:
+        return
+    try:
+        cursor = conn.cursor()
+        # Con el candado de la llamada tomado, olvidar() espera: ninguna de sus conexiones vuelve
+        # al pool (ni la toma otra petición) mientras se manda el KILL, así que cada thread_id
+        # del conjunto sigue siendo de esta llamada
+        with llamada._lock:
+            for hilo in llamada._hilos_mysql:
+                try:
+                    cursor.execute("KILL QUERY %s", (int(hilo),))
+                except Exception:
+                    pass
+    finally:
+        conn.close()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def obtener_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                trabajadores = int(os.getenv("DB_EXECUTOR_WORKERS", os.getenv("DB_POOL_SIZE", "10")))
+                _executor = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix="bloqueante")
+    return _executor
+
+
+def cerrar_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _esperar_desconexion(request, intervalo=0.5):
+    while not await request.is_disconnected():
+        await asyncio.sleep(intervalo)
+
+
+async def ejecutar(fn, *args, timeout=None, request=None, **kwargs):
+    """
+    Ejecuta una función bloqueante (consultas pymysql, armado de reportes) en el pool de hilos
+    sin detener el event loop. Si se excede `timeout` o el cliente de `request` se desconecta,
+    la consulta en curso se cancela en MySQL con KILL QUERY.
+    """
+    if timeout is None:
+        timeout = float(os.getenv("DB_QUERY_TIMEOUT", "120"))
+
+    loop = asyncio.get_running_loop()
+    llamada = Llamada(timeout)
+    ctx = contextvars.copy_context()
+    ctx.run(_llamada_actual.set, llamada)
+    futuro = loop.run_in_executor(obtener_executor(), functools.partial(ctx.run, en_peticion, fn, *args, **kwargs))
+
+    vigilante = asyncio.ensure_future(_esperar_desconexion(request)) if request is not None else None
+    esperando = {futuro} if vigilante is None else {futuro, vigilante}
+    try:
+        listos, _ = await asyncio.wait(esperando, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        llamada.cancelar()
+        futuro.cancel()
+        raise
+    finally:
+        if vigilante is not None:
+            vigilante.cancel()
+
+    if futuro in listos:
+        try:
+            return futuro.result()
+        except Exception as exc:
+            if exc.args[:1] in ((ER_QUERY_TIMEOUT,), (ER_STATEMENT_TIMEOUT,)):
+                raise TiempoAgotado(f"MySQL abortó la consulta tras {timeout:g}s") from exc
+            raise
+
+    llamada.cancelar()
+    futuro.cancel()
+    if vigilante is not None and vigilante in listos:
+        raise ClienteDesconectado()
+    raise TiempoAgotado(f"La operación excedió {timeout:g}s")
@@ -0,0 +1,135 @@
+"""
+Feed en vivo de recibos nuevos para las pantallas de caja (Server-Sent Events).
+
+Un solo sondeo por worker: mientras haya suscriptores, cada FEED_INTERVALO segundos se
+consultan los recibos de hoy con id_recibo mayor que la marca de agua y el lote se
+serializa una vez y se reparte a todas las conexiones abiertas. N pantallas cuestan una
+consulta por intervalo en lugar de N lecturas del día completo.
+
+Cada evento lleva `id: <último id_recibo>`; al reconectar, el navegador manda
+Last-Event-ID y el suscriptor recibe primero lo que se perdió (entre ese id y la marca de
+agua del momento) y después los lotes del sondeo, sin huecos ni repetidos.
+"""
+import asyncio
+import os
+from datetime import datetime
+
+from database import obtenerRecibos, obtenerRecibosHoyNuevos, ultimoId, ultimoRecibo
+from ejecucion import ejecutar
+from serializacion import filas_json
+
+
+class FeedRecibos:
+    def __init__(self, intervalo=3.0, latido=15.0, cola_max=100):
+        self.intervalo = intervalo
+        self.latido = latido
+        self.cola_max = cola_max
+        self.ultimo = None
+        self._suscriptores = set()
+        self._tarea = None
+        self._inicio_lock = None
+        self.consultas = 0
+        self.eventos = 0
+        self.errores = 0
+        self.lentos = 0
+
+    @staticmethod
+    def _evento(filas) -> bytes:
+        return b"id: " + str(ultimoId(filas)).encode() + b"\nevent: recibos\ndata: " + filas_json(filas) + b"\n\n"
+
+    async def _iniciar(self):
+        """
+        Sin sondeo en marcha la marca de agua quedó vieja (de cuando se fue el último suscriptor):
+        se relee antes de arrancarlo, si no el primer lote repetiría a los nuevos clientes todo lo
+        cobrado mientras tanto. Quien la relee arranca el sondeo sin otro await de por medio.
+        """
+        if self._inicio_lock is None:
+            self._inicio_lock = asyncio.Lock()
+        async with self._inicio_lock:
+            if self._tarea is None or self._tarea.done():
+                self.ultimo = await ejecutar(ultimoRecibo)
+
+    def _arrancar_sondeo(self):
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.ensure_future(self._sondear())
+
+    async def _sondear(self):
+        while self._suscriptores:
+            await asyncio.sleep(self.intervalo)
+            if not self._suscriptores:
+                break
+            hoy = datetime.now().strftime("%y%m%d")
+            try:
+                filas = await ejecutar(obtenerRecibos, hoy, hoy, nuevos_desde=self.ultimo)
+            except Exception:
+                self.errores += 1
+                continue
+            self.consultas += 1
+            if not filas:
+                continue
+            self.ultimo = ultimoId(filas)
+            self._repartir(self._evento(filas))
+
+    def _repartir(self, evento):
+        self.eventos += 1
+        for cola in list(self._suscriptores):
+            try:
+                cola.put_nowait(evento)
+            except asyncio.QueueFull:
+                # Cliente que no lee: se le cierra el stream y al reconectar pide desde su Last-Event-ID
+                self.lentos += 1
+                self._suscriptores.discard(cola)
+                while not cola.empty():
+                    cola.get_nowait()
+                cola.put_nowait(None)
+
+    async def suscribir(self, desde=None):
+        """Generador de eventos SSE (bytes) para una conexión; `desde` es el último id_recibo (int) que ya tiene el cliente."""
+        await self._iniciar()
+        cola = asyncio.Queue(self.cola_max)
+        # Sin await entre registrarse y leer la marca: todo lote posterior del sondeo es > corte
+        self._suscriptores.add(cola)
+        corte = self.ultimo
+        self._arrancar_sondeo()
+        try:
+            yield f"retry: {int(self.intervalo * 1000)}\n\n".encode()
+            if desde is not None and corte is not None:
+                perdidos = await ejecutar(obtenerRecibosHoyNuevos, desde, corte)
+                if perdidos:
+                    yield self._evento(perdidos)
+            while True:
+                try:
+                    evento = await asyncio.wait_for(cola.get(), self.latido)
+                except asyncio.TimeoutError:
+                    yield b": latido\n\n"
+                    continue
+                if evento is None:
+                    break
+                yield evento
+        finally:
+            self._suscriptores.discard(cola)
+
+    def estadisticas(self) -> dict:
+        return {
+            "suscriptores": len(self._suscriptores),
+            "intervalo": self.intervalo,
+            "consultas": self.consultas,
+            "eventos": self.eventos,
+            "errores": self.errores,
+            "lentos": self.lentos,
+        }
+
+
+_feed = None
+
+
+def obtener_feed() -> FeedRecibos:
+    """Uno por worker; sólo se usa desde el event loop, no necesita candado."""
+    global _feed
+    if _feed is None:
+        _feed = FeedRecibos(
+            intervalo=float(os.getenv("FEED_INTERVALO", "3")),
+            latido=float(os.getenv("FEED_LATIDO", "15")),
+            cola_max=int(os.getenv("FEED_COLA", "100")),
+        )
+    return _feed
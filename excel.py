@@ -0,0 +1,66 @@
+import os
+import tempfile
+from itertools import islice
+
+from metricas import etapa
+
+
+# Se leen al generar, no al importar: main carga .env después de importar este módulo
+def _filas_muestra() -> int:
+    # Filas que se miran para estimar el ancho de cada columna
+    return int(os.getenv("EXCEL_FILAS_MUESTRA", "200"))
+
+
+def _memoria_max() -> int:
+    return int(os.getenv("EXCEL_MEMORIA_MAX", str(8 * 1024 * 1024)))
+
+
+def _anchos(headers, muestra):
+    anchos = [len(str(h)) for h in headers]
+    for fila in muestra:
+        for i, valor in enumerate(fila):
+            if i < len(anchos) and valor is not None:
+                anchos[i] = max(anchos[i], len(str(valor)))
+    return [min(a, 60) + 2 for a in anchos]
+
+
+def build_excel_streaming(salida, hoja: str, headers: list[str], rows) -> int:
+    """
+    Escribe un xlsx con openpyxl en modo write-only: las filas (`rows` puede ser un generador)
+    se vuelcan a disco conforme llegan en lugar de armar el libro completo en memoria.
+    Los anchos de columna se estiman con las primeras EXCEL_FILAS_MUESTRA filas.
+    Devuelve el número de filas de datos escritas.
+    """
+    with etapa("excel"):
+        return _escribir(salida, hoja, headers, rows)
+
+
+def _escribir(salida, hoja, headers, rows) -> int:
+    # openpyxl (y numpy detrás) se importa con el primer Excel, no al arrancar el worker
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    rows = iter(rows)
+    muestra = list(islice(rows, _filas_muestra()))
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(hoja)
+    # En modo write-only los anchos deben fijarse antes de la primera fila
+    for idx, ancho in enumerate(_anchos(headers, muestra), start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = ancho
+
+    ws.append(headers)
+    total = 0
+    for fila in muestra:
+        ws.append(fila)
+        total += 1
+    for fila in rows:
+        ws.append(fila)
+        total += 1
+
+    wb.save(salida)
+    return total
+
+
+def archivo_temporal():
+    return tempfile.SpooledTemporaryFile(max_size=_memoria_max())
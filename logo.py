@@ -0,0 +1,127 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+
+class CacheLogo:
+    """
+    Copia en memoria del logo ya decodificado y reducido. Nunca descarga en la ruta de la
+    petición: si la copia venció se refresca en segundo plano y mientras tanto se sirve la anterior.
+    """
+
+    def __init__(self, url, ruta_local=None, ttl=86400.0, lado_max=600):
+        self.url = url
+        self.ruta_local = ruta_local
+        self.ttl = ttl
+        self.lado_max = lado_max
+        # Copia en disco para poder arrancar sin red
+        nombre = hashlib.sha1(url.encode()).hexdigest()[:12] if url else "local"
+        self.ruta_cache = os.path.join(tempfile.gettempdir(), f"logo_{nombre}.jpg")
+
+        self._lock = threading.Lock()
+        self._datos = None
+        self._tamano = None
+        self._cargado_en = 0.0
+        self._refrescando = False
+
+    def _leer_original(self) -> bytes:
+        if self.ruta_local and os.path.exists(self.ruta_local):
+            with open(self.ruta_local, "rb") as f:
+                return f.read()
+        import requests
+        resp = requests.get(self.url, timeout=8)
+        resp.raise_for_status()
+        return resp.content
+
+    def _preparar(self, original: bytes):
+        """Decodifica y reduce la imagen una sola vez; devuelve (jpeg_bytes, (ancho, alto))."""
+        from PIL import Image
+        img = Image.open(BytesIO(original))
+        img = img.convert("RGB")
+        img.thumbnail((self.lado_max, self.lado_max))
+        salida = BytesIO()
+        img.save(salida, format="JPEG", quality=90)
+        return salida.getvalue(), img.size
+
+    def _guardar(self, datos, tamano):
+        with self._lock:
+            self._datos = datos
+            self._tamano = tamano
+            self._cargado_en = time.monotonic()
+
+    def cargar(self) -> bool:
+        """Carga bloqueante (para el hilo de fondo). Si falla, conserva la copia anterior."""
+        try:
+            datos, tamano = self._preparar(self._leer_original())
+        except Exception:
+            return self._cargar_de_disco()
+        self._guardar(datos, tamano)
+        try:
+            with open(self.ruta_cache, "wb") as f:
+                f.write(datos)
+        except OSError:
+            pass
+        return True
+
+    def _cargar_de_disco(self) -> bool:
+        if self._datos is not None or not os.path.exists(self.ruta_cache):
+            return self._datos is not None
+        try:
+            with open(self.ruta_cache, "rb") as f:
+                datos, tamano = self._preparar(f.read())
+        except Exception:
+            return False
+        self._guardar(datos, tamano)
+        return True
+
+    def _refrescar_en_fondo(self):
+        with self._lock:
+            if self._refrescando:
+                return
+            self._refrescando = True
+
+        def trabajo():
+            try:
+                self.cargar()
+            finally:
+                with self._lock:
+                    self._refrescando = False
+
+        threading.Thread(target=trabajo, name="logo-refresco", daemon=True).start()
+
+    def instalar(self, datos, tamano):
+        """Usa una copia ya preparada en otro proceso (workers de render) sin descargar nada."""
+        self._guardar(datos, tamano)
+
+    def precargar(self):
+        self._refrescar_en_fondo()
+
+    def obtener(self):
+        """Devuelve (jpeg_bytes, (ancho, alto)) o None si todavía no hay copia."""
+        with self._lock:
+            datos, tamano, cargado_en = self._datos, self._tamano, self._cargado_en
+        if datos is None or time.monotonic() - cargado_en > self.ttl:
+            self._refrescar_en_fondo()
+        if datos is None:
+            return None
+        return datos, tamano
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def obtener_logo(url: str) -> CacheLogo:
+    with _caches_lock:
+        cache = _caches.get(url)
+        if cache is None:
+            cache = CacheLogo(
+                url,
+                ruta_local=os.getenv("LOGO_PATH"),
+                ttl=float(os.getenv("LOGO_TTL", "86400")),
+            )
+            _caches[url] = cache
+        return cache
@@ -1,15 +1,39 @@
-from fastapi import FastAPI, HTTPException, Query
-from reportlab.lib import colors
-from reportlab.lib.units import mm
-
-from database import obtenerRecibosHoy, obtenerRecibosConIntervalo, obtenerRecibosConIntervaloYContribuyente, \
-    obtenerTotalesYDescuentos, obtenerDespliegueTotales, obtenerCedulasConIntervalo, \
-    obtenerCedulasConIntervaloYContribuyente, yymmdd_to_human,_attachment_headers, build_pdf_advanced
+from fastapi import FastAPI, HTTPException, Query, Request, Body
+from fastapi.responses import JSONResponse, Response
+
+from database import obtenerRecibosHoy, obtenerRecibosHoyNuevos, ultimoId, obtenerTotalesYDescuentos, obtenerDespliegueTotales, \
+    obtenerRecibos, obtenerCedulas, lotesRecibos, lotesCedulas, \
+    obtenerRecibosPagina, obtenerCedulasPagina, _attachment_headers, LOGO_URL, \
+    resumenConciliacion, lotesConciliacion, obtenerConciliacionPagina, CATEGORIAS_CONCILIACION
+from logo import obtener_logo
+from agregados import obtener_cache
+import rollup
+import snapshot
+from contribuyentes import obtener_indice
+from render import RenderSaturado, obtener_pool_render, archivo_temporal, iterar_archivo
+from plantillas import PLANTILLAS, generar_pdf, generar_excel, precalentar_en_fondo
+from excel import archivo_temporal as excel_temporal
+from pool import PoolAgotado, obtener_pool
+from ejecucion import ejecutar, cerrar_executor, TiempoAgotado, ClienteDesconectado
+from serializacion import RespuestaFilas, filas_json, filas_ndjson, valor_json
+from trabajos import SinDatos, obtener_cola
+from tablero import normalizar_consultas, resolver_tablero
+from analitica import analitica, PERIODOS, GRUPOS, COMPARACIONES
+from exportacion import EXPORTACIONES
+from en_vivo import obtener_feed
+from condicional import no_modificado, obtener_versiones, obtener_cache_render, max_age_cerrado
+import metricas
+import admision
+from admision import PresupuestoExcedido
 from dotenv import load_dotenv
 import os
-from fastapi.responses import StreamingResponse
-from io import BytesIO
-import pandas as pd
+import base64
+import json
+from typing import Literal
+from urllib.parse import urlencode
+from pydantic import BaseModel
+from functools import partial
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
 
 
 load_dotenv()
@@ -26,258 +50,603 @@ if ENV == "PROD":
 else:
     app = FastAPI()
 
+# Turnos por ruta para consultas, exportaciones y reportes caros (admision.py); va dentro de
+# las métricas para que la espera aparezca en Server-Timing
+app.add_middleware(admision.MiddlewareAdmision)
+# Server-Timing en cada respuesta y métricas por ruta para /metrics
+app.add_middleware(metricas.MiddlewareMetricas)
+
+# -----------------------
+# Streaming NDJSON y paginación por llave
+# -----------------------
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def _lineas_ndjson(lotes):
+    """Convierte cada lote columnar del cursor sin búfer en un trozo de NDJSON conforme va llegando."""
+    for lote in lotes:
+        yield filas_ndjson(lote)
+
+async def _respuesta_filas(request: Request, filas, headers=None) -> RespuestaFilas:
+    """Serializa el ConjuntoFilas a bytes JSON en el executor (no en el event loop)."""
+    cuerpo = await ejecutar(filas_json, filas, request=request)
+    return RespuestaFilas(cuerpo, headers=headers)
+
+def _codificar_cursor(llave) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(llave), default=valor_json).encode()).decode().rstrip("=")
+
+def _decodificar_cursor(cursor: str | None):
+    if not cursor:
+        return None
+    try:
+        llave = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        # (fecha, último) o, en recibos, (fecha, último, repetidas): la llave no es única
+        if len(llave) == 3:
+            fecha, ultimo, repetidas = llave
+            return fecha, ultimo, int(repetidas)
+        fecha, ultimo = llave
+        return fecha, ultimo
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def _encabezado_cursor(siguiente) -> dict:
+    return {"X-Cursor-Siguiente": _codificar_cursor(siguiente)} if siguiente else {}
+
+# -----------------------
+# GET condicional (ETag por versión del rango)
+# -----------------------
+async def _version(request: Request, tabla, desde, hasta, contribuyente=None):
+    return await ejecutar(obtener_versiones().version, tabla, desde, hasta, contribuyente, request=request)
+
+async def _condicional(request: Request, tabla, desde, hasta, contribuyente, representacion):
+    """
+    (encabezados de caché, True si el cliente ya tiene esa versión y basta un 304). Si hay que
+    leer el rango, antes se revisa que quepa en el presupuesto de filas (413 si no).
+    """
+    version = await _version(request, tabla, desde, hasta, contribuyente)
+    igual = no_modificado(request.headers, version, representacion)
+    if not igual:
+        admision.obtener_control().verificar_filas(version.filas, "json", _alternativas(tabla, desde, hasta, contribuyente))
+    return version.encabezados(representacion, max_age_cerrado()), igual
+
+def _alternativas(tabla, desde, hasta, contribuyente=None, tipo=None) -> list[str]:
+    """Rutas que sí sirven para un rango que excede el presupuesto de filas."""
+    consulta = urlencode({"desde": desde, "hasta": hasta, **({"contribuyente": contribuyente} if contribuyente else {})})
+    alternativas = []
+    if tabla == "conciliacion":
+        # ndjson y paginación aceptan contribuyente; no hay CSV
+        alternativas += [f"GET /cedulas/conciliacion?{consulta}&formato=ndjson", f"GET /cedulas/conciliacion?{consulta}&limit=5000"]
+    else:
+        if not contribuyente:
+            alternativas += [f"GET /{tabla}?{consulta}&formato=ndjson", f"GET /{tabla}?{consulta}&limit=5000"]
+        alternativas.append(f"GET /{tabla}/csv?{consulta}")
+    alternativas.append(f"POST /reportes?tipo={tipo or tabla + '_excel'}&{consulta}")
+    return alternativas
+
+
+@app.exception_handler(PoolAgotado)
+async def pool_agotado(request: Request, exc: PoolAgotado):
+    return JSONResponse(status_code=503, content={"detail": "Servidor ocupado, intente de nuevo"}, headers={"Retry-After": "5"})
+
+@app.exception_handler(RenderSaturado)
+async def render_saturado(request: Request, exc: RenderSaturado):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "10"})
+
+@app.exception_handler(PresupuestoExcedido)
+async def presupuesto_excedido(request: Request, exc: PresupuestoExcedido):
+    return JSONResponse(status_code=413, content={
+        "detail": str(exc), "filas": exc.filas, "maximo": exc.maximo, "alternativas": exc.alternativas,
+    })
+
+@app.exception_handler(TiempoAgotado)
+async def tiempo_agotado(request: Request, exc: TiempoAgotado):
+    return JSONResponse(status_code=504, content={"detail": "La consulta tardó demasiado, reduzca el intervalo"})
+
+@app.exception_handler(ClienteDesconectado)
+async def cliente_desconectado(request: Request, exc: ClienteDesconectado):
+    # Nadie leerá la respuesta; 499 sólo queda en los logs
+    return Response(status_code=499)
+
+@app.on_event("startup")
+def precargar_logo():
+    # El logo se descarga una vez en segundo plano; los PDFs nunca esperan a la red
+    obtener_logo(LOGO_URL).precargar()
+
+@app.on_event("startup")
+def precargar_indices():
+    # Los índices se llenan en segundo plano; mientras tanto los filtros usan LIKE
+    obtener_indice("recibos").precargar()
+    obtener_indice("cedulas").precargar()
+
+@app.on_event("startup")
+def iniciar_rollup():
+    rollup.iniciar_actualizador()
+
+@app.on_event("startup")
+def iniciar_snapshot():
+    snapshot.iniciar_actualizador()
+
+@app.on_event("startup")
+def precalentar_exportacion():
+    # reportlab y openpyxl se importan en segundo plano; PRECALENTAR_EXPORTACION=0 los deja para el primer reporte
+    if os.getenv("PRECALENTAR_EXPORTACION", "1") != "0":
+        precalentar_en_fondo(float(os.getenv("PRECALENTAR_ESPERA", "2")))
+
+@app.on_event("startup")
+def iniciar_render():
+    pool_render = obtener_pool_render()
+    if pool_render is not None:
+        pool_render.precalentar()
+
+@app.on_event("shutdown")
+def cerrar_pool():
+    pool_render = obtener_pool_render()
+    if pool_render is not None:
+        pool_render.cerrar()
+    _cola_reportes().cerrar()
+    cerrar_executor()
+    obtener_pool().cerrar()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metricasPrometheus():
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/perfiles/{id}", response_class=PlainTextResponse)
+async def perfilPeticion(id: str):
+    perfil = metricas.obtener_perfil(id)
+    if perfil is None:
+        raise HTTPException(status_code=404, detail="Perfil inexistente (PERFILADOR=1 y encabezado X-Perfilar: 1)")
+    return PlainTextResponse(perfil)
+
+@app.get("/pool")
+async def estadisticasPool():
+    return obtener_pool().estadisticas()
+
+def _estadisticas_render():
+    pool_render = obtener_pool_render()
+    return pool_render.estadisticas() if pool_render is not None else {"workers": 0}
+
+@app.get("/render")
+async def estadisticasRender():
+    return _estadisticas_render()
+
+@app.get("/admision")
+async def estadisticasAdmision():
+    return admision.obtener_control().estadisticas()
+
+@app.get("/snapshot")
+async def estadisticasSnapshot():
+    return snapshot.obtener_snapshot().estadisticas()
+
+@app.get("/cache/agregados")
+async def estadisticasCacheAgregados():
+    return obtener_cache().estadisticas()
+
+@app.post("/cache/agregados/invalidar")
+async def invalidarCacheAgregados(
+    desde: str | None = Query(None, description="Primer día a descartar (yymmdd); vacío = todos"),
+    hasta: str | None = Query(None, description="Último día a descartar (yymmdd)")
+):
+    obtener_cache().invalidar(desde, hasta)
+    obtener_versiones().invalidar()
+    return obtener_cache().estadisticas()
+
 @app.get("/recibos/totales/despliegue")
 async def obtenerSumaTotalesDespliegue(
+    request: Request,
     desde: str = Query(..., description="Fecha de inicio (yymmdd)"),
     hasta: str = Query(..., description="Fecha de fin (yymmdd)")
 ):
-    totales = obtenerDespliegueTotales(desde, hasta)
+    totales = await ejecutar(obtenerDespliegueTotales, desde, hasta, request=request)
     return totales
     
 @app.get("/recibos/totales")
 async def obtenerSumaTotalesYDescuentos(
+    request: Request,
     desde: str = Query(..., description="Fecha de inicio (yymmdd)"),
     hasta: str = Query(..., description="Fecha de fin (yymmdd)"),
     contribuyente: str = Query(None, description="(Opcional) Filtro por contribuyente")
 ):
-    totales = obtenerTotalesYDescuentos(desde, hasta, contribuyente)
+    totales = await ejecutar(obtenerTotalesYDescuentos, desde, hasta, contribuyente, request=request)
     return totales
 
+# -----------------------
+# Tablero: varias consultas en una petición y una conexión
+# -----------------------
+class ConsultaTablero(BaseModel):
+    tipo: Literal["totales", "despliegue", "hoy"]
+    desde: str | None = None
+    hasta: str | None = None
+    contribuyente: str | None = None
+
+async def _tablero(request: Request, consultas: dict):
+    try:
+        normalizadas = normalizar_consultas(consultas)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    return await ejecutar(resolver_tablero, normalizadas, request=request)
+
+@app.post("/tablero")
+async def tableroConsultas(
+    request: Request,
+    consultas: dict[str, ConsultaTablero] = Body(..., description="{nombre: {tipo, desde, hasta, contribuyente}}")
+):
+    return await _tablero(request, {nombre: c.model_dump() for nombre, c in consultas.items()})
+
+@app.get("/tablero")
+async def tableroDelDia(
+    request: Request,
+    desde: str = Query(..., description="Fecha de inicio (yymmdd)"),
+    hasta: str = Query(..., description="Fecha de fin (yymmdd)"),
+    contribuyente: str = Query(None, description="(Opcional) Filtro por contribuyente para los totales")
+):
+    """Lo que pide el front en cada refresco: totales y despliegue del rango y los recibos de hoy."""
+    return await _tablero(request, {
+        "totales": {"tipo": "totales", "desde": desde, "hasta": hasta, "contribuyente": contribuyente},
+        "despliegue": {"tipo": "despliegue", "desde": desde, "hasta": hasta},
+        "hoy": {"tipo": "hoy"},
+    })
+
+# -----------------------
+# Analítica: series por periodo con comparación
+# -----------------------
+@app.get("/recibos/analitica")
+async def analiticaRecaudacion(
+    request: Request,
+    desde: str = Query(..., description="Fecha de inicio (yymmdd)"),
+    hasta: str = Query(..., description="Fecha de fin (yymmdd)"),
+    periodo: str = Query("dia", description=f"Agrupación temporal: {', '.join(PERIODOS)}"),
+    por: str = Query(None, description=f"(Opcional) Agrupar además por: {', '.join(GRUPOS)}"),
+    comparar: str = Query("anterior", description=f"Comparación: {', '.join(COMPARACIONES)}"),
+    contribuyente: str = Query(None, description="(Opcional) Filtro por contribuyente")
+):
+    """Sumas, conteos y tasa de cancelación por periodo, con el periodo de comparación en la misma consulta."""
+    try:
+        return await ejecutar(analitica, desde, hasta, periodo, por, comparar, contribuyente, request=request)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
 @app.get("/recibos/filtrar")
 async def buscarRecibosContribuyenteIntervalo(
+    request: Request,
     desde: str = Query(...),
     hasta: str = Query(...),
     contribuyente: str = Query(...)
 ):
-    recibos = obtenerRecibosConIntervaloYContribuyente(desde, hasta, contribuyente)
+    headers, igual = await _condicional(request, "recibos", desde, hasta, contribuyente, "json")
+    if igual:
+        return Response(status_code=304, headers=headers)
+    recibos = await ejecutar(obtenerRecibos, desde, hasta, contribuyente, request=request)
     if recibos:
-        return recibos
+        return await _respuesta_filas(request, recibos, headers=headers)
     raise HTTPException(status_code=404, detail="No se encontraron recibos con ese contribuyente en ese intervalo")
 
 @app.get("/recibos")
 async def buscarRecibosIntervalo(
+    request: Request,
     desde: str = Query(..., description="Fecha de inicio del intervalo (yymmdd)"),
-    hasta: str = Query(..., description="Fecha de fin del intervalo (yymmdd)")
+    hasta: str = Query(..., description="Fecha de fin del intervalo (yymmdd)"),
+    formato: str = Query("json", pattern="^(json|ndjson)$", description="json | ndjson (streaming, una línea por recibo)"),
+    limit: int | None = Query(None, ge=1, le=5000, description="Tamaño de página; el cursor siguiente viene en X-Cursor-Siguiente"),
+    cursor: str | None = Query(None, description="Cursor opaco devuelto por la página anterior"),
 ):
-    recibos = obtenerRecibosConIntervalo(desde, hasta)
+    if formato == "ndjson":
+        lotes = lotesRecibos(desde, hasta, despues_de=_decodificar_cursor(cursor), tam_lote=500)
+        return StreamingResponse(_lineas_ndjson(lotes), media_type=NDJSON_MEDIA_TYPE)
+
+    if limit:
+        recibos, siguiente = await ejecutar(obtenerRecibosPagina, desde, hasta, limit, _decodificar_cursor(cursor), request=request)
+        if recibos or cursor:
+            return await _respuesta_filas(request, recibos, headers=_encabezado_cursor(siguiente))
+        raise HTTPException(status_code=404, detail="No se encontraron recibos en ese intervalo")
+
+    headers, igual = await _condicional(request, "recibos", desde, hasta, None, "json")
+    if igual:
+        return Response(status_code=304, headers=headers)
+    recibos = await ejecutar(obtenerRecibos, desde, hasta, request=request)
     if recibos:
-        return recibos
+        return await _respuesta_filas(request, recibos, headers=headers)
     raise HTTPException(status_code=404, detail="No se encontraron recibos en ese intervalo")
 
 @app.get("/recibos/hoy")
-async def buscarRecibosHoy():
-    ofertas = obtenerRecibosHoy()
+async def buscarRecibosHoy(
+    request: Request,
+    since: int | None = Query(None, ge=0, description="Último id_recibo que ya tiene el cliente; sólo se devuelven los posteriores"),
+):
+    if since is not None:
+        # Sondeo incremental: lista vacía (no 404) si no hay nada nuevo; la marca siguiente va en X-Ultimo-Recibo
+        nuevos = await ejecutar(obtenerRecibosHoyNuevos, since, request=request)
+        ultimo = str(ultimoId(nuevos) if nuevos else since)
+        return await _respuesta_filas(request, nuevos, headers={"X-Ultimo-Recibo": ultimo})
+
+    ofertas = await ejecutar(obtenerRecibosHoy, request=request)
     if ofertas:
         return ofertas
     raise HTTPException(status_code=404, detail="No se encontraron ofertas")
 
+@app.get("/recibos/hoy/stream")
+async def streamRecibosHoy(
+    request: Request,
+    since: int | None = Query(None, ge=0, description="Último id_recibo que ya tiene el cliente"),
+):
+    """Server-Sent Events con los recibos nuevos de hoy; al reconectar se usa Last-Event-ID."""
+    desde = since
+    ultimo_evento = request.headers.get("last-event-id")
+    if ultimo_evento:
+        try:
+            desde = int(ultimo_evento)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID debe ser un id_recibo numérico")
+    return StreamingResponse(
+        obtener_feed().suscribir(desde),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/recibos/hoy/stream/estadisticas")
+async def estadisticasStreamRecibos():
+    return obtener_feed().estadisticas()
+
+@app.get("/contribuyentes/buscar")
+async def buscarContribuyentes(
+    q: str = Query(..., min_length=1, description="Texto a buscar (sin distinguir acentos ni mayúsculas)"),
+    tipo: str = Query("recibos", pattern="^(recibos|cedulas)$", description="recibos | cedulas"),
+    limite: int = Query(20, ge=1, le=200),
+):
+    return await ejecutar(obtener_indice(tipo).sugerencias, q, limite)
+
 #CEDULAS
 
 @app.get("/cedulas")
 async def buscarCedulasIntervalo(
+    request: Request,
     desde: str = Query(..., description="Fecha de inicio del intervalo (yymmdd)"),
-    hasta: str = Query(..., description="Fecha de fin del intervalo (yymmdd)")
+    hasta: str = Query(..., description="Fecha de fin del intervalo (yymmdd)"),
+    formato: str = Query("json", pattern="^(json|ndjson)$", description="json | ndjson (streaming, una línea por cédula)"),
+    limit: int | None = Query(None, ge=1, le=5000, description="Tamaño de página; el cursor siguiente viene en X-Cursor-Siguiente"),
+    cursor: str | None = Query(None, description="Cursor opaco devuelto por la página anterior"),
 ):
-    cedulas = obtenerCedulasConIntervalo(desde, hasta)
+    if formato == "ndjson":
+        lotes = lotesCedulas(desde, hasta, despues_de=_decodificar_cursor(cursor), tam_lote=500)
+        return StreamingResponse(_lineas_ndjson(lotes), media_type=NDJSON_MEDIA_TYPE)
+
+    if limit:
+        cedulas, siguiente = await ejecutar(obtenerCedulasPagina, desde, hasta, limit, _decodificar_cursor(cursor), request=request)
+        if cedulas or cursor:
+            return await _respuesta_filas(request, cedulas, headers=_encabezado_cursor(siguiente))
+        raise HTTPException(status_code=404, detail="No se encontraron cedulas en ese intervalo")
+
+    headers, igual = await _condicional(request, "cedulas", desde, hasta, None, "json")
+    if igual:
+        return Response(status_code=304, headers=headers)
+    cedulas = await ejecutar(obtenerCedulas, desde, hasta, request=request)
     if cedulas:
-        return cedulas
+        return await _respuesta_filas(request, cedulas, headers=headers)
     raise HTTPException(status_code=404, detail="No se encontraron cedulas en ese intervalo")
 
 @app.get("/cedulas/filtrar")
 async def buscarCedulasContribuyenteIntervalo(
+    request: Request,
     desde: str = Query(...),
     hasta: str = Query(...),
     contribuyente: str = Query(...)
 ):
-    recibos = obtenerCedulasConIntervaloYContribuyente(desde, hasta, contribuyente)
-    if recibos:
-        return recibos
+    headers, igual = await _condicional(request, "cedulas", desde, hasta, contribuyente, "json")
+    if igual:
+        return Response(status_code=304, headers=headers)
+    cedulas = await ejecutar(obtenerCedulas, desde, hasta, contribuyente, request=request)
+    if cedulas:
+        return await _respuesta_filas(request, cedulas, headers=headers)
     raise HTTPException(status_code=404, detail="No se encontraron recibos con ese contribuyente en ese intervalo")
 
+@app.get("/cedulas/conciliacion")
+async def conciliacionCedulas(
+    request: Request,
+    desde: str = Query(..., description="Fecha de inicio del intervalo de cédulas (yymmdd)"),
+    hasta: str = Query(..., description="Fecha de fin del intervalo de cédulas (yymmdd)"),
+    contribuyente: str | None = Query(None, description="(Opcional) Filtro por contribuyente"),
+    categoria: str | None = Query(None, description=f"(Opcional) Sólo el detalle de: {', '.join(CATEGORIAS_CONCILIACION)}"),
+    formato: str = Query("json", pattern="^(json|ndjson)$", description="json | ndjson (detalle en streaming, una línea por cédula)"),
+    limit: int | None = Query(None, ge=1, le=5000, description="Tamaño de página del detalle; el cursor siguiente viene en X-Cursor-Siguiente"),
+    cursor: str | None = Query(None, description="Cursor opaco devuelto por la página anterior"),
+):
+    """
+    Cada cédula contra el recibo de tesorería al que apunta (recibo_teso = id_recibo, en MySQL):
+    pagada, sin_pagar, cancelada, diferencia_monto o recibo_inexistente. Sin `limit` ni ndjson
+    devuelve sólo los totales por categoría; el PDF/Excel está en /cedulas/conciliacion/reporte y /excel.
+    """
+    if categoria is not None and categoria not in CATEGORIAS_CONCILIACION:
+        raise HTTPException(status_code=422, detail=f"categoria debe ser una de {', '.join(CATEGORIAS_CONCILIACION)}")
+    contribuyente = (contribuyente or "").strip() or None
+
+    if formato == "ndjson":
+        lotes = lotesConciliacion(desde, hasta, contribuyente, categoria, despues_de=_decodificar_cursor(cursor), tam_lote=500)
+        return StreamingResponse(_lineas_ndjson(lotes), media_type=NDJSON_MEDIA_TYPE)
+
+    if limit:
+        filas, siguiente = await ejecutar(obtenerConciliacionPagina, desde, hasta, limit, _decodificar_cursor(cursor),
+                                          contribuyente, categoria, request=request)
+        if filas or cursor:
+            return await _respuesta_filas(request, filas, headers=_encabezado_cursor(siguiente))
+        raise HTTPException(status_code=404, detail="No se encontraron cedulas en ese intervalo")
+
+    resumen = await ejecutar(resumenConciliacion, desde, hasta, contribuyente, request=request)
+    if not resumen["totales"]["cedulas"]:
+        raise HTTPException(status_code=404, detail="No se encontraron cedulas en ese intervalo")
+    return {"desde": desde, "hasta": hasta, "contribuyente": contribuyente, **resumen}
+
 
 # -----------------------
-# Endpoint: Recibos -> PDF
+# CSV en streaming (exportacion.py)
 # -----------------------
+def _exportar_csv(tipo, desde, hasta, contribuyente, columnas, gzip):
+    exportacion = EXPORTACIONES[tipo]
+    try:
+        exportacion.validar(columnas)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    # "?contribuyente=" o sólo espacios: sin filtro, como en los reportes
+    contribuyente = (contribuyente or "").strip() or None
+    nombre = f"{tipo}_{desde}_{hasta}.csv" + (".gz" if gzip else "")
+    return StreamingResponse(
+        exportacion.lineas(desde, hasta, contribuyente, columnas, comprimir=gzip),
+        media_type="application/gzip" if gzip else "text/csv; charset=utf-8",
+        headers=_attachment_headers(nombre),
+    )
 
-@app.get("/recibos/reporte")
-async def reporte_recibos(
-    desde: str = Query(..., description="Fecha inicio (yymmdd)"),
-    hasta: str = Query(..., description="Fecha fin (yymmdd)"),
-    contribuyente: str | None = Query(default=None, description="Filtro opcional por contribuyente"),
+@app.get("/recibos/csv")
+async def exportarRecibosCSV(
+    desde: str = Query(..., description="Fecha de inicio (yymmdd)"),
+    hasta: str = Query(..., description="Fecha de fin (yymmdd)"),
+    contribuyente: str | None = Query(None, description="(Opcional) Filtro por contribuyente"),
+    gzip: bool = Query(False, description="Descargar comprimido (.csv.gz)"),
 ):
-    # 1) Traer datos
-    if contribuyente and contribuyente.strip():
-        data = obtenerRecibosConIntervaloYContribuyente(desde, hasta, contribuyente.strip())
-    else:
-        data = obtenerRecibosConIntervalo(desde, hasta)
+    return _exportar_csv("recibos", desde, hasta, contribuyente, [], gzip)
+
+@app.get("/cedulas/csv")
+async def exportarCedulasCSV(
+    desde: str = Query(..., description="Fecha de inicio (yymmdd)"),
+    hasta: str = Query(..., description="Fecha de fin (yymmdd)"),
+    contribuyente: str | None = Query(None, description="(Opcional) Filtro por contribuyente"),
+    columnas: list[str] = Query([], description="Columnas derivadas a agregar: importe"),
+    gzip: bool = Query(False, description="Descargar comprimido (.csv.gz)"),
+):
+    return _exportar_csv("cedulas", desde, hasta, contribuyente, columnas, gzip)
 
-    # 2) Ordenar por fecha desc (por si algún día cambia el SQL)
+
+# -----------------------
+# Reportes (definidos en plantillas.py)
+# -----------------------
+# tipo -> (generador, archivo temporal para el endpoint directo, plantilla)
+REPORTES = {}
+# Sin compilar: la plantilla se compila (e importa reportlab) con el primer reporte o al precalentar
+for _nombre, _plantilla in PLANTILLAS.items():
+    REPORTES[f"{_nombre}_pdf"] = (partial(generar_pdf, _plantilla), archivo_temporal, _plantilla)
+    REPORTES[f"{_nombre}_excel"] = (partial(generar_excel, _plantilla), excel_temporal, _plantilla)
+
+def _cola_reportes():
+    return obtener_cola({tipo: generador for tipo, (generador, _, _) in REPORTES.items()})
+
+# Gauges de /metrics: se leen de las mismas estadísticas que /pool, /render, /cache/agregados y /reportes
+metricas.registrar_colector("db_pool", lambda: obtener_pool().estadisticas())
+metricas.registrar_colector("render", _estadisticas_render)
+metricas.registrar_colector("cache_agregados", lambda: obtener_cache().estadisticas())
+metricas.registrar_colector("reportes", lambda: _cola_reportes().estadisticas())
+metricas.registrar_colector("feed_recibos", lambda: obtener_feed().estadisticas())
+metricas.registrar_colector("versiones", lambda: obtener_versiones().estadisticas())
+metricas.registrar_colector("cache_reportes", lambda: obtener_cache_render().estadisticas())
+metricas.registrar_colector("snapshot", lambda: snapshot.obtener_snapshot().estadisticas())
+metricas.registrar_colector("admision", lambda: admision.obtener_control().estadisticas())
+
+async def _reporte_directo(request: Request, tipo, desde, hasta, contribuyente):
+    """
+    Genera el reporte dentro de la petición y lo envía en trozos (rangos chicos). Responde 304
+    si el cliente ya tiene esa versión; los de rangos cerrados se guardan en disco por versión.
+    """
+    generador, temporal, plantilla = REPORTES[tipo]
+    contribuyente = (contribuyente or "").strip() or None
+    version = await _version(request, plantilla.tabla, desde, hasta, contribuyente if plantilla.por_contribuyente else None)
+    headers = version.encabezados(tipo, max_age_cerrado())
+    if no_modificado(request.headers, version, tipo):
+        return Response(status_code=304, headers=headers)
+
+    parametros = {"desde": desde, "hasta": hasta, "contribuyente": contribuyente}
+    # Lo que ya está en la caché de archivos se sirve aunque exceda el presupuesto de filas
+    if not plantilla.agrupada and not (version.cerrado and obtener_cache_render().existe(tipo, parametros, version)):
+        admision.obtener_control().verificar_filas(
+            version.filas, "pdf" if tipo.endswith("_pdf") else "excel",
+            _alternativas(plantilla.tabla, desde, hasta, contribuyente, tipo=tipo),
+        )
+
+    if version.cerrado:
+        try:
+            ruta, meta = await ejecutar(
+                obtener_cache_render().obtener, tipo, parametros, version,
+                lambda salida: generador(salida, None, desde, hasta, contribuyente), request=request
+            )
+        except SinDatos as exc:
+            raise HTTPException(status_code=404, detail=str(exc))
+        return FileResponse(ruta, media_type=meta["media_type"], headers={**_attachment_headers(meta["nombre"]), **headers})
+
+    salida = temporal()
     try:
-        data.sort(key=lambda r: int(r.get("fecha", 0)), reverse=True)
-    except Exception:
-        pass
-
-    # 3) Armar filas: Recibo | Fecha | Contribuyente | Concepto | Neto | Descuento
-    headers = ["Recibo", "Fecha", "Contribuyente", "Concepto", "Neto", "Descuento", "% Desc.", "Forma Pago"]
-    rows = []
-    total_neto = 0.0
-    total_desc = 0.0
-    for r in data:
-        neto = float(r.get("neto", 0) or 0)
-        desc = float(r.get("descuento", 0) or 0)
-        porcentaje_desc = f"{r.get("porcentaje_descuento", 0)}%"
-        forma_pago = r.get("forma_pago", "N/A")
-        total_neto += neto
-        total_desc += desc
-        rows.append([
-            r.get("recibo", ""),
-            yymmdd_to_human(str(r.get("fecha", ""))),
-            r.get("contribuyente", ""),
-            r.get("concepto", ""),
-            f"${neto:,.2f}",
-            f"${desc:,.2f}",
-            porcentaje_desc,
-            forma_pago
-        ])
-
-    # 4) Fila de totales (si hay datos)
-    if rows:
-        rows.append([
-            "", "", "", "Totales:",
-            f"${total_neto:,.2f}",
-            f"${total_desc:,.2f}",
-        ])
-
-    title = "Reporte de Recibos"
-    rango = f"{yymmdd_to_human(desde)} a {yymmdd_to_human(hasta)}"
-    sub = f"Rango: {rango}" + (f" — Contribuyente: {contribuyente.strip()}" if contribuyente else "")
-
-    # Col widths sugeridos (A4 landscape)
-    col_widths = [
-        22*mm,  # Recibo
-        22*mm,  # Fecha
-        55*mm,  # Contribuyente
-        65*mm,  # Concepto
-        25*mm,  # Neto
-        25*mm,  # Descuento
-    ]
-
-    # Alinear Neto/Descuento a la derecha y poner la última fila (totales) en bold
-    last_row_index = len(rows)  # en la tabla real será +1 por el header
-    extra_styles = [
-        ("ALIGN", (4,1), (5,-1), "RIGHT"),
-        ("FONTNAME", (0,last_row_index), (-1,last_row_index), "Helvetica-Bold"),
-        ("BACKGROUND", (0,last_row_index), (-1,last_row_index), colors.HexColor("#BC955C")), # Fondo Dorado para totales
-        ("TEXTCOLOR", (0,last_row_index), (-1,last_row_index), colors.white), # Texto blanco para que resalte
-    ]
-
-    pdf_bytes = build_pdf_advanced(
-        title, sub, headers, rows,
-        col_widths=col_widths,
-        landscape_mode=True,
-        extra_styles=extra_styles
-    )
+        fname, media_type = await ejecutar(generador, salida, None, desde, hasta, contribuyente, request=request)
+    except SinDatos as exc:
+        salida.close()
+        raise HTTPException(status_code=404, detail=str(exc))
+    except BaseException:
+        salida.close()
+        raise
+    return StreamingResponse(iterar_archivo(salida), media_type=media_type, headers={**_attachment_headers(fname), **headers})
 
-    fname = f"recibos_{desde}-{hasta}" + (f"_{contribuyente.strip().upper().replace(' ', '_')}" if contribuyente else "") + ".pdf"
-    return StreamingResponse(BytesIO(pdf_bytes), media_type="application/pdf", headers=_attachment_headers(fname))
 
-@app.get("/recibos/excel")
-async def reporte_recibos_excel(
-    desde: str = Query(..., description="Fecha inicio (yymmdd)"),
-    hasta: str = Query(..., description="Fecha fin (yymmdd)"),
-    contribuyente: str | None = Query(default=None, description="Filtro opcional por contribuyente"),
-):
-    # 1) Reutilizamos tu lógica de obtención de datos
-    if contribuyente and contribuyente.strip():
-        data = obtenerRecibosConIntervaloYContribuyente(desde, hasta, contribuyente.strip())
-    else:
-        data = obtenerRecibosConIntervalo(desde, hasta)
-
-    if not data:
-        raise HTTPException(status_code=404, detail="No hay datos para exportar")
-
-    # 2) Formatear los datos para que el Excel se vea "humano"
-    filas_excel = []
-    for r in data:
-        filas_excel.append({
-            "Folio": r.get("recibo"),
-            "Fecha": yymmdd_to_human(str(r.get("fecha"))),
-            "Contribuyente": r.get("contribuyente"),
-            "Concepto": r.get("concepto"),
-            "Monto Neto": float(r.get("neto") or 0),
-            "Descuento": float(r.get("descuento") or 0),
-            "% Desc": f"{r.get('porcentaje_descuento')}%",
-            "Forma de Pago": r.get("forma_pago")
-        })
-
-    # 3) Crear el Excel usando Pandas
-    df = pd.DataFrame(filas_excel)
-    
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Recibos')
-        
-        # Ajuste básico de ancho de columnas (opcional pero se ve pro)
-        worksheet = writer.sheets['Recibos']
-        for idx, col in enumerate(df.columns):
-            max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-            worksheet.column_dimensions[chr(65 + idx)].width = max_len
-
-    output.seek(0)
-
-    # 4) Nombre del archivo y retorno
-    fname = f"recibos_{desde}_{hasta}.xlsx"
-    return StreamingResponse(
-        output, 
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers=_attachment_headers(fname)
-    )
+# -----------------------
+# Endpoints: reportes directos ({ruta}/reporte y {ruta}/excel por cada plantilla)
+# -----------------------
 
+def _endpoint_reporte(tipo):
+    async def reporte(
+        request: Request,
+        desde: str = Query(..., description="Fecha inicio (yymmdd)"),
+        hasta: str = Query(..., description="Fecha fin (yymmdd)"),
+        contribuyente: str | None = Query(default=None, description="Filtro opcional por contribuyente"),
+    ):
+        return await _reporte_directo(request, tipo, desde, hasta, contribuyente)
+    return reporte
+
+for _nombre, _plantilla in PLANTILLAS.items():
+    app.add_api_route(f"{_plantilla.ruta}/reporte", _endpoint_reporte(f"{_nombre}_pdf"), methods=["GET"],
+                      name=f"reporte_{_nombre}", response_class=StreamingResponse)
+    app.add_api_route(f"{_plantilla.ruta}/excel", _endpoint_reporte(f"{_nombre}_excel"), methods=["GET"],
+                      name=f"reporte_{_nombre}_excel", response_class=StreamingResponse)
+    admision.registrar_ruta(f"{_plantilla.ruta}/reporte", "reporte")
+    admision.registrar_ruta(f"{_plantilla.ruta}/excel", "reporte")
+
+# Rutas que esperan turno (admision.py); /recibos/hoy, totales, tablero, búsquedas y estado nunca esperan
+for _ruta in ("/recibos", "/cedulas", "/recibos/filtrar", "/cedulas/filtrar", "/recibos/analitica", "/cedulas/conciliacion"):
+    admision.registrar_ruta(_ruta, "consulta")
+for _ruta in ("/recibos/csv", "/cedulas/csv"):
+    admision.registrar_ruta(_ruta, "exportacion")
 
 
-# ---- ENDPOINT mejorado: CÉDULAS -> PDF organizado ----
-@app.get("/cedulas/reporte")
-async def reporte_cedulas(
+# -----------------------
+# Endpoints: cola de reportes (rangos grandes)
+# -----------------------
+
+@app.post("/reportes", status_code=202)
+async def encolarReporte(
+    tipo: str = Query(..., description="<plantilla>_pdf | <plantilla>_excel, p. ej. recibos_pdf, cedulas_excel, despliegue_pdf"),
     desde: str = Query(..., description="Fecha inicio (yymmdd)"),
     hasta: str = Query(..., description="Fecha fin (yymmdd)"),
     contribuyente: str | None = Query(default=None, description="Filtro opcional por contribuyente"),
 ):
-    # 1) Trae datos
-    if contribuyente and contribuyente.strip():
-        data = obtenerCedulasConIntervaloYContribuyente(desde, hasta, contribuyente.strip())
-    else:
-        data = obtenerCedulasConIntervalo(desde, hasta)
-
-    # 2) Ordena por fecha desc (por si el SQL cambia)
-    try:
-        data.sort(key=lambda r: int(r.get("fecham", 0)), reverse=True)
-    except Exception:
-        pass
-
-    # 3) Arma filas en el orden: Folio | Fecha | Contribuyente | Motivo | Dirección
-    headers = ["Folio", "Fecha", "Folio Elec.", "Contribuyente", "Motivo", "Dirección", "Importe", "Recibo", "Fecha Recibo"]
-    rows = []
-    for r in data:
-        importe = float(r.get("precio_unitario")) * float(r.get("cantidad"))
-        rows.append([
-            r.get("folio", ""),
-            yymmdd_to_human(str(r.get("fecham", ""))),
-            r.get("folio_electronico"),
-            r.get("contribuyente", ""),
-            r.get("motivo", ""),
-            r.get("direccion", "") or "",
-            f"${importe}",
-            r.get("recibo_teso") if r.get("recibo_teso") != None else "Sin recibo",
-            yymmdd_to_human(str(r.get("fecha_rteso"))) if r.get("recibo_teso") != None else "Sin recibo"
-        ])
-
-    title = "Reporte de Cédulas"
-    rango = f"{yymmdd_to_human(desde)} a {yymmdd_to_human(hasta)}"
-    sub = f"Rango: {rango}" + (f" — Contribuyente: {contribuyente.strip()}" if contribuyente else "")
-
-    # 4) Col widths pensadas para paisaje A4 (ajústalas si lo ves apretado)
-    col_widths = [22*mm, 22*mm, 22*mm, 50*mm, 50*mm, 50*mm, 22*mm, 22*mm, 22*mm]
-
-    pdf_bytes = build_pdf_advanced(title, sub, headers, rows, col_widths=col_widths, landscape_mode=True)
-    fname = f"cedulas_{desde}-{hasta}" + (f"_{contribuyente.strip().upper().replace(' ', '_')}" if contribuyente else "") + ".pdf"
-    return StreamingResponse(BytesIO(pdf_bytes), media_type="application/pdf", headers=_attachment_headers(fname))
\ No newline at end of file
+    if tipo not in REPORTES:
+        raise HTTPException(status_code=422, detail=f"Tipo de reporte desconocido; opciones: {', '.join(sorted(REPORTES))}")
+    parametros = {"desde": desde, "hasta": hasta, "contribuyente": (contribuyente or "").strip() or None}
+    trabajo = _cola_reportes().enviar(tipo, parametros)
+    return JSONResponse(status_code=202, content=trabajo.a_dict(), headers={"Location": f"/reportes/{trabajo.id}"})
+
+@app.get("/reportes")
+async def estadisticasReportes():
+    return _cola_reportes().estadisticas()
+
+@app.get("/reportes/{id}")
+async def estadoReporte(id: str):
+    estado = _cola_reportes().consultar(id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Trabajo inexistente o expirado")
+    return estado
+
+@app.get("/reportes/{id}/archivo")
+async def descargarReporte(id: str):
+    cola = _cola_reportes()
+    encontrado = cola.almacen.archivo(id)
+    if encontrado is None:
+        estado = cola.consultar(id)
+        if estado is None:
+            raise HTTPException(status_code=404, detail="Trabajo inexistente o expirado")
+        if estado["estado"] == "error":
+            raise HTTPException(status_code=422, detail=estado["error"])
+        raise HTTPException(status_code=409, detail=f"El reporte aún no está listo ({estado['estado']})",
+                            headers={"Retry-After": "5"})
+    ruta, meta = encontrado
+    return FileResponse(ruta, media_type=meta["media_type"], headers=_attachment_headers(meta["nombre"]))
\ No newline at end of file
@@ -0,0 +1,324 @@
+"""
+Tiempos por etapa de cada petición (conexión, consulta, fetch, armado de filas, serialización,
+logo, PDF, Excel), como encabezado Server-Timing y como métricas Prometheus en /metrics.
+
+    with etapa("consulta"):
+        cursor.execute(sql, params)
+
+Las etapas se suman a la medición de la petición en curso (un ContextVar que `ejecutar`
+copia a los hilos del executor) y pueden anidarse: el logo queda dentro del PDF. Fuera de
+una petición (cola de reportes, hilos de fondo) se registran con ruta "segundo_plano".
+Las métricas son por proceso: con varios workers de uvicorn cada uno expone las suyas.
+
+Fuera de PROD, PERFILADOR=1 permite pedir un perfil por muestreo de una petición con el
+encabezado `X-Perfilar: 1`; la respuesta trae `X-Perfil: <id>` y las pilas agregadas
+(formato collapsed, para flamegraph.pl / speedscope) quedan en /metrics/perfiles/<id>.
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_BYTES = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+SEGUNDO_PLANO = "segundo_plano"
+
+
+# -----------------------
+# Registro de métricas
+# -----------------------
+def _etiquetas(nombres, valores) -> str:
+    if not nombres:
+        return ""
+    partes = []
+    for n, v in zip(nombres, valores):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{n}="{v}"')
+    return "{" + ",".join(partes) + "}"
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, *valores, n=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + n
+
+    def exponer(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} counter"
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for llave, n in valores:
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, llave)} {n}"
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        # llave -> [conteos por bucket..., suma, total]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, *valores, valor):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exponer(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} histogram"
+        with self._lock:
+            series = sorted((llave, list(serie)) for llave, serie in self._series.items())
+        nombres = self.etiquetas + ("le",)
+        for llave, serie in series:
+            for limite, n in zip(self.buckets, serie):
+                yield f"{self.nombre}_bucket{_etiquetas(nombres, llave + (f'{limite:g}',))} {n}"
+            yield f"{self.nombre}_bucket{_etiquetas(nombres, llave + ('+Inf',))} {serie[-1]}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, llave)} {serie[-2]:.6f}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, llave)} {serie[-1]}"
+
+
+PETICIONES = Contador("http_peticiones_total", "Peticiones atendidas", ("ruta", "metodo", "status"))
+DURACION = Histograma("http_peticion_segundos", "Duración de la petición hasta el último byte", ("ruta", "metodo"))
+ETAPAS = Histograma("etapa_segundos", "Tiempo por etapa dentro de cada petición", ("ruta", "etapa"))
+FILAS = Contador("filas_devueltas_total", "Filas leídas de MySQL", ("ruta",))
+BYTES = Contador("bytes_respuesta_total", "Bytes de cuerpo enviados", ("ruta",))
+TAMANO = Histograma("respuesta_bytes", "Tamaño del cuerpo de la respuesta", ("ruta",), buckets=BUCKETS_BYTES)
+
+_METRICAS = [PETICIONES, DURACION, ETAPAS, FILAS, BYTES, TAMANO]
+_colectores = []
+
+
+def registrar_colector(prefijo, fn):
+    """
+    `fn()` devuelve un dict {nombre: número} (p. ej. estadisticas() del pool) que se expone
+    como gauges `<prefijo>_<nombre>`; los dicts anidados se aplanan con "_".
+    """
+    _colectores.append((prefijo, fn))
+
+
+def _gauges(prefijo, valores):
+    for nombre, valor in valores.items():
+        if isinstance(valor, dict):
+            yield from _gauges(f"{prefijo}_{nombre}", valor)
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            yield f"# TYPE {prefijo}_{nombre} gauge"
+            yield f"{prefijo}_{nombre} {valor}"
+
+
+def exponer() -> str:
+    lineas = []
+    for metrica in _METRICAS:
+        lineas.extend(metrica.exponer())
+    for prefijo, fn in _colectores:
+        try:
+            valores = fn()
+        except Exception:
+            continue
+        lineas.extend(_gauges(prefijo, valores))
+    return "\n".join(lineas) + "\n"
+
+
+# -----------------------
+# Medición de la petición en curso
+# -----------------------
+class Medicion:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+        self.filas = 0
+        self.hilos = {threading.get_ident()}
+        self._lock = threading.Lock()
+
+    def anotar_hilo(self):
+        ident = threading.get_ident()
+        if ident not in self.hilos:
+            with self._lock:
+                self.hilos = self.hilos | {ident}
+
+    def sumar(self, nombre, segundos):
+        with self._lock:
+            self.etapas[nombre] = self.etapas.get(nombre, 0.0) + segundos
+
+    def server_timing(self) -> str:
+        with self._lock:
+            etapas = list(self.etapas.items())
+        partes = [f"{nombre};dur={segundos * 1000:.1f}" for nombre, segundos in etapas]
+        partes.append(f"total;dur={(time.perf_counter() - self.inicio) * 1000:.1f}")
+        return ", ".join(partes)
+
+
+_medicion = contextvars.ContextVar("medicion", default=None)
+
+
+@contextmanager
+def etapa(nombre):
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.anotar_hilo()
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        if medicion is not None:
+            medicion.sumar(nombre, segundos)
+        else:
+            ETAPAS.observar(SEGUNDO_PLANO, nombre, valor=segundos)
+
+
+def contar_filas(n):
+    medicion = _medicion.get()
+    if medicion is not None:
+        with medicion._lock:
+            medicion.filas += n
+    else:
+        FILAS.sumar(SEGUNDO_PLANO, n=n)
+
+
+def en_peticion(fn, *args, **kwargs):
+    """Corre `fn` anotando el hilo en la medición actual (para el perfilador)."""
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.anotar_hilo()
+    return fn(*args, **kwargs)
+
+
+# -----------------------
+# Perfilador por muestreo (sólo fuera de PROD)
+# -----------------------
+PERFILES_MAX = 20
+
+_perfiles = OrderedDict()
+_perfiles_lock = threading.Lock()
+
+
+class Perfilador:
+    """Muestrea cada PERFIL_INTERVALO_MS las pilas de los hilos que trabajan para la petición."""
+
+    def __init__(self, medicion):
+        self.medicion = medicion
+        self.intervalo = float(os.getenv("PERFIL_INTERVALO_MS", "5")) / 1000
+        self.id = uuid.uuid4().hex[:12]
+        self.pilas = {}
+        self.muestras = 0
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, name="perfilador", daemon=True)
+
+    def _muestrear(self):
+        while not self._fin.wait(self.intervalo):
+            marcos = sys._current_frames()
+            for ident in self.medicion.hilos:
+                marco = marcos.get(ident)
+                if marco is None:
+                    continue
+                pila = []
+                while marco is not None:
+                    codigo = marco.f_code
+                    pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{marco.f_lineno})")
+                    marco = marco.f_back
+                llave = ";".join(reversed(pila))
+                self.pilas[llave] = self.pilas.get(llave, 0) + 1
+            self.muestras += 1
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def terminar(self):
+        self._fin.set()
+        self._hilo.join()
+        texto = "\n".join(f"{pila} {n}" for pila, n in sorted(self.pilas.items(), key=lambda p: -p[1]))
+        with _perfiles_lock:
+            _perfiles[self.id] = texto + "\n"
+            while len(_perfiles) > PERFILES_MAX:
+                _perfiles.popitem(last=False)
+
+
+def perfilador_habilitado() -> bool:
+    return os.getenv("PERFILADOR", "0") == "1" and os.getenv("ENV", "DEV") != "PROD"
+
+
+def obtener_perfil(id):
+    with _perfiles_lock:
+        return _perfiles.get(id)
+
+
+# -----------------------
+# Middleware ASGI
+# -----------------------
+class MiddlewareMetricas:
+    """
+    Mide cada petición HTTP: agrega Server-Timing al responder y, al enviar el último byte,
+    registra duración, etapas, filas y bytes por plantilla de ruta (/recibos, no /recibos?desde=...).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        medicion = Medicion()
+        token = _medicion.set(medicion)
+        perfilador = None
+        if (b"x-perfilar", b"1") in scope.get("headers", []) and perfilador_habilitado():
+            perfilador = Perfilador(medicion)
+            perfilador.iniciar()
+
+        estado = {"status": 500, "bytes": 0}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["status"] = mensaje["status"]
+                headers = list(mensaje.get("headers", []))
+                headers.append((b"server-timing", medicion.server_timing().encode("latin-1")))
+                if perfilador is not None:
+                    # El perfil queda listo al enviar el último byte
+                    headers.append((b"x-perfil", perfilador.id.encode()))
+                mensaje = dict(mensaje, headers=headers)
+            elif mensaje["type"] == "http.response.body":
+                estado["bytes"] += len(mensaje.get("body", b""))
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _medicion.reset(token)
+            if perfilador is not None:
+                perfilador.terminar()
+            self._registrar(scope, medicion, estado)
+
+    def _registrar(self, scope, medicion, estado):
+        route = scope.get("route")
+        ruta = getattr(route, "path", None) or "sin_ruta"
+        metodo = scope.get("method", "")
+        PETICIONES.sumar(ruta, metodo, str(estado["status"]))
+        DURACION.observar(ruta, metodo, valor=time.perf_counter() - medicion.inicio)
+        for nombre, segundos in medicion.etapas.items():
+            ETAPAS.observar(ruta, nombre, valor=segundos)
+        if medicion.filas:
+            FILAS.sumar(ruta, n=medicion.filas)
+        BYTES.sumar(ruta, n=estado["bytes"])
+        TAMANO.observar(ruta, valor=estado["bytes"])
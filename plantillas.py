@@ -0,0 +1,326 @@
+"""
+Registro de plantillas de reporte. Cada reporte (recibos, cédulas, despliegue, conciliación) se define una vez:
+de dónde salen sus datos, sus columnas con su formato y ancho, y qué columnas se suman. La
+plantilla se compila al arrancar (encabezados, anchos, estilos de tabla) y la usan igual el
+PDF, el Excel, los endpoints directos y la cola de /reportes.
+
+Para agregar un reporte basta con registrar otra PlantillaReporte; main.py arma sus endpoints
+{ruta}/reporte y {ruta}/excel y lo acepta como tipo en POST /reportes.
+
+reportlab (reportes.py) y openpyxl (excel.py) se importan con el primer PDF/Excel o con
+precalentar_en_fondo() después del arranque, no al importar este módulo: un worker nuevo
+contesta /recibos/hoy sin esperarlos.
+"""
+import threading
+import time
+
+from columnar import ConjuntoFilas
+from database import obtenerRecibos, obtenerCedulas, lotesRecibos, lotesCedulas, obtenerDespliegueTotales, \
+    obtenerConciliacion, lotesConciliacion, yymmdd_to_human, formato_moneda
+from excel import build_excel_streaming
+from render import renderizar_pdf
+from trabajos import SinDatos
+
+# reportlab.lib.units.mm, sin importar reportlab al arrancar
+mm = 72 / 25.4
+
+# -----------------------
+# Formatos (se aplican por columna, una vez por valor distinto)
+# -----------------------
+def _numero(valor):
+    return float(valor or 0)
+
+def _fecha_humana(valor):
+    return yymmdd_to_human(str(valor))
+
+def _porcentaje(valor):
+    return f"{valor}%"
+
+def _o_sin_recibo(recibo):
+    return recibo if recibo is not None else "Sin recibo"
+
+def _fecha_recibo(recibo, fecha):
+    return _fecha_humana(fecha) if recibo is not None else "Sin recibo"
+
+def _vacio(valor):
+    return valor or ""
+
+def _fecha_o_vacio(valor):
+    return _fecha_humana(valor) if valor else ""
+
+ESTADOS_CONCILIACION = {
+    "pagada": "Pagada",
+    "sin_pagar": "Sin pagar",
+    "cancelada": "Recibo cancelado",
+    "diferencia_monto": "Diferencia de monto",
+    "recibo_inexistente": "Recibo inexistente",
+}
+
+def _estado_conciliacion(categoria):
+    return ESTADOS_CONCILIACION.get(categoria, categoria)
+
+def _importe(precio, cantidad):
+    return _numero(precio) * _numero(cantidad)
+
+def _importe_texto(precio, cantidad):
+    return f"${_importe(precio, cantidad)}"
+
+def _entero(valor):
+    return f"{int(valor):,}"
+
+
+_IGUAL = object()
+
+
+class Columna:
+    """
+    Una columna del reporte. `campo` es una columna del ConjuntoFilas o una tupla de columnas
+    (entonces `formato` recibe un valor por cada una). `formato_excel` cambia el formato en el
+    Excel (por defecto el mismo); en_pdf=False la deja sólo en el Excel.
+    """
+
+    def __init__(self, titulo, campo, ancho=None, formato=None, suma=False, formato_suma=formato_moneda,
+                 titulo_excel=None, formato_excel=_IGUAL, en_pdf=True):
+        self.titulo = titulo
+        self.campos = campo if isinstance(campo, tuple) else (campo,)
+        self.ancho = ancho
+        self.formato = formato
+        self.suma = suma
+        self.formato_suma = formato_suma
+        self.titulo_excel = titulo_excel or titulo
+        self.formato_excel = formato if formato_excel is _IGUAL else formato_excel
+        self.en_pdf = en_pdf
+
+    def valores(self, filas, excel=False):
+        formato = self.formato_excel if excel else self.formato
+        if formato is None:
+            return filas[self.campos[0]]
+        if len(self.campos) == 1:
+            return filas.mapear(self.campos[0], formato)
+        return filas.combinar(self.campos, formato)
+
+
+class PlantillaReporte:
+    """
+    `fuente(desde, hasta, contribuyente)` devuelve un ConjuntoFilas con todo el intervalo;
+    `lotes(...)`, si existe, lo entrega por lotes y lo usan el PDF y el Excel en streaming. `tabla` ("recibos" o
+    "cedulas") es de dónde sale la versión del rango para ETag y la caché de archivos;
+    por_contribuyente=False si el reporte ignora ese filtro; agrupada=True si resume el intervalo
+    (no una fila por registro) y no cuenta contra el presupuesto de filas de admision.py.
+    """
+
+    def __init__(self, nombre, titulo, ruta, columnas, fuente, lotes=None, hoja=None, landscape_mode=True,
+                 tabla="recibos", por_contribuyente=True, agrupada=False):
+        self.nombre = nombre
+        self.titulo = titulo
+        self.ruta = ruta
+        self.columnas = columnas
+        self.fuente = fuente
+        self.lotes = lotes
+        self.hoja = hoja or titulo
+        self.landscape_mode = landscape_mode
+        self.tabla = tabla
+        self.por_contribuyente = por_contribuyente
+        self.agrupada = agrupada
+        self.compilada = False
+
+    def compilar(self):
+        pdf = [c for c in self.columnas if c.en_pdf]
+        self.columnas_pdf = pdf
+        self.headers_pdf = [c.titulo for c in pdf]
+        self.headers_excel = [c.titulo_excel for c in self.columnas]
+        anchos = [c.ancho for c in pdf]
+        self.anchos = [a * mm for a in anchos] if all(anchos) else None
+        self.columnas_suma = tuple(i for i, c in enumerate(pdf) if c.suma)
+        self.formatos_suma = {i: pdf[i].formato_suma for i in self.columnas_suma}
+        # Los TableStyle quedan en la caché de reportes (en este proceso y en los workers de render)
+        from reportes import estilos_tabla
+        estilos_tabla(self.columnas_suma)
+        self.compilada = True
+        return self
+
+    def filas_pdf(self, filas):
+        return zip(*(c.valores(filas) for c in self.columnas_pdf))
+
+    def filas_excel(self, filas):
+        return zip(*(c.valores(filas, excel=True) for c in self.columnas))
+
+    def subtitulo(self, desde, hasta, contribuyente):
+        rango = f"{yymmdd_to_human(desde)} a {yymmdd_to_human(hasta)}"
+        return f"Rango: {rango}" + (f" — Contribuyente: {contribuyente}" if contribuyente else "")
+
+    def archivo(self, extension, desde, hasta, contribuyente):
+        if extension == "pdf":
+            sufijo = f"_{contribuyente.upper().replace(' ', '_')}" if contribuyente else ""
+            return f"{self.nombre}_{desde}-{hasta}{sufijo}.pdf"
+        return f"{self.nombre}_{desde}_{hasta}.{extension}"
+
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _contar(filas, avance, cada=500):
+    """Pasa las filas tal cual, reportando cuántas van cada `cada` filas."""
+    if avance is None:
+        yield from filas
+        return
+    n = 0
+    for n, fila in enumerate(filas, start=1):
+        yield fila
+        if n % cada == 0:
+            avance(n)
+    avance(n)
+
+
+def _lotes(plantilla, desde, hasta, contribuyente):
+    if plantilla.lotes is not None:
+        return plantilla.lotes(desde, hasta, contribuyente)
+    return [plantilla.fuente(desde, hasta, contribuyente)]
+
+
+# -----------------------
+# Generadores (síncronos: corren en el executor o en la cola de trabajos)
+# Reciben el archivo de salida y avance(filas, total=None); devuelven (nombre, media_type).
+# -----------------------
+def generar_pdf(plantilla, salida, avance=None, desde=None, hasta=None, contribuyente=None):
+    if not plantilla.compilada:
+        plantilla.compilar()
+    # Lotes del cursor sin búfer (el SQL ya los ordena), formateados conforme llegan: la memoria
+    # del PDF no crece con el intervalo, igual que en el Excel
+    lotes = _lotes(plantilla, desde, hasta, contribuyente)
+    if avance:
+        avance(0)
+    rows = (fila for lote in lotes for fila in plantilla.filas_pdf(lote))
+    renderizar_pdf(
+        salida, f"Reporte de {plantilla.titulo}", plantilla.subtitulo(desde, hasta, contribuyente),
+        plantilla.headers_pdf, _contar(rows, avance),
+        col_widths=plantilla.anchos,
+        landscape_mode=plantilla.landscape_mode,
+        columnas_suma=plantilla.columnas_suma or None,
+        formato_suma=plantilla.formatos_suma,
+    )
+    return plantilla.archivo("pdf", desde, hasta, contribuyente), "application/pdf"
+
+
+def generar_excel(plantilla, salida, avance=None, desde=None, hasta=None, contribuyente=None):
+    if not plantilla.compilada:
+        plantilla.compilar()
+    # Lotes directo del cursor sin búfer: el libro se escribe mientras llegan las filas
+    lotes = _lotes(plantilla, desde, hasta, contribuyente)
+    rows = (fila for lote in lotes for fila in plantilla.filas_excel(lote))
+    if not build_excel_streaming(salida, plantilla.hoja, plantilla.headers_excel, _contar(rows, avance)):
+        raise SinDatos("No hay datos para exportar")
+    return plantilla.archivo("xlsx", desde, hasta, contribuyente), XLSX_MEDIA_TYPE
+
+
+# -----------------------
+# Registro
+# -----------------------
+PLANTILLAS = {}
+
+
+def registrar(plantilla):
+    PLANTILLAS[plantilla.nombre] = plantilla
+    return plantilla
+
+
+def obtener_plantilla(nombre) -> PlantillaReporte:
+    plantilla = PLANTILLAS[nombre]
+    if not plantilla.compilada:
+        plantilla.compilar()
+    return plantilla
+
+
+def compilar_plantillas():
+    for plantilla in PLANTILLAS.values():
+        plantilla.compilar()
+
+
+def precalentar():
+    """Importa reportlab y openpyxl y compila las plantillas (estilos de tabla incluidos)."""
+    import openpyxl  # noqa: F401
+    import reportes  # noqa: F401
+    compilar_plantillas()
+
+
+def precalentar_en_fondo(espera=0.0):
+    """precalentar() en un hilo, `espera` segundos después de llamarse, para no competir con las primeras peticiones."""
+    def trabajo():
+        time.sleep(espera)
+        try:
+            precalentar()
+        except Exception:
+            pass  # Se reintenta solo con el primer reporte
+
+    threading.Thread(target=trabajo, name="precalentar-exportacion", daemon=True).start()
+
+
+COLUMNAS_DESPLIEGUE = ("cuenta", "total_neto", "total_descuento", "cantidad_recibos")
+
+def _despliegue(desde, hasta, contribuyente=None):
+    cuentas = obtenerDespliegueTotales(desde, hasta)
+    return ConjuntoFilas.desde_filas(COLUMNAS_DESPLIEGUE, [tuple(c[k] for k in COLUMNAS_DESPLIEGUE) for c in cuentas])
+
+
+registrar(PlantillaReporte(
+    "recibos", "Recibos", "/recibos",
+    [
+        # Neto y Descuento van sin formato: el motor por bloques lleva el acumulado y los totales
+        Columna("Recibo", "recibo", 22, titulo_excel="Folio"),
+        Columna("Fecha", "fecha", 22, _fecha_humana),
+        Columna("Contribuyente", "contribuyente", 55),
+        Columna("Concepto", "concepto", 65),
+        Columna("Neto", "neto", 25, _numero, suma=True, titulo_excel="Monto Neto"),
+        Columna("Descuento", "descuento", 25, _numero, suma=True),
+        Columna("% Desc.", "porcentaje_descuento", 18, _porcentaje, titulo_excel="% Desc"),
+        Columna("Forma Pago", "forma_pago", 28, titulo_excel="Forma de Pago"),
+    ],
+    fuente=obtenerRecibos, lotes=lotesRecibos,
+))
+
+registrar(PlantillaReporte(
+    "cedulas", "Cédulas", "/cedulas",
+    [
+        Columna("Folio", "folio", 22),
+        Columna("Fecha", "fecham", 22, _fecha_humana),
+        Columna("Folio Elec.", "folio_electronico", 22),
+        Columna("Contribuyente", "contribuyente", 50),
+        Columna("Motivo", "motivo", 50),
+        Columna("Dirección", "direccion", 50, _vacio),
+        Columna("Precio Unitario", "precio_unitario", formato=_numero, en_pdf=False),
+        Columna("Cantidad", "cantidad", formato=_numero, en_pdf=False),
+        Columna("Importe", ("precio_unitario", "cantidad"), 22, _importe_texto, formato_excel=_importe),
+        Columna("Recibo", "recibo_teso", 22, _o_sin_recibo),
+        Columna("Fecha Recibo", ("recibo_teso", "fecha_rteso"), 22, _fecha_recibo),
+    ],
+    fuente=obtenerCedulas, lotes=lotesCedulas, hoja="Cedulas", tabla="cedulas",
+))
+
+registrar(PlantillaReporte(
+    "despliegue", "Despliegue por Cuenta", "/recibos/totales/despliegue",
+    [
+        Columna("Cuenta", "cuenta", 120),
+        Columna("Neto", "total_neto", 45, _numero, suma=True),
+        Columna("Descuento", "total_descuento", 45, _numero, suma=True),
+        Columna("Recibos", "cantidad_recibos", 35, _numero, suma=True, formato_suma=_entero, formato_excel=int),
+    ],
+    fuente=_despliegue, hoja="Despliegue", por_contribuyente=False, agrupada=True,
+))
+
+registrar(PlantillaReporte(
+    "conciliacion", "Conciliación de Cédulas", "/cedulas/conciliacion",
+    [
+        Columna("Folio", "folio", 20),
+        Columna("Fecha", "fecham", 22, _fecha_humana),
+        Columna("Folio Elec.", "folio_electronico", en_pdf=False),
+        Columna("Contribuyente", "contribuyente", 55),
+        Columna("Motivo", "motivo", en_pdf=False),
+        Columna("Importe", "importe", 25, _numero, suma=True),
+        Columna("Recibo", "recibo_teso", 22, _o_sin_recibo),
+        Columna("Fecha Recibo", "fecha_recibo", 22, _fecha_o_vacio),
+        Columna("Neto Recibo", "neto_recibo", 25, _numero, suma=True),
+        Columna("Diferencia", "diferencia", 25, _numero, suma=True),
+        Columna("Estado", "categoria", 35, _estado_conciliacion),
+    ],
+    fuente=obtenerConciliacion, lotes=lotesConciliacion, hoja="Conciliacion", tabla="conciliacion",
+))
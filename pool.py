@@ -0,0 +1,245 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from ejecucion import llamada_actual
+from metricas import etapa
+
+log = logging.getLogger(__name__)
+
+
+class PoolAgotado(Exception):
+    """No se pudo obtener una conexión del pool dentro del tiempo de espera."""
+
+
+class PoolConexiones:
+    """Pool acotado de conexiones MySQL con verificación de salud y reciclado."""
+
+    def __init__(self, fabrica, tamano=10, espera=30.0, max_inactiva=300.0, vida_maxima=3600.0, ping_tras=30.0):
+        self._fabrica = fabrica
+        self.tamano = tamano
+        self.espera = espera
+        self.max_inactiva = max_inactiva
+        self.vida_maxima = vida_maxima
+        self.ping_tras = ping_tras
+
+        # Cada entrada libre es (conexion, creada_en, ultimo_uso)
+        self._libres = queue.LifoQueue()
+        self._cupos = threading.BoundedSemaphore(tamano)
+        self._lock = threading.Lock()
+        self._creadas_en = {}
+
+        self.en_uso = 0
+        self.prestamos = 0
+        self.creadas = 0
+        self.recicladas = 0
+        self.descartadas = 0
+        self.agotamientos = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def _crear(self):
+        conn = self._fabrica()
+        with self._lock:
+            self.creadas += 1
+        return conn, time.monotonic()
+
+    def _cerrar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _tomar_libre(self):
+        """Devuelve una conexión libre y sana, o None si hay que crear una nueva."""
+        while True:
+            try:
+                conn, creada, ultimo_uso = self._libres.get_nowait()
+            except queue.Empty:
+                return None
+
+            ahora = time.monotonic()
+            if ahora - creada > self.vida_maxima or ahora - ultimo_uso > self.max_inactiva:
+                self._cerrar(conn)
+                with self._lock:
+                    self.recicladas += 1
+                continue
+
+            if ahora - ultimo_uso > self.ping_tras:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self._cerrar(conn)
+                    with self._lock:
+                        self.descartadas += 1
+                    continue
+
+            return conn, creada
+
+    def adquirir(self):
+        inicio = time.monotonic()
+        if not self._cupos.acquire(timeout=self.espera):
+            with self._lock:
+                self.agotamientos += 1
+            raise PoolAgotado(f"Sin conexiones disponibles tras {self.espera:g}s")
+        esperado = time.monotonic() - inicio
+
+        try:
+            entrada = self._tomar_libre() or self._crear()
+        except Exception:
+            self._cupos.release()
+            raise
+
+        conn, creada = entrada
+        with self._lock:
+            self._creadas_en[id(conn)] = creada
+            self.en_uso += 1
+            self.prestamos += 1
+            self.espera_total += esperado
+            self.espera_max = max(self.espera_max, esperado)
+        return conn
+
+    def liberar(self, conn, descartar=False):
+        with self._lock:
+            creada = self._creadas_en.pop(id(conn), time.monotonic())
+            self.en_uso -= 1
+            if descartar:
+                self.descartadas += 1
+
+        if descartar:
+            self._cerrar(conn)
+        else:
+            self._libres.put((conn, creada, time.monotonic()))
+        self._cupos.release()
+
+    def cerrar(self):
+        while True:
+            try:
+                conn, _, _ = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._cerrar(conn)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "tamano": self.tamano,
+                "en_uso": self.en_uso,
+                "libres": self._libres.qsize(),
+                "prestamos": self.prestamos,
+                "creadas": self.creadas,
+                "recicladas": self.recicladas,
+                "descartadas": self.descartadas,
+                "agotamientos": self.agotamientos,
+                "espera_promedio_ms": round(self.espera_total / self.prestamos * 1000, 3) if self.prestamos else 0.0,
+                "espera_max_ms": round(self.espera_max * 1000, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool(fabrica=None) -> PoolConexiones:
+    """Crea el pool la primera vez que se usa (las variables de entorno ya están cargadas)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if fabrica is None:
+                    from database import get_connection
+                    fabrica = get_connection
+                _pool = PoolConexiones(
+                    fabrica,
+                    tamano=int(os.getenv("DB_POOL_SIZE", "10")),
+                    espera=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                    max_inactiva=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+                    vida_maxima=float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+                    ping_tras=float(os.getenv("DB_POOL_PING_AFTER", "30")),
+                )
+    return _pool
+
+
+_sabor_servidor = None
+_aviso_tiempo_maximo = False
+
+
+def _sabor(conn) -> str:
+    """"mariadb" o "mysql", según la versión que reporta el servidor; se consulta una vez por proceso."""
+    global _sabor_servidor
+    if _sabor_servidor is None:
+        try:
+            version = conn.get_server_info()
+        except Exception:
+            version = ""
+        _sabor_servidor = "mariadb" if "mariadb" in str(version).lower() else "mysql"
+    return _sabor_servidor
+
+
+def _tiempo_maximo(conn, llamada):
+    """
+    MAX_EXECUTION_TIME de la sesión (sólo afecta a los SELECT): el timeout de la llamada de
+    `ejecutar`, para que MySQL aborte la consulta por su cuenta aunque el KILL QUERY no llegue;
+    fuera de una llamada (lotes en streaming, cola de reportes, rollup, snapshot) el de
+    DB_MAX_EXECUTION_MS_FONDO, sin límite por defecto. En MariaDB la variable es
+    max_statement_time, en segundos. El SET sólo se manda cuando cambia respecto al préstamo
+    anterior de la misma conexión; si el servidor lo rechaza se avisa una vez en el log y la
+    consulta sigue sin límite. DB_MAX_EXECUTION=0 lo desactiva.
+    """
+    global _aviso_tiempo_maximo
+    if os.getenv("DB_MAX_EXECUTION", "1") == "0":
+        return
+    if llamada is not None and llamada.timeout:
+        ms = int(llamada.timeout * 1000)
+    else:
+        ms = int(os.getenv("DB_MAX_EXECUTION_MS_FONDO", "0"))
+    if getattr(conn, "max_execution_ms", None) == ms:
+        return
+    if _sabor(conn) == "mariadb":
+        sql, valor = "SET SESSION max_statement_time = %s", ms / 1000
+    else:
+        sql, valor = "SET SESSION MAX_EXECUTION_TIME = %s", ms
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, (valor,))
+    except Exception as exc:
+        if not _aviso_tiempo_maximo:
+            _aviso_tiempo_maximo = True
+            log.warning("El servidor rechazó %r; las consultas quedan sin tiempo máximo propio: %s", sql, exc)
+    finally:
+        cursor.close()
+    # Aunque falle, no se reintenta en cada préstamo de la misma conexión
+    conn.max_execution_ms = ms
+
+
+@contextmanager
+def conexion():
+    """Presta una conexión del pool: `with conexion() as conn: ...`"""
+    llamada = llamada_actual()
+    pool = obtener_pool()
+    with etapa("conexion"):
+        conn = pool.adquirir()
+    descartar = False
+    try:
+        _tiempo_maximo(conn, llamada)
+        # Si la llamada se cancela (timeout o desconexión), su consulta se aborta en MySQL
+        if llamada is not None:
+            llamada.registrar(conn)
+        try:
+            yield conn
+        finally:
+            if llamada is not None:
+                llamada.olvidar(conn)
+                # Una llamada cancelada pudo recibir un KILL QUERY a medio camino: su conexión
+                # no regresa al pool
+                descartar = llamada.cancelada
+    except BaseException:
+        # La conexión pudo quedar rota o con resultados a medio leer (cursor sin búfer
+        # abandonado): no la regresamos al pool
+        descartar = True
+        raise
+    finally:
+        pool.liberar(conn, descartar=descartar)
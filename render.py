@@ -0,0 +1,233 @@
+"""
+Pool de procesos para generar los PDF. reportlab es Python puro y con hilos todo el render
+comparte el GIL: unos cuantos reportes grandes ocupan un núcleo y frenan a los endpoints JSON.
+Aquí las filas (datos simples ya formateados) se vuelcan por lotes a un archivo temporal que
+lee un proceso worker con reportlab ya importado y calentado; el worker escribe el PDF en otro
+archivo temporal que se copia a la salida por trozos. Ni las filas ni el PDF completos quedan
+en la memoria de ningún proceso.
+
+    RENDER_WORKERS   procesos (0 = render en el mismo hilo, lo normal)
+    RENDER_COLA      renders que pueden esperar además de los que están corriendo
+    RENDER_ESPERA    segundos que se espera un lugar antes de responder 503
+    RENDER_TIMEOUT   segundos que puede tardar un render; después se reinicia el pool (504)
+"""
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturoAgotado
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from database import LOGO_URL
+from ejecucion import TiempoAgotado
+from logo import obtener_logo
+from metricas import etapa
+
+
+def _memoria_max() -> int:
+    # Hasta este tamaño el PDF se queda en memoria; arriba se vuelca a un archivo temporal.
+    # Se lee al generar, no al importar: main carga .env después de importar este módulo
+    return int(os.getenv("PDF_MEMORIA_MAX", str(8 * 1024 * 1024)))
+
+
+class RenderSaturado(Exception):
+    """No hubo lugar en la cola de render dentro de RENDER_ESPERA segundos."""
+
+
+# ---------- lado del worker ----------
+def _calentar():
+    # Se importa reportlab, se compilan las plantillas (estilos de tabla y encabezado) y un
+    # render mínimo carga las fuentes
+    import plantillas
+    import reportes
+    plantillas.compilar_plantillas()
+    reportes.build_pdf_por_bloques(BytesIO(), "", "", ["-"], [["-"]], logo_url=None)
+
+
+def _leer_filas(ruta):
+    """Las filas del archivo que escribió _volcar_filas, un lote a la vez."""
+    with open(ruta, "rb") as archivo:
+        while True:
+            try:
+                lote = pickle.load(archivo)
+            except EOFError:
+                return
+            yield from lote
+
+
+def _renderizar(logo_url, logo, ruta_filas, ruta_pdf, args, kwargs):
+    import reportes
+    if logo_url and logo is not None:
+        obtener_logo(logo_url).instalar(*logo)
+    with open(ruta_pdf, "wb") as salida:
+        reportes.build_pdf_por_bloques(salida, *args, _leer_filas(ruta_filas), logo_url=logo_url, **kwargs)
+
+
+# ---------- lado del servidor ----------
+def _volcar_filas(rows, archivo, tam_lote=2000):
+    """Escribe las filas en lotes de `tam_lote` (pickle por lote): en memoria sólo hay un lote."""
+    lote = []
+    for fila in rows:
+        lote.append(tuple(fila))
+        if len(lote) >= tam_lote:
+            pickle.dump(lote, archivo, pickle.HIGHEST_PROTOCOL)
+            lote = []
+    if lote:
+        pickle.dump(lote, archivo, pickle.HIGHEST_PROTOCOL)
+
+
+def _temporal(sufijo):
+    descriptor, ruta = tempfile.mkstemp(prefix="render_", suffix=sufijo)
+    os.close(descriptor)
+    return ruta
+
+
+class PoolRender:
+    def __init__(self, workers, cola, espera, timeout=300.0):
+        self.workers = workers
+        self.espera = espera
+        self.timeout = timeout
+        self.capacidad = workers + cola
+        self._lugares = threading.BoundedSemaphore(self.capacidad)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.renders = 0
+        self.rechazados = 0
+        self.reinicios = 0
+
+    def _obtener_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: hacer fork de un proceso con hilos (executor, pool de conexiones) no es seguro
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_calentar,
+                )
+            return self._executor
+
+    def _descartar(self, executor, terminar=False):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.reinicios += 1
+        if terminar:
+            # Un worker atorado no sale con shutdown(); ProcessPoolExecutor no expone sus procesos
+            for proceso in list((getattr(executor, "_processes", None) or {}).values()):
+                proceso.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def precalentar(self):
+        """Arranca los procesos en segundo plano para que el primer reporte no pague el arranque."""
+        executor = self._obtener_executor()
+        for _ in range(self.workers):
+            executor.submit(int)
+
+    def renderizar(self, salida, args, rows, kwargs, logo_url):
+        if not self._lugares.acquire(timeout=self.espera):
+            with self._lock:
+                self.rechazados += 1
+            raise RenderSaturado("Demasiados reportes en proceso, intente de nuevo")
+        ruta_filas, ruta_pdf = _temporal(".filas"), _temporal(".pdf")
+        try:
+            with etapa("formato"):
+                with open(ruta_filas, "wb") as archivo:
+                    _volcar_filas(rows, archivo)
+            logo = obtener_logo(logo_url).obtener() if logo_url else None
+            executor = self._obtener_executor()
+            futuro = executor.submit(_renderizar, logo_url, logo, ruta_filas, ruta_pdf, args, kwargs)
+            try:
+                futuro.result(timeout=self.timeout)
+            except FuturoAgotado:
+                self._descartar(executor, terminar=True)
+                raise TiempoAgotado(f"El render del PDF excedió {self.timeout:g}s")
+            except BrokenProcessPool:
+                # Un worker murió (p. ej. sin memoria): el siguiente reporte arranca un pool nuevo
+                self._descartar(executor)
+                raise
+            with open(ruta_pdf, "rb") as pdf:
+                shutil.copyfileobj(pdf, salida, 64 * 1024)
+            with self._lock:
+                self.renders += 1
+        finally:
+            self._lugares.release()
+            for ruta in (ruta_filas, ruta_pdf):
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "capacidad": self.capacidad,
+                "renders": self.renders,
+                "rechazados": self.rechazados,
+                "reinicios": self.reinicios,
+            }
+
+    def cerrar(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool_render():
+    """None si RENDER_WORKERS=0 (render en el hilo que llama)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Apagado por defecto: con pocos núcleos el render en el hilo es igual de rápido y sin copias
+                workers = int(os.getenv("RENDER_WORKERS", "0"))
+                if workers <= 0:
+                    return None
+                _pool = PoolRender(
+                    workers,
+                    cola=int(os.getenv("RENDER_COLA", str(workers * 2))),
+                    espera=float(os.getenv("RENDER_ESPERA", "30")),
+                    timeout=float(os.getenv("RENDER_TIMEOUT", "300")),
+                )
+    return _pool
+
+
+def renderizar_pdf(salida, title, subtitle, headers, rows, logo_url=LOGO_URL, **kwargs):
+    """
+    Igual que reportes.build_pdf_por_bloques, pero en el pool de procesos si está habilitado.
+    `rows` puede ser cualquier iterable: al worker le llega por lotes a través de un archivo temporal.
+    """
+    pool = obtener_pool_render()
+    if pool is None:
+        import reportes
+        # Aquí el formato de las filas ocurre dentro del render
+        with etapa("pdf"):
+            reportes.build_pdf_por_bloques(salida, title, subtitle, headers, rows, logo_url=logo_url, **kwargs)
+        return
+    with etapa("pdf"):
+        pool.renderizar(salida, (title, subtitle, list(headers)), rows, kwargs, logo_url)
+
+
+def archivo_temporal():
+    return tempfile.SpooledTemporaryFile(max_size=_memoria_max())
+
+
+def iterar_archivo(archivo, tam_bloque=64 * 1024):
+    """Envía un archivo ya generado en trozos y lo cierra al terminar."""
+    try:
+        archivo.seek(0)
+        while True:
+            trozo = archivo.read(tam_bloque)
+            if not trozo:
+                break
+            yield trozo
+    finally:
+        archivo.close()
@@ -0,0 +1,356 @@
+import os
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import Image as RLImage
+
+from database import LOGO_URL, formato_moneda
+from logo import obtener_logo
+from metricas import etapa
+
+
+# -----------------------
+# Encabezado institucional y tabla simple
+# -----------------------
+def _make_logo_flowable(url: str, max_w=35*mm, max_h=20*mm):
+    """Toma el logo de la caché en memoria y devuelve un Flowable Image ajustado a un cuadro max_w x max_h."""
+    with etapa("logo"):
+        logo = obtener_logo(url).obtener()
+    if logo is None:
+        return None
+    img_bytes, (iw, ih) = logo
+    scale = min(max_w / iw, max_h / ih)
+    w, h = iw * scale, ih * scale
+    return RLImage(BytesIO(img_bytes), width=w, height=h)
+
+# Definición de colores institucionales
+GOB_GUINDA = colors.HexColor("#691C32")
+GOB_DORADO = colors.HexColor("#BC955C")
+GOB_GRIS_F = colors.HexColor("#F2F2F2")
+
+@lru_cache(maxsize=1)
+def _hoja_estilos():
+    """getSampleStyleSheet() una vez por proceso; los reportes sólo leen de ella."""
+    return getSampleStyleSheet()
+
+@lru_cache(maxsize=1)
+def _estilos_encabezado():
+    """Estilos del encabezado institucional (textos, tabla logo/textos y barras), armados una sola vez."""
+    styles = _hoja_estilos()
+    # Estilos de texto personalizados
+    title_style = ParagraphStyle(
+        "GovTitle", parent=styles["Title"],
+        fontName="Helvetica-Bold", fontSize=16,
+        textColor=GOB_GUINDA, alignment=0 # Alineado a la izquierda
+    )
+    sub_style = ParagraphStyle(
+        "GovSub", parent=styles["Normal"],
+        fontName="Helvetica", fontSize=10,
+        textColor=colors.gray, leading=12
+    )
+    header_tbl_style = TableStyle([
+        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+        ("BOTTOMPADDING", (0,0), (-1,-1), 10),
+    ])
+    # Una línea guinda gruesa con una dorada delgada abajo
+    guinda_style = TableStyle([
+        ('BACKGROUND', (0,0), (-1,-1), GOB_GUINDA),
+        ('LEFTPADDING', (0,0), (-1,-1), 0),
+        ('RIGHTPADDING', (0,0), (-1,-1), 0),
+        ('TOPPADDING', (0,0), (-1,-1), 0),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 0),
+    ])
+    dorada_style = TableStyle([
+        ('BACKGROUND', (0,0), (-1,-1), GOB_DORADO),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 2),
+    ])
+    return title_style, sub_style, header_tbl_style, guinda_style, dorada_style
+
+def _encabezado_institucional(title: str, subtitle: str, ancho: float, logo_url: str | None, styles=None) -> list:
+    """Logo, título, subtítulo y barras guinda/dorada que encabezan todos los reportes."""
+    title_style, sub_style, header_tbl_style, guinda_style, dorada_style = _estilos_encabezado()
+
+    story = []
+
+    # ---------- ENCABEZADO INSTITUCIONAL ----------
+    logo_flow = _make_logo_flowable(logo_url, max_w=40*mm, max_h=25*mm) if logo_url else None
+    
+    # Textos del encabezado
+    header_info = [
+        Paragraph(title.upper(), title_style),
+        Paragraph(subtitle, sub_style),
+        Paragraph(f"Fecha de impresión: {datetime.now().strftime('%d/%m/%Y %H:%M')}", sub_style)
+    ]
+
+    # Tabla de encabezado para alinear logo y textos
+    header_tbl = Table([[logo_flow, header_info]], colWidths=[45*mm, None])
+    header_tbl.setStyle(header_tbl_style)
+    story.append(header_tbl)
+
+    # --- BARRA DECORATIVA (ESTILO GOBIERNO) ---
+    linea_guinda = Table([[""]], colWidths=[ancho])
+    linea_guinda.setStyle(guinda_style)
+    story.append(linea_guinda)
+    story.append(Spacer(1, 2)) # Espacio mínimo entre barras
+    
+    linea_dorada = Table([[""]], colWidths=[ancho])
+    linea_dorada.setStyle(dorada_style)
+    story.append(linea_dorada)
+    story.append(Spacer(1, 8))
+    return story
+
+@lru_cache(maxsize=1)
+def _estilos_tabla_avanzada():
+    styles = _hoja_estilos()
+    cell_style = ParagraphStyle(
+        "cell", parent=styles["Normal"], 
+        fontName="Helvetica", fontSize=8, leading=10
+    )
+    header_style = ParagraphStyle("h", textColor=colors.white, fontSize=9, alignment=1)
+    return cell_style, header_style
+
+def build_pdf_advanced(
+    title: str,
+    subtitle: str,
+    headers: list[str],
+    rows: list[list],
+    col_widths=None,
+    landscape_mode=True,
+    extra_styles=None,
+    logo_url: str | None = LOGO_URL,
+) -> bytes:
+    buf = BytesIO()
+    pagesize = landscape(A4) if landscape_mode else A4
+    doc = SimpleDocTemplate(
+        buf,
+        pagesize=pagesize,
+        leftMargin=12*mm, rightMargin=12*mm,
+        topMargin=10*mm, bottomMargin=10*mm,
+        title=title
+    )
+    
+    styles = _hoja_estilos()
+    cell_style, header_style = _estilos_tabla_avanzada()
+
+    story = _encabezado_institucional(title, subtitle, doc.width, logo_url)
+
+    # ---------- TABLA DE DATOS ----------
+    if not rows:
+        story.append(Paragraph("No se encontraron registros.", styles["Italic"]))
+    else:
+        wrapped_rows = [[Paragraph(str(c) if c else "", cell_style) for c in r] for r in rows]
+        # Headers con fondo guinda y texto blanco
+        header_pars = [Paragraph(f"<b>{h}</b>", header_style) for h in headers]
+        data = [header_pars] + wrapped_rows
+
+        table = Table(data, colWidths=col_widths, repeatRows=1)
+        
+        base_style = [
+            ("BACKGROUND", (0,0), (-1,0), GOB_GUINDA), # Encabezado guinda
+            ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+            ("GRID", (0,0), (-1,-1), 0.1, colors.gray), # Cuadrícula muy fina
+            ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.white, GOB_GRIS_F]), # Alternancia de gris muy tenue
+        ]
+        
+        if extra_styles:
+            base_style.extend(extra_styles)
+            
+        table.setStyle(TableStyle(base_style))
+        story.append(table)
+
+    doc.build(story)
+    return buf.getvalue()
+
+
+def _filas_por_bloque() -> int:
+    # Se lee al generar, no al importar: main carga .env después de importar este módulo
+    return int(os.getenv("PDF_FILAS_POR_BLOQUE", "40"))
+
+CELDA_FUENTE = "Helvetica"
+CELDA_TAMANO = 8
+CELDA_PADDING = 6  # LEFTPADDING + RIGHTPADDING por defecto de Table
+
+
+class _StoryPerezosa(list):
+    """
+    Story que se va llenando desde un generador conforme reportlab consume flowables,
+    para no tener todos los bloques de la tabla en memoria a la vez.
+    doc.build sólo usa len(), [0], del [0] e inserciones al frente.
+    """
+
+    def __init__(self, inicio, fuente):
+        super().__init__(inicio)
+        self._fuente = iter(fuente)
+
+    def _rellenar(self, minimo=2):
+        while list.__len__(self) < minimo:
+            try:
+                self.append(next(self._fuente))
+            except StopIteration:
+                break
+
+    def __len__(self):
+        self._rellenar()
+        return list.__len__(self)
+
+    def __getitem__(self, i):
+        self._rellenar()
+        return list.__getitem__(self, i)
+
+
+def _numerar_pagina(canvas, doc):
+    canvas.saveState()
+    canvas.setFont("Helvetica", 7)
+    canvas.setFillColor(colors.gray)
+    canvas.drawRightString(doc.pagesize[0] - doc.rightMargin, 5*mm, f"Página {doc.page}")
+    canvas.restoreState()
+
+
+def _celda(valor, ancho, cell_style):
+    """Texto plano si cabe en la columna; Paragraph sólo cuando hace falta partir líneas."""
+    texto = str(valor) if valor else ""
+    if ancho is None or stringWidth(texto, CELDA_FUENTE, CELDA_TAMANO) <= ancho - CELDA_PADDING:
+        return texto
+    return Paragraph(texto, cell_style)
+
+
+@lru_cache(maxsize=1)
+def _estilo_celda():
+    return ParagraphStyle(
+        "cell", parent=_hoja_estilos()["Normal"],
+        fontName=CELDA_FUENTE, fontSize=CELDA_TAMANO, leading=10
+    )
+
+
+@lru_cache(maxsize=64)
+def estilos_tabla(columnas_suma=()):
+    """
+    (estilo de cada bloque, estilo del bloque final) para una tabla con esas columnas sumadas.
+    Se arman una vez por combinación; las plantillas los precompilan al arrancar.
+    """
+    base_style = [
+        ("BACKGROUND", (0,0), (-1,0), GOB_GUINDA), # Encabezado guinda
+        ("TEXTCOLOR", (0,0), (-1,0), colors.white),
+        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
+        ("FONTSIZE", (0,0), (-1,0), 9),
+        ("ALIGN", (0,0), (-1,0), "CENTER"),
+        ("FONTNAME", (0,1), (-1,-1), CELDA_FUENTE),
+        ("FONTSIZE", (0,1), (-1,-1), CELDA_TAMANO),
+        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+        ("GRID", (0,0), (-1,-1), 0.1, colors.gray), # Cuadrícula muy fina
+        ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.white, GOB_GRIS_F]),
+    ]
+    for i in columnas_suma:
+        base_style.append(("ALIGN", (i,1), (i,-1), "RIGHT"))
+    estilo_bloque = TableStyle(base_style + [
+        ("FONTNAME", (0,-1), (-1,-1), "Helvetica-Bold"),
+        ("BACKGROUND", (0,-1), (-1,-1), colors.HexColor("#E8DCC8")),
+    ] if columnas_suma else base_style)
+    estilo_final = TableStyle(base_style + [
+        ("FONTNAME", (0,-1), (-1,-1), "Helvetica-Bold"),
+        ("BACKGROUND", (0,-1), (-1,-1), GOB_DORADO), # Fondo Dorado para totales
+        ("TEXTCOLOR", (0,-1), (-1,-1), colors.white),
+    ])
+    return estilo_bloque, estilo_final
+
+
+def _bloques(headers, rows, col_widths, columnas_suma, formato_suma, filas_por_bloque, cell_style):
+    """Genera una Table por bloque de filas, con el acumulado al pie de cada bloque."""
+    anchos = list(col_widths or [])
+    anchos += [None] * (len(headers) - len(anchos))
+    columnas_suma = tuple(columnas_suma or ())
+    acumulados = {i: 0.0 for i in columnas_suma}
+    etiqueta = min(columnas_suma) - 1 if columnas_suma else None
+    # formato_suma puede ser una función para todas las columnas o un dict {columna: función}
+    formatos = formato_suma if isinstance(formato_suma, dict) else {i: formato_suma for i in columnas_suma}
+    estilo_bloque, estilo_final = estilos_tabla(columnas_suma)
+
+    def fila_acumulado(texto):
+        fila = [""] * len(headers)
+        if etiqueta is not None and etiqueta >= 0:
+            fila[etiqueta] = texto
+        for i in columnas_suma:
+            fila[i] = formatos[i](acumulados[i])
+        return fila
+
+    def tabla(filas, estilo):
+        t = Table([list(headers)] + filas, colWidths=col_widths, repeatRows=1)
+        t.setStyle(estilo)
+        return t
+
+    bloque = []
+    hubo_filas = False
+    for r in rows:
+        fila = []
+        for i, valor in enumerate(r):
+            if i in acumulados:
+                numero = float(valor or 0)
+                acumulados[i] += numero
+                fila.append(formatos[i](numero))
+            else:
+                fila.append(_celda(valor, anchos[i] if i < len(anchos) else None, cell_style))
+        bloque.append(fila)
+        if len(bloque) >= filas_por_bloque:
+            hubo_filas = True
+            if columnas_suma:
+                bloque.append(fila_acumulado("Acumulado:"))
+            yield tabla(bloque, estilo_bloque)
+            bloque = []
+
+    if bloque or hubo_filas:
+        if columnas_suma:
+            bloque.append(fila_acumulado("Totales:"))
+            yield tabla(bloque, estilo_final)
+        elif bloque:
+            yield tabla(bloque, estilo_bloque)
+
+
+def build_pdf_por_bloques(
+    salida,
+    title: str,
+    subtitle: str,
+    headers: list[str],
+    rows,
+    col_widths=None,
+    landscape_mode=True,
+    columnas_suma=None,
+    formato_suma=formato_moneda,
+    filas_por_bloque=None,
+    logo_url: str | None = LOGO_URL,
+):
+    """
+    Variante de build_pdf_advanced para rangos grandes: `rows` puede ser un generador y se
+    consume por bloques de `filas_por_bloque` filas (por defecto PDF_FILAS_POR_BLOQUE), cada
+    uno como una tabla independiente con su acumulado. Las columnas en `columnas_suma` deben traer números sin formato;
+    `formato_suma` es una función o un dict {columna: función}.
+    Escribe el PDF en el archivo `salida`.
+    """
+    pagesize = landscape(A4) if landscape_mode else A4
+    doc = SimpleDocTemplate(
+        salida,
+        pagesize=pagesize,
+        leftMargin=12*mm, rightMargin=12*mm,
+        topMargin=10*mm, bottomMargin=10*mm,
+        title=title
+    )
+    styles = _hoja_estilos()
+    encabezado = _encabezado_institucional(title, subtitle, doc.width, logo_url)
+    if filas_por_bloque is None:
+        filas_por_bloque = _filas_por_bloque()
+    bloques = _bloques(headers, rows, col_widths, columnas_suma, formato_suma, filas_por_bloque, _estilo_celda())
+
+    primero = next(bloques, None)
+    if primero is None:
+        encabezado.append(Paragraph("No se encontraron registros.", styles["Italic"]))
+        story = encabezado
+    else:
+        story = _StoryPerezosa(encabezado + [primero], bloques)
+
+    doc.build(story, onFirstPage=_numerar_pagina, onLaterPages=_numerar_pagina)
@@ -0,0 +1,246 @@
+"""
+Tabla resumen de TEARMO01 por día × cuenta × forma de pago × status, mantenida de forma incremental.
+
+    python rollup.py reconstruir   # borra y recalcula todo el resumen
+    python rollup.py actualizar    # aplica los recibos nuevos desde la última marca
+
+La actualización suma los recibos con id_recibo (comparado como número) mayor a la marca guardada
+y recalcula completos los últimos ROLLUP_DIAS_RECALCULO días (para reflejar cancelaciones
+recientes). Los días anteriores a ese tramo quedan "cubiertos": mientras la última actualización
+tenga menos de ROLLUP_MAX_EDAD segundos, los totales de esos días se leen del resumen en lugar de
+recorrer TEARMO01.
+"""
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import pymysql
+
+from pool import conexion
+
+log = logging.getLogger(__name__)
+
+
+TABLA = "RESUMEN_TEARMO01"
+TABLA_ESTADO = "RESUMEN_TEARMO01_ESTADO"
+
+CREAR_TABLAS = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA} (
+        dia CHAR(6) NOT NULL,
+        id_cuenta VARCHAR(64) NOT NULL,
+        id_formapago VARCHAR(64) NOT NULL,
+        id_status INT NOT NULL,
+        suma_neto DECIMAL(18,2) NOT NULL,
+        suma_descuento DECIMAL(18,2) NOT NULL,
+        cantidad INT NOT NULL,
+        PRIMARY KEY (dia, id_cuenta, id_formapago, id_status)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_ESTADO} (
+        id TINYINT NOT NULL PRIMARY KEY,
+        ultimo_recibo VARCHAR(32) NULL,
+        cubierto_hasta CHAR(6) NULL,
+        actualizado DATETIME NULL
+    )
+    """,
+]
+
+_SELECT_AGRUPADO = """
+    SELECT id_fecha, COALESCE(id_cuenta, ''), COALESCE(id_formapago, ''), COALESCE(id_status, -1),
+        COALESCE(SUM(id_neto), 0), COALESCE(SUM(id_descuento), 0), COUNT(*)
+    FROM TEARMO01
+"""
+_GROUP_BY = " GROUP BY id_fecha, COALESCE(id_cuenta, ''), COALESCE(id_formapago, ''), COALESCE(id_status, -1)"
+
+_INSERT = f"""
+    INSERT INTO {TABLA} (dia, id_cuenta, id_formapago, id_status, suma_neto, suma_descuento, cantidad)
+"""
+_SUMAR_EXISTENTES = """
+    ON DUPLICATE KEY UPDATE
+        suma_neto = suma_neto + VALUES(suma_neto),
+        suma_descuento = suma_descuento + VALUES(suma_descuento),
+        cantidad = cantidad + VALUES(cantidad)
+"""
+
+# Evita que varios workers actualicen el resumen al mismo tiempo
+NOMBRE_CANDADO = "resumen_tearmo01"
+
+
+def habilitado() -> bool:
+    return os.getenv("ROLLUP_ENABLED", "0") == "1"
+
+
+def _inicio_recalculo() -> str:
+    dias = int(os.getenv("ROLLUP_DIAS_RECALCULO", "3"))
+    return (datetime.now().date() - timedelta(days=dias - 1)).strftime("%y%m%d")
+
+
+def _con_candado(cursor) -> bool:
+    cursor.execute("SELECT GET_LOCK(%s, 0)", (NOMBRE_CANDADO,))
+    return cursor.fetchone()[0] == 1
+
+
+def _soltar_candado(cursor):
+    cursor.execute("SELECT RELEASE_LOCK(%s)", (NOMBRE_CANDADO,))
+
+
+def crear_tablas():
+    with conexion() as conn:
+        cursor = conn.cursor()
+        for sql in CREAR_TABLAS:
+            cursor.execute(sql)
+
+
+def reconstruir() -> dict:
+    """Recalcula el resumen completo en una sola transacción."""
+    crear_tablas()
+    inicio = _inicio_recalculo()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        if not _con_candado(cursor):
+            return {"actualizado": False, "motivo": "otra actualización en curso"}
+        try:
+            conn.begin()
+            cursor.execute("SELECT MAX(CAST(id_recibo AS UNSIGNED)) FROM TEARMO01")
+            ultimo = cursor.fetchone()[0]
+            cursor.execute(f"DELETE FROM {TABLA}")
+            cursor.execute(_INSERT + _SELECT_AGRUPADO + _GROUP_BY)
+            filas = cursor.rowcount
+            _guardar_estado(cursor, ultimo, inicio)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _soltar_candado(cursor)
+    return {"actualizado": True, "filas_resumen": filas, "ultimo_recibo": ultimo, "cubierto_hasta": inicio}
+
+
+def actualizar() -> dict:
+    """Aplica los recibos nuevos desde la marca y recalcula el tramo reciente."""
+    crear_tablas()
+    inicio = _inicio_recalculo()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT ultimo_recibo FROM {TABLA_ESTADO} WHERE id = 1")
+        estado = cursor.fetchone()
+        if not estado or estado[0] is None:
+            return reconstruir()
+        if not _con_candado(cursor):
+            return {"actualizado": False, "motivo": "otra actualización en curso"}
+        try:
+            conn.begin()
+            cursor.execute("SELECT MAX(CAST(id_recibo AS UNSIGNED)) FROM TEARMO01")
+            ultimo = cursor.fetchone()[0]
+
+            # 1) Recibos nuevos con fecha anterior al tramo reciente (capturas atrasadas)
+            cursor.execute(
+                _INSERT + _SELECT_AGRUPADO
+                + " WHERE CAST(id_recibo AS UNSIGNED) > %s AND CAST(id_recibo AS UNSIGNED) <= %s AND id_fecha < %s"
+                + _GROUP_BY + _SUMAR_EXISTENTES,
+                (int(estado[0]), ultimo, inicio),
+            )
+            nuevas = cursor.rowcount
+
+            # 2) El tramo reciente se recalcula completo: ahí ocurren las cancelaciones
+            cursor.execute(f"DELETE FROM {TABLA} WHERE dia >= %s", (inicio,))
+            cursor.execute(_INSERT + _SELECT_AGRUPADO + " WHERE id_fecha >= %s" + _GROUP_BY, (inicio,))
+            recientes = cursor.rowcount
+
+            _guardar_estado(cursor, ultimo, inicio)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _soltar_candado(cursor)
+    return {"actualizado": True, "filas_nuevas": nuevas, "filas_recientes": recientes,
+            "ultimo_recibo": ultimo, "cubierto_hasta": inicio}
+
+
+def _guardar_estado(cursor, ultimo, cubierto_hasta):
+    cursor.execute(f"""
+        INSERT INTO {TABLA_ESTADO} (id, ultimo_recibo, cubierto_hasta, actualizado)
+        VALUES (1, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE
+            ultimo_recibo = VALUES(ultimo_recibo),
+            cubierto_hasta = VALUES(cubierto_hasta),
+            actualizado = VALUES(actualizado)
+    """, (None if ultimo is None else str(ultimo), cubierto_hasta))
+
+
+def corte_vigente(cursor):
+    """
+    Primer día (yymmdd) que el resumen NO cubre, o None si el resumen está deshabilitado,
+    no existe o su última actualización es más vieja que ROLLUP_MAX_EDAD.
+    """
+    if not habilitado():
+        return None
+    try:
+        cursor.execute(f"""
+            SELECT cubierto_hasta FROM {TABLA_ESTADO}
+            WHERE id = 1 AND actualizado >= NOW() - INTERVAL %s SECOND
+        """, (int(os.getenv("ROLLUP_MAX_EDAD", "900")),))
+        fila = cursor.fetchone()
+    except pymysql.err.MySQLError:
+        return None
+    return fila[0] if fila else None
+
+
+def totales_por_dia(cursor, desde, hasta):
+    cursor.execute(f"""
+        SELECT
+            dia,
+            COALESCE(SUM(CASE WHEN id_status = 0 THEN suma_neto ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN id_status = 0 THEN suma_descuento ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN id_status = 1 THEN cantidad ELSE 0 END), 0)
+        FROM {TABLA}
+        WHERE dia BETWEEN %s AND %s
+        GROUP BY dia
+    """, (desde, hasta))
+    return cursor.fetchall()
+
+
+def despliegue_por_dia(cursor, desde, hasta):
+    cursor.execute(f"""
+        SELECT r.dia, c.id_nombrecuenta, COALESCE(SUM(r.suma_neto), 0), COALESCE(SUM(r.suma_descuento), 0), SUM(r.cantidad)
+        FROM {TABLA} r
+        JOIN TEARCA01 c ON r.id_cuenta = c.id_codigoc
+        WHERE r.dia BETWEEN %s AND %s
+        AND r.id_status = 0
+        GROUP BY r.dia, c.id_nombrecuenta
+    """, (desde, hasta))
+    return cursor.fetchall()
+
+
+def iniciar_actualizador():
+    """Hilo de fondo que llama a actualizar() cada ROLLUP_INTERVALO segundos (0 = sólo por comando)."""
+    intervalo = float(os.getenv("ROLLUP_INTERVALO", "0"))
+    if not habilitado() or intervalo <= 0:
+        return None
+    alto = threading.Event()
+
+    def ciclo():
+        while not alto.wait(intervalo):
+            try:
+                actualizar()
+            except Exception:
+                # Se reintenta en el siguiente ciclo; mientras, los totales caen a TEARMO01
+                log.exception("Falló la actualización del resumen")
+
+    threading.Thread(target=ciclo, name="rollup", daemon=True).start()
+    return alto
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    comandos = {"reconstruir": reconstruir, "actualizar": actualizar}
+    if len(sys.argv) != 2 or sys.argv[1] not in comandos:
+        print(__doc__)
+        sys.exit(2)
+    print(comandos[sys.argv[1]]())
@@ -0,0 +1,76 @@
+import datetime
+import json
+from decimal import Decimal
+
+from starlette.responses import Response
+
+from metricas import etapa
+
+
+def valor_json(valor):
+    # Igual que jsonable_encoder: Decimal entero -> int, con decimales -> float
+    if isinstance(valor, Decimal):
+        return int(valor) if valor.as_tuple().exponent >= 0 else float(valor)
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return valor.isoformat()
+    if isinstance(valor, bytes):
+        return valor.decode("utf-8", "replace")
+    raise TypeError(f"No serializable: {type(valor).__name__}")
+
+
+# Un solo encoder: json.dumps con argumentos arma uno nuevo en cada llamada
+_encoder = json.JSONEncoder(default=valor_json, ensure_ascii=False, separators=(",", ":"))
+
+
+_cadena = json.encoder.encode_basestring
+
+
+def _codificar(valor) -> str:
+    # Atajos para los tipos que traen casi todas las columnas; mismo texto que json.dumps
+    if type(valor) is str:
+        return _cadena(valor)
+    if isinstance(valor, Decimal):
+        return str(int(valor)) if valor.as_tuple().exponent >= 0 else repr(float(valor))
+    return _encoder.encode(valor)
+
+
+def _objetos(filas):
+    """
+    Un objeto JSON (str) por fila. Cada columna se codifica una vez por valor distinto y las
+    filas se arman con una plantilla "%s" fija, sin pasar por dicts ni por jsonable_encoder.
+    Las columnas DECIMAL de MySQL traen la misma escala en todas sus filas, así que memorizar
+    por valor no mezcla 1 y 1.00.
+    """
+    plantilla = "{" + ",".join(_codificar(c).replace("%", "%%") + ":%s" for c in filas.columnas) + "}"
+    codificadas = [filas.mapear(c, _codificar) for c in filas.columnas]
+    return map(plantilla.__mod__, zip(*codificadas))
+
+
+def filas_json(filas) -> bytes:
+    """Arreglo JSON de objetos {columna: valor} directo desde un ConjuntoFilas."""
+    if not filas:
+        return b"[]"
+    with etapa("serializacion"):
+        return ("[" + ",".join(_objetos(filas)) + "]").encode("utf-8")
+
+
+def filas_ndjson(filas) -> bytes:
+    """Un objeto por línea (NDJSON) desde un ConjuntoFilas."""
+    if not filas:
+        return b""
+    with etapa("serializacion"):
+        return ("\n".join(_objetos(filas)) + "\n").encode("utf-8")
+
+
+class RespuestaFilas(Response):
+    """
+    Respuesta JSON para listados grandes. Acepta los bytes ya generados con filas_json
+    (lo normal: se serializa en el executor, no en el event loop) o un ConjuntoFilas.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        return filas_json(content)
@@ -0,0 +1,499 @@
+"""
+Copia local (SQLite) de los meses cerrados de TEARMO01 y TEARMM01 para que las consultas de
+rangos históricos no vayan a MySQL.
+
+    python snapshot.py actualizar            # exporta los meses cerrados que falten
+    python snapshot.py verificar             # compara cada mes con MySQL y reexporta los que cambiaron
+    python snapshot.py reexportar 2501 2502  # vuelve a copiar esos meses (yymm)
+
+Un mes está cerrado cuando terminó hace más de SNAPSHOT_GRACIA_DIAS días (las correcciones
+tardías caen antes de eso; para las que no, `verificar`). El archivo (SNAPSHOT_PATH) tiene las
+mismas columnas que MySQL, índices por fecha y por contribuyente, y una tabla con los meses
+copiados y su firma. Lo comparten de sólo lectura todos los workers: la exportación escribe
+una copia y la reemplaza con os.replace, así que cada consulta ve el archivo completo anterior
+o el nuevo, nunca uno a medias.
+
+database.py parte cada rango en tramos por mes: los meses copiados se leen de aquí y sólo el
+resto (la cola abierta y lo que no se haya exportado) va a MySQL. Los tramos vienen del más
+reciente al más viejo, igual que el ORDER BY ... DESC de las consultas, así que los resultados
+y los cursores de paginación son los mismos. El filtro por contribuyente usa el mismo índice
+de nombres; sólo el LIKE de respaldo compara distinto que MySQL (SQLite no ignora acentos).
+
+La versión de un rango (ETag, condicional.py) se arma igual por tramos: los meses completos
+usan la firma de MySQL guardada al copiarlos, los pedazos de mes se calculan sobre la copia
+local y sólo lo que no está aquí se consulta en MySQL.
+"""
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pymysql
+
+from columnar import ConjuntoFilas
+from metricas import etapa, contar_filas
+from pool import conexion
+
+log = logging.getLogger(__name__)
+
+
+class Tabla:
+    def __init__(self, nombre, fecha, columnas, contribuyente, llave, decimales):
+        self.nombre = nombre
+        self.fecha = fecha
+        self.columnas = columnas
+        self.contribuyente = contribuyente
+        self.llave = llave
+        self.decimales = decimales
+
+    def crear(self) -> list:
+        columnas = ", ".join(f"{c} DECIMAL_TEXT" if c in self.decimales else c for c in self.columnas)
+        return [
+            f"CREATE TABLE IF NOT EXISTS {self.nombre} ({columnas})",
+            f"CREATE INDEX IF NOT EXISTS {self.nombre}_fecha ON {self.nombre} ({self.fecha}, {self.llave})",
+            f"CREATE INDEX IF NOT EXISTS {self.nombre}_contribuyente ON {self.nombre} ({self.contribuyente}, {self.fecha})",
+        ]
+
+
+TABLAS = {
+    "recibos": Tabla(
+        "TEARMO01", "id_fecha",
+        ("id_recibo", "id_fecha", "id_neto", "id_descuento", "id_concepto1", "id_contribuyente", "id_dispo6",
+         "id_formapago"),
+        "id_contribuyente", "id_recibo", ("id_neto", "id_descuento"),
+    ),
+    "cedulas": Tabla(
+        "TEARMM01", "fecham",
+        ("codigo", "motivo", "fecham", "contribuyente", "direccion", "precio_unitario", "cantidad", "recibo_teso",
+         "fecha_rteso"),
+        "contribuyente", "codigo", ("precio_unitario", "cantidad"),
+    ),
+}
+
+CREAR_MESES = """
+    CREATE TABLE IF NOT EXISTS SNAPSHOT_MESES (
+        tabla TEXT NOT NULL,
+        mes TEXT NOT NULL,
+        filas INTEGER NOT NULL,
+        firma TEXT NOT NULL,
+        exportado TEXT NOT NULL,
+        PRIMARY KEY (tabla, mes)
+    )
+"""
+
+# Los DECIMAL se guardan como texto (afinidad TEXT por el nombre) para conservar la escala: 1.50 y no 1.5
+sqlite3.register_converter("DECIMAL_TEXT", lambda valor: Decimal(valor.decode()))
+
+# Evita que varios workers exporten al mismo tiempo
+NOMBRE_CANDADO = "snapshot_tear"
+
+_LEFT = re.compile(r"\bLEFT\((\w+), (\d+)\)")
+
+
+def habilitado() -> bool:
+    return os.getenv("SNAPSHOT_ENABLED", "0") == "1"
+
+
+def ruta() -> str:
+    return os.getenv("SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "snapshot_tear.sqlite"))
+
+
+def _sqlite(sql: str) -> str:
+    """El SQL de database.py en dialecto SQLite: placeholders ? y substr en lugar de LEFT."""
+    return _LEFT.sub(r"substr(\1, 1, \2)", sql).replace("%s", "?")
+
+
+class _BitXor:
+    def __init__(self):
+        self.valor = 0
+
+    def step(self, valor):
+        if valor is not None:
+            self.valor ^= int(valor)
+
+    def finalize(self):
+        return self.valor
+
+
+def _concat_ws(separador, *valores):
+    return separador.join(str(v) for v in valores if v is not None)
+
+
+def _valor(valor):
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+
+# -----------------------
+# Meses
+# -----------------------
+def _mes(dia: date) -> str:
+    return dia.strftime("%y%m")
+
+
+def _limites(mes: str):
+    """(primer día, último día) del mes yymm, en yymmdd."""
+    inicio = datetime.strptime(mes + "01", "%y%m%d").date()
+    siguiente = (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return inicio.strftime("%y%m%d"), (siguiente - timedelta(days=1)).strftime("%y%m%d")
+
+
+def _meses_entre(primero: str, ultimo: str) -> list:
+    meses = []
+    mes = datetime.strptime(primero + "01", "%y%m%d").date()
+    fin = datetime.strptime(ultimo + "01", "%y%m%d").date()
+    while mes <= fin:
+        meses.append(_mes(mes))
+        mes = (mes.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return meses
+
+
+def ultimo_mes_cerrado() -> str:
+    gracia = int(os.getenv("SNAPSHOT_GRACIA_DIAS", "10"))
+    limite = datetime.now().date() - timedelta(days=gracia)
+    # El mes de `limite` todavía puede recibir correcciones; el anterior ya no
+    return _mes(limite.replace(day=1) - timedelta(days=1))
+
+
+# -----------------------
+# Lectura (workers)
+# -----------------------
+class Snapshot:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        # tipo -> {mes: (filas, firma)}
+        self._meses = {}
+        self._firma_archivo = None
+        self.lecturas = 0
+        self.filas = 0
+
+    def _conectar(self):
+        conn = sqlite3.connect(f"file:{self.ruta}?mode=ro", uri=True, detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False)
+        conn.execute("PRAGMA query_only = 1")
+        # Lo que usa la firma de un rango (database._consultaVersion*)
+        conn.create_function("CRC32", 1, lambda texto: None if texto is None else zlib.crc32(str(texto).encode()))
+        conn.create_function("CONCAT_WS", -1, _concat_ws)
+        conn.create_aggregate("BIT_XOR", 1, _BitXor)
+        return conn
+
+    def _copiados(self, tipo) -> dict:
+        """{mes: (filas, firma)} de esa tabla; se vuelve a leer sólo si el archivo cambió."""
+        try:
+            estado = os.stat(self.ruta)
+        except OSError:
+            return {}
+        firma = (estado.st_ino, estado.st_mtime_ns, estado.st_size)
+        with self._lock:
+            if firma != self._firma_archivo:
+                try:
+                    conn = self._conectar()
+                    try:
+                        filas = conn.execute("SELECT tabla, mes, filas, firma FROM SNAPSHOT_MESES").fetchall()
+                    finally:
+                        conn.close()
+                except sqlite3.Error:
+                    filas = []
+                meses = {}
+                for tabla, mes, n, firma_mes in filas:
+                    meses.setdefault(tabla, {})[mes] = (n, firma_mes)
+                self._meses = meses
+                self._firma_archivo = firma
+            return self._meses.get(tipo, {})
+
+    def meses(self, tipo) -> frozenset:
+        """Meses (yymm) copiados de esa tabla."""
+        return frozenset(self._copiados(tipo))
+
+    def firma_meses(self, tipo, desde, hasta):
+        """
+        (filas, firmas...) de los meses completos desde..hasta tal como se guardaron al copiarlos,
+        o None si el tramo empieza o termina a media mes (entonces se calcula con version()).
+        """
+        copiados = self._copiados(tipo)
+        meses = _meses_entre(desde[:4], hasta[:4])
+        if desde != _limites(meses[0])[0] or hasta != _limites(meses[-1])[1] or any(m not in copiados for m in meses):
+            return None
+        return (sum(copiados[m][0] for m in meses),) + tuple(copiados[m][1] for m in meses)
+
+    def version(self, tipo, desde, hasta, filtro="", params_filtro=()) -> tuple:
+        """
+        (cantidad, llave máxima, XOR de CRC32) sobre la copia local, con las columnas que tiene el
+        snapshot: sólo cambia al reexportar, que es cuando cambia lo que se lee de aquí.
+        """
+        tabla = TABLAS[tipo]
+        sql = f"""
+            SELECT COUNT(*), MAX({tabla.llave}),
+                COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', {', '.join(tabla.columnas)}))), 0)
+            FROM {tabla.nombre}
+            WHERE {tabla.fecha} BETWEEN %s AND %s
+        """ + filtro
+        conn = self._conectar()
+        try:
+            with etapa("snapshot"):
+                return tuple(conn.execute(_sqlite(sql), [desde, hasta, *params_filtro]).fetchone())
+        finally:
+            conn.close()
+
+    def tramos(self, tipo, desde, hasta) -> list:
+        """
+        [(local, desde, hasta)] del más reciente al más viejo; local=True son meses que están en
+        el snapshot. Sin snapshot (o con fechas que no son yymmdd) es un solo tramo de MySQL.
+        """
+        todo = [(False, desde, hasta)]
+        meses = self.meses(tipo)
+        if not meses:
+            return todo
+        try:
+            inicio = datetime.strptime(desde, "%y%m%d").date()
+            dia = datetime.strptime(hasta, "%y%m%d").date()
+        except (TypeError, ValueError):
+            return todo
+        if len(desde) != 6 or len(hasta) != 6 or inicio > dia:
+            return todo
+        partes = []
+        while dia >= inicio:
+            primero = max(dia.replace(day=1), inicio)
+            local = _mes(dia) in meses
+            if partes and partes[-1][0] == local:
+                partes[-1][1] = primero.strftime("%y%m%d")
+            else:
+                partes.append([local, primero.strftime("%y%m%d"), dia.strftime("%y%m%d")])
+            dia = primero - timedelta(days=1)
+        return [tuple(p) for p in partes]
+
+    def _contar(self, n):
+        with self._lock:
+            self.lecturas += 1
+            self.filas += n
+
+    def leer(self, sql, params, columnas) -> ConjuntoFilas:
+        conn = self._conectar()
+        try:
+            with etapa("snapshot"):
+                filas = conn.execute(_sqlite(sql), params).fetchall()
+        finally:
+            conn.close()
+        contar_filas(len(filas))
+        self._contar(len(filas))
+        with etapa("armado"):
+            return ConjuntoFilas.desde_filas(columnas, filas)
+
+    def lotes(self, sql, params, columnas, tam_lote):
+        conn = self._conectar()
+        try:
+            with etapa("snapshot"):
+                cursor = conn.execute(_sqlite(sql), params)
+            while True:
+                with etapa("snapshot"):
+                    lote = cursor.fetchmany(tam_lote)
+                if not lote:
+                    break
+                contar_filas(len(lote))
+                self._contar(len(lote))
+                with etapa("armado"):
+                    conjunto = ConjuntoFilas.desde_filas(columnas, lote)
+                yield conjunto
+        finally:
+            conn.close()
+
+    def estadisticas(self) -> dict:
+        cubiertos = {}
+        for tipo in TABLAS:
+            meses = sorted(self.meses(tipo))
+            cubiertos[tipo] = {"meses": len(meses), "primero": meses[0] if meses else None,
+                               "ultimo": meses[-1] if meses else None}
+        with self._lock:
+            return {"habilitado": habilitado(), "lecturas": self.lecturas, "filas": self.filas, **cubiertos}
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def obtener_snapshot() -> Snapshot:
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = Snapshot(ruta())
+    return _snapshot
+
+
+def tramos(tipo, desde, hasta) -> list:
+    if not habilitado():
+        return [(False, desde, hasta)]
+    return obtener_snapshot().tramos(tipo, desde, hasta)
+
+
+# -----------------------
+# Exportación (comando o hilo de fondo)
+# -----------------------
+def _con_candado(cursor) -> bool:
+    cursor.execute("SELECT GET_LOCK(%s, 0)", (NOMBRE_CANDADO,))
+    return cursor.fetchone()[0] == 1
+
+
+def _soltar_candado(cursor):
+    cursor.execute("SELECT RELEASE_LOCK(%s)", (NOMBRE_CANDADO,))
+
+
+def _firma(tipo, mes) -> str:
+    # Siempre contra MySQL: la firma pública del rango ya usaría la del propio snapshot
+    import database
+    return repr(database.versionMySQL(tipo, *_limites(mes)))
+
+
+def _primer_mes(cursor, tabla) -> str | None:
+    desde = os.getenv("SNAPSHOT_DESDE")
+    if desde:
+        return desde
+    cursor.execute(f"SELECT MIN({tabla.fecha}) FROM {tabla.nombre}")
+    fila = cursor.fetchone()
+    return fila[0][:4] if fila and fila[0] else None
+
+
+def _copiar_mes(conn_mysql, local, tipo, mes, tam_lote=5000) -> int:
+    tabla = TABLAS[tipo]
+    inicio, fin = _limites(mes)
+    # La firma se toma antes de copiar: si el mes cambia a media copia, `verificar` lo detecta
+    firma = _firma(tipo, mes)
+    local.execute(f"DELETE FROM {tabla.nombre} WHERE {tabla.fecha} BETWEEN ? AND ?", (inicio, fin))
+    insertar = f"INSERT INTO {tabla.nombre} VALUES ({', '.join('?' * len(tabla.columnas))})"
+    cursor = conn_mysql.cursor(pymysql.cursors.SSCursor)
+    cursor.execute(
+        f"SELECT {', '.join(tabla.columnas)} FROM {tabla.nombre} WHERE {tabla.fecha} BETWEEN %s AND %s",
+        (inicio, fin),
+    )
+    filas = 0
+    try:
+        while True:
+            lote = cursor.fetchmany(tam_lote)
+            if not lote:
+                break
+            local.executemany(insertar, [tuple(map(_valor, fila)) for fila in lote])
+            filas += len(lote)
+    finally:
+        cursor.close()
+    local.execute(
+        "INSERT OR REPLACE INTO SNAPSHOT_MESES (tabla, mes, filas, firma, exportado) VALUES (?, ?, ?, ?, ?)",
+        (tipo, mes, filas, firma, datetime.now().isoformat(timespec="seconds")),
+    )
+    return filas
+
+
+def _exportar(pendientes) -> dict:
+    """Copia los meses {tipo: [yymm]} en un archivo nuevo y lo pone en lugar del actual."""
+    pendientes = {t: m for t, m in pendientes.items() if m}
+    if not pendientes:
+        return {"actualizado": False, "motivo": "sin meses pendientes"}
+    destino = ruta()
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    with conexion() as conn:
+        cursor = conn.cursor()
+        if not _con_candado(cursor):
+            return {"actualizado": False, "motivo": "otra exportación en curso"}
+        try:
+            if os.path.exists(destino):
+                shutil.copyfile(destino, temporal)
+            local = sqlite3.connect(temporal)
+            try:
+                for sql in [CREAR_MESES] + [s for tabla in TABLAS.values() for s in tabla.crear()]:
+                    local.execute(sql)
+                copiados = {}
+                for tipo, meses in pendientes.items():
+                    for mes in meses:
+                        copiados[f"{tipo}:{mes}"] = _copiar_mes(conn, local, tipo, mes)
+                local.commit()
+            finally:
+                local.close()
+            os.replace(temporal, destino)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        finally:
+            _soltar_candado(cursor)
+    return {"actualizado": True, "meses": copiados}
+
+
+def actualizar() -> dict:
+    """Exporta los meses cerrados que todavía no están en el snapshot."""
+    ultimo = ultimo_mes_cerrado()
+    existentes = Snapshot(ruta())
+    pendientes = {}
+    with conexion() as conn:
+        cursor = conn.cursor()
+        for tipo, tabla in TABLAS.items():
+            primero = _primer_mes(cursor, tabla)
+            if primero is None or primero > ultimo:
+                continue
+            copiados = existentes.meses(tipo)
+            pendientes[tipo] = [m for m in _meses_entre(primero, ultimo) if m not in copiados]
+    return _exportar(pendientes)
+
+
+def verificar() -> dict:
+    """Compara la firma guardada de cada mes con la de MySQL y vuelve a copiar los que cambiaron."""
+    if not os.path.exists(ruta()):
+        return actualizar()
+    conn = sqlite3.connect(f"file:{ruta()}?mode=ro", uri=True)
+    try:
+        guardados = conn.execute("SELECT tabla, mes, firma FROM SNAPSHOT_MESES").fetchall()
+    finally:
+        conn.close()
+    cambiados = {}
+    for tipo, mes, firma in guardados:
+        if _firma(tipo, mes) != firma:
+            cambiados.setdefault(tipo, []).append(mes)
+    resultado = _exportar(cambiados)
+    resultado["revisados"] = len(guardados)
+    return resultado
+
+
+def reexportar(*meses) -> dict:
+    return _exportar({tipo: list(meses) for tipo in TABLAS})
+
+
+def iniciar_actualizador():
+    """Hilo de fondo que llama a actualizar() cada SNAPSHOT_INTERVALO segundos (0 = sólo por comando)."""
+    intervalo = float(os.getenv("SNAPSHOT_INTERVALO", "0"))
+    if not habilitado() or intervalo <= 0:
+        return None
+    alto = threading.Event()
+
+    def ciclo():
+        while not alto.wait(intervalo):
+            try:
+                actualizar()
+            except Exception:
+                # MySQL caído, candado, disco lleno...: se reintenta en el siguiente ciclo, pero
+                # que quede en el log, si no el snapshot deja de avanzar sin que nadie lo note
+                log.exception("Falló la actualización del snapshot")
+
+    threading.Thread(target=ciclo, name="snapshot", daemon=True).start()
+    return alto
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    comandos = {"actualizar": actualizar, "verificar": verificar, "reexportar": reexportar}
+    if len(sys.argv) < 2 or sys.argv[1] not in comandos or (sys.argv[1] != "reexportar" and len(sys.argv) != 2):
+        print(__doc__)
+        sys.exit(2)
+    inicio = time.perf_counter()
+    print(comandos[sys.argv[1]](*sys.argv[2:]))
+    print(f"{time.perf_counter() - inicio:.1f}s")
@@ -0,0 +1,136 @@
+"""
+Tablero: varias consultas con nombre (totales, despliegue por cuenta, recibos de hoy) en una
+sola petición y sobre una sola conexión del pool, en lugar de una petición, una conexión y un
+recorrido de TEARMO01 por cada una.
+
+    {"semana": {"tipo": "totales", "desde": "250414", "hasta": "250420"},
+     "semana_perez": {"tipo": "totales", "desde": "250414", "hasta": "250420", "contribuyente": "perez"},
+     "cuentas": {"tipo": "despliegue", "desde": "250401", "hasta": "250420"},
+     "hoy": {"tipo": "hoy"}}
+
+Los totales y despliegues sin contribuyente salen de la caché de agregados por día (sólo van a
+MySQL los días que falten). Los totales con contribuyente se resuelven todos juntos en un solo
+SELECT con agregación condicional: tres SUM(CASE ...) por consulta sobre la unión de los rangos.
+"""
+from datetime import datetime
+
+from agregados import obtener_cache
+from contribuyentes import filtro_contribuyente
+from database import _consultaRecibos, _leer, _normalizarRecibos, COLUMNAS_RECIBO
+from metricas import etapa
+from pool import conexion
+
+
+TIPOS = ("totales", "despliegue", "hoy")
+MAX_CONSULTAS = 20
+
+
+def _fecha(valor, campo, nombre):
+    try:
+        if len(valor or "") != 6:
+            raise ValueError
+        datetime.strptime(valor, "%y%m%d")
+    except ValueError:
+        raise ValueError(f"{nombre}: '{campo}' debe ser una fecha yymmdd")
+    return valor
+
+
+def normalizar_consultas(consultas: dict) -> dict:
+    """Valida las consultas y devuelve {nombre: (tipo, desde, hasta, contribuyente)}; ValueError si algo no cuadra."""
+    if not consultas:
+        raise ValueError("No se pidió ninguna consulta")
+    if len(consultas) > MAX_CONSULTAS:
+        raise ValueError(f"Máximo {MAX_CONSULTAS} consultas por tablero")
+    hoy = datetime.now().strftime("%y%m%d")
+    normalizadas = {}
+    for nombre, consulta in consultas.items():
+        tipo = consulta.get("tipo")
+        if tipo not in TIPOS:
+            raise ValueError(f"{nombre}: tipo debe ser uno de {', '.join(TIPOS)}")
+        contribuyente = (consulta.get("contribuyente") or "").strip() or None
+        if tipo == "hoy":
+            normalizadas[nombre] = (tipo, hoy, hoy, contribuyente)
+            continue
+        desde = _fecha(consulta.get("desde"), "desde", nombre)
+        hasta = _fecha(consulta.get("hasta"), "hasta", nombre)
+        if desde > hasta:
+            raise ValueError(f"{nombre}: 'desde' es posterior a 'hasta'")
+        if tipo == "despliegue" and contribuyente:
+            raise ValueError(f"{nombre}: el despliegue no admite filtro por contribuyente")
+        normalizadas[nombre] = (tipo, desde, hasta, contribuyente)
+    return normalizadas
+
+
+def _unir_rangos(rangos):
+    """Junta los rangos (desde, hasta) que se traslapan para que el WHERE no recorra dos veces los mismos días."""
+    unidos = []
+    for desde, hasta in sorted(rangos):
+        if unidos and desde <= unidos[-1][1]:
+            unidos[-1][1] = max(unidos[-1][1], hasta)
+        else:
+            unidos.append([desde, hasta])
+    return unidos
+
+
+def _totales_condicionales(cursor, consultas):
+    """{(desde, hasta, contribuyente): totales} de todas las consultas en un solo recorrido de TEARMO01."""
+    columnas, params = [], []
+    for desde, hasta, contribuyente in consultas:
+        condicion = "id_fecha BETWEEN %s AND %s"
+        params_condicion = [desde, hasta]
+        if contribuyente:
+            filtro, params_filtro = filtro_contribuyente("recibos", "id_contribuyente", contribuyente)
+            condicion += filtro
+            params_condicion += params_filtro
+        columnas += [
+            f"COALESCE(SUM(CASE WHEN {condicion} AND id_status = 0 THEN id_neto ELSE 0 END), 0)",
+            f"COALESCE(SUM(CASE WHEN {condicion} AND id_status = 0 THEN id_descuento ELSE 0 END), 0)",
+            f"COALESCE(SUM(CASE WHEN {condicion} AND id_status = 1 THEN 1 ELSE 0 END), 0)",
+        ]
+        params += params_condicion * 3
+
+    rangos = _unir_rangos((desde, hasta) for desde, hasta, _ in consultas)
+    where = " OR ".join(["id_fecha BETWEEN %s AND %s"] * len(rangos))
+    params += [fecha for rango in rangos for fecha in rango]
+
+    with etapa("consulta"):
+        cursor.execute(f"SELECT {', '.join(columnas)} FROM TEARMO01 WHERE {where}", params)
+    with etapa("fetch"):
+        fila = cursor.fetchone()
+
+    resultados = {}
+    for i, llave in enumerate(consultas):
+        neto, descuento, cancelados = fila[i * 3:i * 3 + 3]
+        resultados[llave] = {
+            "total_neto": float(neto),
+            "total_descuento": float(descuento),
+            "cantidad_status_1": int(cancelados),
+        }
+    return resultados
+
+
+def resolver_tablero(consultas: dict) -> dict:
+    """Resuelve las consultas ya normalizadas; las repetidas se calculan una sola vez."""
+    resultados = {}
+    cache = obtener_cache()
+    with conexion() as conn:
+        cursor = conn.cursor()
+
+        condicionales = [c for c in dict.fromkeys(consultas.values()) if c[0] == "totales" and c[3]]
+        if condicionales:
+            totales = _totales_condicionales(cursor, [c[1:] for c in condicionales])
+            resultados.update((c, totales[c[1:]]) for c in condicionales)
+
+        for consulta in dict.fromkeys(consultas.values()):
+            tipo, desde, hasta, contribuyente = consulta
+            if consulta in resultados:
+                continue
+            if tipo == "totales":
+                resultados[consulta] = cache.totales(desde, hasta, cursor=cursor)
+            elif tipo == "despliegue":
+                resultados[consulta] = cache.despliegue(desde, hasta, cursor=cursor)
+            else:
+                sql, params = _consultaRecibos(desde, hasta, contribuyente)
+                resultados[consulta] = _normalizarRecibos(_leer(cursor, sql, params, COLUMNAS_RECIBO)).registros()
+
+    return {nombre: resultados[consulta] for nombre, consulta in consultas.items()}
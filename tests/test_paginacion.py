@@ -0,0 +1,64 @@
+"""
+Paginación por llave de /recibos con (fecha, recibo) repetida en el borde de una página.
+Corre contra la base SQLite de benchmarks/sinteticos.py: python -m pytest tests
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "benchmarks")]
+
+import sinteticos  # noqa: E402
+
+
+def _recibo(recibo, fecha, concepto):
+    return (recibo, fecha, "100.00", "0.00", concepto, "JUAN PEREZ", "000000", "EFECTIVO", 0, "1")
+
+
+@pytest.fixture
+def recibos(tmp_path, monkeypatch):
+    monkeypatch.setenv("SNAPSHOT_ENABLED", "0")
+    ruta = str(tmp_path / "recibos.db")
+    conn = sqlite3.connect(ruta)
+    conn.execute(f"CREATE TABLE TEARMO01 {sinteticos.TABLAS['TEARMO01']}")
+    filas = [
+        _recibo("10000", "250102", "A"),
+        _recibo("9999", "250102", "B"),
+        # Tres filas con la misma (fecha, recibo): caen en el borde entre la página 1 y la 2
+        _recibo("9998", "250102", "C"),
+        _recibo("9998", "250102", "D"),
+        _recibo("9998", "250102", "E"),
+        _recibo("9997", "250102", "F"),
+        _recibo("10001", "250101", "G"),
+    ]
+    conn.executemany("INSERT INTO TEARMO01 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", filas)
+    conn.commit()
+    conn.close()
+    sinteticos.instalar(ruta)
+    return [f[4] for f in filas]
+
+
+def _paginar(limite):
+    from database import obtenerRecibosPagina
+    vistos, siguiente = [], None
+    while True:
+        filas, siguiente = obtenerRecibosPagina("250101", "250131", limite, siguiente)
+        vistos += filas["concepto"]
+        if siguiente is None:
+            return vistos
+
+
+@pytest.mark.parametrize("limite", [1, 2, 3, 4, 5])
+def test_llave_repetida_en_el_borde(recibos, limite):
+    # id_recibo como número: 10000 antes que 9999; ninguna de las repetidas se pierde ni se repite
+    assert _paginar(limite) == recibos
+
+
+def test_cursor_en_ndjson_continua_la_pagina(recibos):
+    from database import lotesRecibos, obtenerRecibosPagina
+    pagina, siguiente = obtenerRecibosPagina("250101", "250131", 3)
+    resto = [c for lote in lotesRecibos("250101", "250131", despues_de=siguiente, tam_lote=2) for c in lote["concepto"]]
+    assert list(pagina["concepto"]) + resto == recibos
@@ -0,0 +1,325 @@
+"""
+Cola de trabajos para reportes (PDF/Excel) que tardan más de lo que aguanta un proxy.
+
+    POST /reportes?tipo=...      -> {"id": ..., "estado": "en_cola"}   (202)
+    GET  /reportes/{id}          -> estado y avance (filas procesadas / total si se conoce)
+    GET  /reportes/{id}/archivo  -> el archivo terminado
+
+Dos peticiones con la misma especificación mientras la primera sigue en curso reciben el mismo
+trabajo. Los archivos terminados se guardan en REPORTES_DIR junto con un <id>.json de metadatos
+(así cualquier worker de uvicorn puede servirlos) y se borran REPORTES_TTL segundos después de
+terminar o, del menos usado al más usado, cuando el directorio supera REPORTES_MAX_MB; los que
+siguen en cola o en proceso no se tocan. Un error inesperado va completo al log y el cliente sólo
+ve un mensaje genérico con el id del trabajo.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class SinDatos(Exception):
+    """El reporte no tiene filas; no se genera archivo."""
+
+
+_ID_VALIDO = re.compile(r"^[0-9a-f]{32}$")
+
+
+def llave_especificacion(tipo: str, parametros: dict) -> str:
+    canonica = json.dumps({"tipo": tipo, **parametros}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonica.encode()).hexdigest()
+
+
+class Trabajo:
+    def __init__(self, tipo, parametros, llave):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.parametros = parametros
+        self.llave = llave
+        self.estado = "en_cola"
+        self.filas = 0
+        self.total = None
+        self.creado = time.time()
+        self.iniciado = None
+        self.terminado = None
+        self.error = None
+        self.nombre = None
+        self.media_type = None
+        self.tamano = None
+
+    def avance(self, filas, total=None):
+        self.filas = filas
+        if total is not None:
+            self.total = total
+
+    def a_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "parametros": self.parametros,
+            "estado": self.estado,
+            "filas": self.filas,
+            "total": self.total,
+            "progreso": round(self.filas / self.total, 4) if self.total else None,
+            "creado": self.creado,
+            "iniciado": self.iniciado,
+            "terminado": self.terminado,
+            "error": self.error,
+            "nombre": self.nombre,
+            "media_type": self.media_type,
+            "tamano": self.tamano,
+        }
+
+
+class AlmacenArtefactos:
+    """Directorio con <id>.json (metadatos) y <id>.<ext> (archivo) por trabajo terminado."""
+
+    def __init__(self, directorio, ttl=3600.0, max_bytes=1024 * 1024 * 1024, max_en_proceso=86400.0):
+        self.directorio = directorio
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Un trabajo "en_cola"/"en_proceso" más viejo que esto quedó huérfano (se cayó su worker)
+        self.max_en_proceso = max_en_proceso
+        self._lock = threading.Lock()
+        self.desalojos = 0
+        os.makedirs(directorio, exist_ok=True)
+
+    def _meta(self, id):
+        return os.path.join(self.directorio, f"{id}.json")
+
+    def ruta(self, id, nombre):
+        return os.path.join(self.directorio, id + os.path.splitext(nombre)[1])
+
+    def temporal(self, id):
+        return open(os.path.join(self.directorio, f"{id}.parcial"), "w+b")
+
+    def publicar(self, trabajo, archivo):
+        """Mueve el archivo parcial a su nombre final y escribe los metadatos."""
+        archivo.close()
+        destino = self.ruta(trabajo.id, trabajo.nombre)
+        os.replace(archivo.name, destino)
+        trabajo.tamano = os.path.getsize(destino)
+        self.guardar_meta(trabajo)
+
+    def guardar_meta(self, trabajo):
+        tmp = self._meta(trabajo.id) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(trabajo.a_dict(), f, ensure_ascii=False)
+        os.replace(tmp, self._meta(trabajo.id))
+
+    def leer_meta(self, id):
+        if not _ID_VALIDO.match(id):
+            return None
+        try:
+            with open(self._meta(id), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("terminado") and time.time() - meta["terminado"] > self.ttl:
+            return None
+        return meta
+
+    def archivo(self, id):
+        """Ruta del archivo terminado y sus metadatos, o None si no existe o ya expiró."""
+        meta = self.leer_meta(id)
+        if not meta or meta.get("estado") != "listo":
+            return None
+        ruta = self.ruta(id, meta["nombre"])
+        if not os.path.exists(ruta):
+            return None
+        # El mtime marca el último uso: el desalojo por tamaño empieza por el menos usado
+        os.utime(ruta)
+        return ruta, meta
+
+    def _entradas(self):
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                yield ruta, os.stat(ruta)
+            except OSError:
+                continue
+
+    def _borrar_trabajo(self, id):
+        for nombre in os.listdir(self.directorio):
+            if nombre.startswith(id + "."):
+                try:
+                    os.remove(os.path.join(self.directorio, nombre))
+                except OSError:
+                    pass
+
+    def _expirado(self, id, ahora, st):
+        """
+        Los trabajos en cola o en proceso no expiran (su .json y su .parcial siguen en uso); los
+        terminados, REPORTES_TTL segundos después de `terminado`, igual que en leer_meta. Lo que no
+        tiene metadatos legibles expira por el mtime del archivo.
+        """
+        try:
+            with open(self._meta(id), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return ahora - st.st_mtime > self.ttl
+        if meta.get("estado") in ("en_cola", "en_proceso"):
+            return ahora - (meta.get("creado") or st.st_mtime) > self.max_en_proceso
+        return ahora - (meta.get("terminado") or st.st_mtime) > self.ttl
+
+    def purgar(self):
+        """Borra lo expirado y, si aún se pasa de max_bytes, los archivos terminados menos usados."""
+        with self._lock:
+            ahora = time.time()
+            vivos, revisados = {}, {}
+            for ruta, st in list(self._entradas()):
+                id = os.path.basename(ruta).split(".", 1)[0]
+                if id not in revisados:
+                    revisados[id] = self._expirado(id, ahora, st)
+                    if revisados[id]:
+                        self._borrar_trabajo(id)
+                        self.desalojos += 1
+                if revisados[id]:
+                    continue
+                if not ruta.endswith((".json", ".tmp", ".parcial")):
+                    vivos[id] = (st.st_mtime, st.st_size)
+            total = sum(tam for _, tam in vivos.values())
+            for id, (_, tam) in sorted(vivos.items(), key=lambda item: item[1][0]):
+                if total <= self.max_bytes:
+                    break
+                self._borrar_trabajo(id)
+                self.desalojos += 1
+                total -= tam
+
+    def estadisticas(self) -> dict:
+        archivos, ocupado = 0, 0
+        for ruta, st in self._entradas():
+            if not ruta.endswith((".json", ".tmp", ".parcial")):
+                archivos += 1
+                ocupado += st.st_size
+        return {
+            "directorio": self.directorio,
+            "archivos": archivos,
+            "bytes": ocupado,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "desalojos": self.desalojos,
+        }
+
+
+class ColaTrabajos:
+    """
+    Ejecuta los generadores de reportes en un pool de hilos propio (no compite con el executor
+    de las consultas interactivas). Cada generador recibe (salida, avance, **parametros) y
+    devuelve (nombre_archivo, media_type).
+    """
+
+    def __init__(self, almacen, generadores, workers=2):
+        self.almacen = almacen
+        self.generadores = generadores
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reporte")
+        self._lock = threading.Lock()
+        self._trabajos = {}
+        self._en_curso = {}
+        self.workers = workers
+        self.deduplicados = 0
+
+    def enviar(self, tipo, parametros) -> Trabajo:
+        if tipo not in self.generadores:
+            raise KeyError(tipo)
+        llave = llave_especificacion(tipo, parametros)
+        with self._lock:
+            existente = self._en_curso.get(llave)
+            if existente is not None:
+                self.deduplicados += 1
+                return existente
+            trabajo = Trabajo(tipo, parametros, llave)
+            self._trabajos[trabajo.id] = trabajo
+            self._en_curso[llave] = trabajo
+        self.almacen.guardar_meta(trabajo)
+        self._executor.submit(self._ejecutar, trabajo)
+        return trabajo
+
+    def _ejecutar(self, trabajo):
+        trabajo.estado = "en_proceso"
+        trabajo.iniciado = time.time()
+        self.almacen.guardar_meta(trabajo)
+        salida = self.almacen.temporal(trabajo.id)
+        try:
+            trabajo.nombre, trabajo.media_type = self.generadores[trabajo.tipo](
+                salida, trabajo.avance, **trabajo.parametros
+            )
+            trabajo.estado = "listo"
+            trabajo.terminado = time.time()
+            self.almacen.publicar(trabajo, salida)
+        except Exception as exc:
+            salida.close()
+            try:
+                os.remove(salida.name)
+            except OSError:
+                pass
+            trabajo.estado = "error"
+            if isinstance(exc, SinDatos):
+                trabajo.error = str(exc)
+            else:
+                # El detalle (SQL, mensajes del driver) va al log, no al cliente
+                log.exception("Falló el reporte %s (%s)", trabajo.id, trabajo.tipo)
+                trabajo.error = f"Error interno al generar el reporte; referencia {trabajo.id}"
+            trabajo.terminado = time.time()
+            self.almacen.guardar_meta(trabajo)
+        finally:
+            with self._lock:
+                self._en_curso.pop(trabajo.llave, None)
+            self._olvidar_viejos()
+            self.almacen.purgar()
+
+    def _olvidar_viejos(self):
+        limite = time.time() - self.almacen.ttl
+        with self._lock:
+            for id in [i for i, t in self._trabajos.items() if t.terminado and t.terminado < limite]:
+                del self._trabajos[id]
+
+    def consultar(self, id):
+        """Estado del trabajo: de memoria si lo corre este proceso, si no de sus metadatos en disco."""
+        trabajo = self._trabajos.get(id)
+        if trabajo is not None and trabajo.estado in ("en_cola", "en_proceso"):
+            return trabajo.a_dict()
+        return self.almacen.leer_meta(id)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            estados = {}
+            for t in self._trabajos.values():
+                estados[t.estado] = estados.get(t.estado, 0) + 1
+            return {
+                "workers": self.workers,
+                "en_curso": len(self._en_curso),
+                "deduplicados": self.deduplicados,
+                "trabajos": estados,
+                "almacen": self.almacen.estadisticas(),
+            }
+
+    def cerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_cola = None
+_cola_lock = threading.Lock()
+
+
+def obtener_cola(generadores=None) -> ColaTrabajos:
+    """Crea la cola la primera vez (con los generadores que registra main) y la reutiliza después."""
+    global _cola
+    if _cola is None:
+        with _cola_lock:
+            if _cola is None:
+                almacen = AlmacenArtefactos(
+                    os.getenv("REPORTES_DIR", os.path.join(tempfile.gettempdir(), "reportes")),
+                    ttl=float(os.getenv("REPORTES_TTL", "3600")),
+                    max_bytes=int(float(os.getenv("REPORTES_MAX_MB", "1024")) * 1024 * 1024),
+                )
+                _cola = ColaTrabajos(almacen, generadores or {}, workers=int(os.getenv("REPORTES_WORKERS", "2")))
+    return _cola